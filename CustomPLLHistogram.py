@@ -2,16 +2,116 @@ import TimeTagger
 import numpy as np
 import numba
 import math
-from time import sleep
+import threading
+from time import perf_counter
+
+from pll_kernels import (
+    PHASE_BINS,
+    PHASE_STATS,
+    PLL_STATE_DTYPE,
+    HIST_1,
+    HIST_2,
+    COINC_1,
+    COINC_2,
+    FULL_COINC_1,
+    FULL_COINC_2,
+    N_HISTOGRAMS,
+    POSITION_ORIGIN,
+    ACCIDENTAL_HISTORY,
+    RING_BUFFERS,
+    TAG_DTYPE,
+    make_kernel,
+)
+from histogram_geometry import HistogramGeometry
 
 
 """
 Modified from the example code provided by swabian to generate histgrams from a phased locked clock.
 Andrew Mueller February 2022
 
+The numba kernels this measurement is built from are in pll_kernels.
 """
 
 
+def read_ring(buffer, count):
+    """
+    The last min(count, len(buffer)) entries written to a ring buffer, oldest first.
+    count is the number of entries written since the ring was last read. This is a view
+    into the buffer, unless the ring wrapped around.
+    """
+    size = len(buffer)
+    if count <= size:
+        return buffer[:count]
+    start = count & (size - 1)
+    return np.concatenate((buffer[start:], buffer[:start]))
+
+
+def decode_clocks(offsets, steps, last_lclock):
+    """
+    Clocks and locked clocks from compact storage, given the last locked clock written.
+    The locked clocks are summed back from the end, so a ring that wrapped still decodes.
+    """
+    pclocks = np.empty(len(steps), dtype=np.int64)
+    if len(steps):
+        pclocks[-1] = last_lclock
+        pclocks[:-1] = last_lclock - np.cumsum(steps[:0:-1], dtype=np.int64)[::-1]
+    return pclocks + offsets, pclocks
+
+
+class PLLBuffers:
+    """
+    One set of the arrays the kernels fill between two getData() calls.
+    With a position_dtype, the set uses compact storage (see CustomPLLHistogram).
+    The clock rings hold clock_size entries, size by default, and the rings of every data
+    tag and its diff tag_size entries, size by default.
+    """
+
+    def __init__(
+        self,
+        size,
+        n_hist_bins,
+        n_windows=1,
+        n_offsets=1,
+        position_dtype=None,
+        clock_size=None,
+        tag_size=None,
+    ):
+        if clock_size is None:
+            clock_size = size
+        if tag_size is None:
+            tag_size = size
+        if position_dtype is None:
+            clock_dtype, dec_dtype, diff_dtype = np.int64, np.float64, np.float64
+            position_dtype = np.float64
+        else:
+            clock_dtype, dec_dtype, diff_dtype = np.int32, np.float32, np.int32
+        self.position_dtype = position_dtype
+        self.diff_dtype = diff_dtype
+        self.clock_data = np.zeros((clock_size,), dtype=clock_dtype)
+        # the steps between recorded locked clocks span clock_decimation periods, past
+        # int32 for a few ms, so they stay int64
+        self.lclock_data = np.zeros((clock_size,), dtype=np.int64)
+        self.lclock_data_dec = np.zeros((clock_size,), dtype=dec_dtype)  # decimal component of clock0
+        self.full_coinc_1 = np.zeros((size,), dtype=position_dtype)
+        self.full_coinc_2 = np.zeros((size,), dtype=position_dtype)
+        self.coinc_1 = np.zeros((size,), dtype=position_dtype)
+        self.coinc_2 = np.zeros((size,), dtype=position_dtype)
+        self.allocate_tags(tag_size)
+        self.hist_counts = np.zeros((N_HISTOGRAMS, n_hist_bins), dtype=np.int64)
+        self.window_counts = np.zeros(n_windows, dtype=np.int64)
+        self.accidental_counts = np.zeros(n_offsets, dtype=np.int64)
+
+    def allocate_tags(self, size):
+        """The rings of every data tag and its diff, only written while tags are stored."""
+        self.hist_1_tags_data = np.zeros((size,), dtype=self.position_dtype)
+        self.hist_2_tags_data = np.zeros((size,), dtype=self.position_dtype)
+        self.diff_1_data = np.zeros((size,), dtype=self.diff_dtype)
+        self.diff_2_data = np.zeros((size,), dtype=self.diff_dtype)
+
+    def nbytes(self):
+        return sum(a.nbytes for a in vars(self).values() if isinstance(a, np.ndarray))
+
+
 class CustomPLLHistogram(TimeTagger.CustomMeasurement):
     """
     Example for a single start - multiple stop measurement.
@@ -30,6 +130,24 @@ class CustomPLLHistogram(TimeTagger.CustomMeasurement):
         prop=2e-9,
         n_bins=20000000,
         max_time_walk_arr_len = 10000,
+        parallel=False,
+        n_threads=None,
+        bin_width=1.0,
+        hist_range=(0.0, 250.0),
+        geometry=None,
+        store_tags=False,
+        compact=False,
+        position_dtype=np.uint16,
+        position_resolution=0.01,
+        coincidence_windows=((90.0, 150.0),),
+        accidental_offsets=(-3, -2, -1, 0, 1, 2, 3),
+        acquire_clocks=100,
+        lock_threshold=5.0,
+        lock_clocks=100,
+        discard_unlocked=False,
+        phase_bin_width=1.0,
+        clock_decimation=16,
+        clock_envelope=False,
     ):
         TimeTagger.CustomMeasurement.__init__(self, tagger)
         self.data_channel_1 = data_channel_1
@@ -39,31 +157,114 @@ class CustomPLLHistogram(TimeTagger.CustomMeasurement):
         self.phase = phase
         self.deriv = deriv
         self.prop = prop
-        self.clock0 = 0
-        self.period = 1  # 12227788.110837
-
-        self.prev_raw_1 = 0
-        self.prev_raw_2 = 0
-
-        self.phi_old = 0
-        self.init = 1
-        self.max_bins = n_bins
+        # the buffers are rings of a power of two entries, so the kernels wrap the write
+        # index with a mask. If more arrives between two getData() calls than fits, the
+        # oldest entries are overwritten and counted in self.dropped
+        self.max_bins = 1 << (int(n_bins) - 1).bit_length()
+        # clocks are recorded once every clock_decimation clocks, the first of each
+        # window, or with clock_envelope the two of the lowest and highest phase error in
+        # it. Their rings shrink to match. clock_decimation=1 records every clock
+        self.clock_decimation = int(clock_decimation)
+        self.clock_envelope = bool(clock_envelope) and self.clock_decimation > 1
+        per_window = 2 if self.clock_envelope else 1
+        clock_bins = max(1, math.ceil(int(n_bins) * per_window / self.clock_decimation))
+        self.clock_bins = 1 << (clock_bins - 1).bit_length()
+        self.dropped = dict.fromkeys(RING_BUFFERS, 0)
+        self.oldest_index = dict.fromkeys(RING_BUFFERS, 0)
         self.max_time_walk_arr_len = max_time_walk_arr_len
-        self.cycle = 0
-
-        self.clock_idx = 0
-        self.hist_1_idx = 0
-        self.hist_2_idx = 0
-
-        self.coinc_idx = 0
-        self.full_coinc_idx = 0
-        self.coincidence = 0
-
-        self.error = 0
-        self.old_clock_start = 0
-        self.old_clock = 0
-        self.i = 0
-        self.t_prime_res = 500
+        # place the data tags on several cores. n_threads=None uses numba's default
+        self.parallel = parallel
+        self.n_threads = n_threads
+        # the kernel bins the data tags into fixed histograms. every tag is only kept
+        # when store_tags is set or a consumer asked for them with request_tags()
+        # a HistogramGeometry shared with the GUI, else one of bin_width over hist_range
+        if geometry is None:
+            geometry = HistogramGeometry(bin_width, hist_range)
+        self.geometry = geometry
+        self.bin_width = geometry.bin_width
+        self.hist_range = geometry.hist_range
+        self.n_hist_bins = geometry.n_bins
+        self.hist_bin_edges = geometry.edges
+        self.store_tags = store_tags
+        self.tag_consumers = 0
+        # compact storage: positions as fixed-point codes of position_resolution ps in
+        # position_dtype, diffs as int32, clocks as int32 offsets to the locked clock and
+        # locked clocks as int64 steps. getData() still returns ps, rounded to within half
+        # a position_resolution. uint16 with 0.01 ps covers -256 to 399 ps.
+        self.compact = compact
+        self.position_dtype = position_dtype if compact else None
+        self.position_resolution = position_resolution
+        # center bin coincidences are counted for every (start, end) window in one pass,
+        # or (ch1 start, ch1 end, ch2 start, ch2 end) for different windows per channel.
+        # The first window also fills the coinc arrays and the COINC histograms
+        self.coincidence_windows = np.array(
+            [tuple(w) * 2 if len(w) == 2 else tuple(w) for w in coincidence_windows],
+            dtype=np.float64,
+        )
+        self.n_windows = len(self.coincidence_windows)
+        # (buffer_cycle, buffer_tag_hist) of every window, carried from block to block
+        self.window_state = np.zeros((self.n_windows, 2), dtype=np.float64)
+        # accidentals: center window pairs of a channel 1 tag in period n and a channel 2
+        # tag in period n + k, for every k in accidental_offsets. Offset 0 counts the
+        # same-period pairs by the same rule, so car() compares like with like. The
+        # kernel keeps the minor cycles of the last ACCIDENTAL_HISTORY center window tags
+        # of each channel, as rings with write counts in accidental_idx
+        self.accidental_offsets = np.array(accidental_offsets, dtype=np.float64)
+        self.accidental_history = np.full((2, ACCIDENTAL_HISTORY), -np.inf)
+        self.accidental_idx = np.zeros(2, dtype=np.int64)
+        # the kernel fits period and phase over the first acquire_clocks clocks, then
+        # tracks with the loop filter. It counts as locked once the rms phase error over
+        # about lock_clocks clocks is below lock_threshold ps. getData() sets frame_locked
+        # for frames processed entirely in lock, and returns unlocked frames empty with
+        # discard_unlocked
+        self.discard_unlocked = discard_unlocked
+        self.frame_locked = False
+        # the kernel also keeps statistics of the phase error at every clock, so lock
+        # quality can be followed without the clock arrays. See phase_error()
+        self.phase_bin_edges = phase_bin_width * (np.arange(PHASE_BINS + 1) - PHASE_BINS // 2)
+        self.frame_phase_stats = None
+        self.session_phase_stats = None
+
+        self.state = np.zeros(1, dtype=PLL_STATE_DTYPE)
+        st = self.state[0]
+        st["data_channel_1"] = data_channel_1
+        st["data_channel_2"] = data_channel_2
+        st["clock_channel"] = clock_channel
+        st["mult"] = mult
+        st["phase"] = phase
+        st["deriv"] = deriv
+        st["prop"] = prop
+        st["walk_inv_res"] = 1 / 500
+        st["buffer_mask"] = self.max_bins - 1
+        st["clock_mask"] = self.clock_bins - 1
+        st["clock_decimation"] = self.clock_decimation
+        st["clock_envelope"] = self.clock_envelope
+        st["store_tags"] = store_tags
+        st["hist_start"] = geometry.start
+        st["bin_width"] = geometry.bin_width
+        st["compact"] = compact
+        if compact:
+            st["position_scale"] = 1 / position_resolution
+            st["position_max"] = np.iinfo(position_dtype).max
+        st["acquire_clocks"] = acquire_clocks
+        st["lock_threshold"] = lock_threshold
+        st["lock_clocks"] = lock_clocks
+        st["lock_time"] = -1
+        st["phase_bin_width"] = phase_bin_width
+        self.reset_phase_stats()
+        st["init"] = 1
+        st["period"] = 1  # 12227788.110837
+        # the buffer indices and the coincidence counter as one int64 array, so getData()
+        # reads and resets them in one go while it holds the lock
+        first = PLL_STATE_DTYPE.fields["clock_idx"][1] // 8
+        self.frame_counters = self.state.view(np.int64)[first : first + len(RING_BUFFERS) + 1]
+
+        # process() wakes a waiting getData() once the frame holds enough data
+        self.data_ready = threading.Condition()
+        self.frame_ready = False
+        self.frame_start = None
+        self.wake_clocks = 1
+        self.wake_duration = None
         self.register_channel(channel=data_channel_1)
         self.register_channel(channel=data_channel_2)
         self.register_channel(channel=clock_channel)
@@ -78,84 +279,202 @@ class CustomPLLHistogram(TimeTagger.CustomMeasurement):
         # concurrent process() calls.
         self.stop()
 
-    def getData(self):
+    def getData(self, min_clocks=1, min_duration=None, timeout=None):
+        """
+        Wait until process() has processed at least min_clocks clocks or min_duration
+        seconds of tags, then return everything since the last call. After timeout
+        seconds, an empty frame is returned instead. timeout=None waits forever.
+
+        The lock is only held to swap the two buffer sets: process() carries on in the
+        spare set and the filled one is handed out without copying. The returned arrays
+        are views into it, valid until the next getData() call recycles it.
+
+        frame_locked tells whether the PLL was locked for the whole frame, and
+        phase_error() gives its phase error statistics.
+        """
+        # process() and clear_impl() run under the lock, so everything they read or
+        # replace is only touched while holding it
+        self._lock()
+        # the consumer is done with the set handed out last time
+        self.spare.hist_counts[:] = 0
+        self.spare.window_counts[:] = 0
+        self.spare.accidental_counts[:] = 0
+        self.wake_clocks = min_clocks
+        self.wake_duration = None if min_duration is None else min_duration * 1e12
+        if self.state[0]["frame_clocks"] >= min_clocks:
+            with self.data_ready:
+                self.frame_ready = True
+        self._unlock()
+        with self.data_ready:
+            if not self.data_ready.wait_for(lambda: self.frame_ready, timeout):
+                return self.empty_frame()
+
         # Acquire a lock this instance to guarantee that process() is not running in parallel
         # This ensures to return a consistent data.
+        self._lock()
+        filled = self.active
+        self.active = self.spare
+        self.spare = filled
+
+        counts = self.frame_counters.tolist()
+        self.frame_counters[:] = 0
+        period = self.state[0]["period"]
+        last_lclock = int(self.state[0]["last_lclock"])
+        self.frame_locked = bool(
+            self.state[0]["locked"] and not self.state[0]["unlocked_clocks"]
+        )
+        self.state[0]["unlocked_clocks"] = 0
+        self.state[0]["frame_clocks"] = 0
+        phase_stats = {name: np.copy(self.state[0][name]) for name in PHASE_STATS}
+        self.reset_phase_stats()
+        self.frame_ready = False
+        self.frame_start = None
+        self._unlock()
+
+        self.frame_phase_stats = phase_stats
+        self.session_phase_stats = merge_phase_stats(self.session_phase_stats, phase_stats)
+
+        clock_idx, hist_1_idx, hist_2_idx, coinc_idx, full_coinc_idx, coincidence = counts
+        self.account_overflow(counts)
+        if self.discard_unlocked and not self.frame_locked:
+            return self.empty_frame()
+        clocks = read_ring(filled.clock_data, clock_idx)
+        pclocks = read_ring(filled.lclock_data, clock_idx)
+        if self.compact:
+            clocks, pclocks = decode_clocks(clocks, pclocks, last_lclock)
+        decode = self.decode_positions
+        return (
+            clocks,
+            pclocks,
+            decode(read_ring(filled.hist_1_tags_data, hist_1_idx)),
+            decode(read_ring(filled.hist_2_tags_data, hist_2_idx)),
+            decode(read_ring(filled.coinc_1, coinc_idx)),
+            decode(read_ring(filled.coinc_2, coinc_idx)),
+            decode(read_ring(filled.full_coinc_1, full_coinc_idx)),
+            decode(read_ring(filled.full_coinc_2, full_coinc_idx)),
+            coincidence,
+            read_ring(filled.diff_1_data, hist_1_idx),
+            read_ring(filled.diff_2_data, hist_2_idx),
+            round(period / 50000, 6),
+            filled.hist_counts,  # rows HIST_1 ... FULL_COINC_2 over hist_bin_edges
+            filled.window_counts,  # center bin pairs in each of coincidence_windows
+            filled.accidental_counts,  # pairs at each of accidental_offsets
+        )
 
-        clocks = np.zeros(50)
-        pclocks = np.zeros(50)
-        hist_1_tags = np.zeros(50)
-        hist_2_tags = np.zeros(50)  # why do I make these?
-        while 1:
-            self._lock()
-            if self.clock_idx == 0:
-                self._unlock()
-                continue
-            if (self.old_clock_start != self.clock_data[0]) | (
-                self.old_clock_start == 0
-            ):
-                clocks = self.clock_data[: self.clock_idx].copy()
-                pclocks = self.lclock_data[: self.clock_idx].copy()
-                hist_1_tags = self.hist_1_tags_data[: self.hist_1_idx].copy()
-                hist_2_tags = self.hist_2_tags_data[: self.hist_2_idx].copy()
-                diff_1 = self.diff_1_data[:self.hist_1_idx].copy()
-                diff_2 = self.diff_2_data[:self.hist_2_idx].copy()
-
-
-                coinc_1 = self.coinc_1[: self.coinc_idx].copy()
-                coinc_2 = self.coinc_2[: self.coinc_idx].copy()
-                full_coinc_1 = self.full_coinc_1[: self.full_coinc_idx].copy()
-                full_coinc_2 = self.full_coinc_2[: self.full_coinc_idx].copy()
-
-                
-                self.old_clock_start = self.clock_data[0]
-                coincidence = self.coincidence
-
-                self.clock_idx = 0
-                self.hist_1_idx = 0
-                self.hist_2_idx = 0
-
-                self.coinc_idx = 0
-                self.full_coinc_idx = 0
-                self.coincidence = 0
-                self.i = 0
-
-                self._unlock()
-                return (
-                    clocks,
-                    pclocks,
-                    hist_1_tags,
-                    hist_2_tags,
-                    coinc_1,
-                    coinc_2,
-                    full_coinc_1,
-                    full_coinc_2,
-                    coincidence,
-                    diff_1,
-                    diff_2,
-                    round(self.period/50000,6)
-                )
-            else:
-                print("nope")
-            self._unlock()
+    def decode_positions(self, codes):
+        """Positions in ps from what the buffers store."""
+        if not self.compact:
+            return codes
+        return codes / self.state[0]["position_scale"] + POSITION_ORIGIN
+
+    def empty_frame(self):
+        """What getData() returns when no data arrived before the timeout."""
+        empty = np.zeros(0)
+        return (
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.int64),
+            empty,
+            empty,
+            empty,
+            empty,
+            empty,
+            empty,
+            0,
+            empty,
+            empty,
+            round(self.state[0]["period"] / 50000, 6),
+            np.zeros((N_HISTOGRAMS, self.n_hist_bins), dtype=np.int64),
+            np.zeros(self.n_windows, dtype=np.int64),
+            np.zeros(len(self.accidental_offsets), dtype=np.int64),
+        )
+
+    def is_locked(self):
+        return bool(self.state[0]["locked"])
+
+    def time_to_lock(self):
+        """Seconds from the first clock to lock, nan if the PLL hasn't locked yet."""
+        lock_time = self.state[0]["lock_time"]
+        return np.nan if lock_time < 0 else lock_time * 1e-12
+
+    def reset_phase_stats(self):
+        st = self.state[0]
+        st["phase_count"] = 0
+        st["phase_mean"] = 0.0
+        st["phase_m2"] = 0.0
+        st["phase_min"] = np.inf
+        st["phase_max"] = -np.inf
+        st["phase_counts"] = 0
+
+    def phase_error(self, session=False):
+        """
+        Phase error of the locked clock in ps, over the frame getData() returned last or
+        over all frames since the start: a dict of count, mean, std, min, max and counts,
+        the histogram over phase_bin_edges. None before the first getData().
+        """
+        stats = self.session_phase_stats if session else self.frame_phase_stats
+        if stats is None:
+            return None
+        count = int(stats["phase_count"])
+        return {
+            "count": count,
+            "mean": float(stats["phase_mean"]) if count else np.nan,
+            "std": math.sqrt(stats["phase_m2"] / (count - 1)) if count > 1 else np.nan,
+            "min": float(stats["phase_min"]) if count else np.nan,
+            "max": float(stats["phase_max"]) if count else np.nan,
+            "counts": stats["phase_counts"],
+        }
+
+    def car(self, accidental_counts):
+        """
+        Coincidence to accidental ratio of a frame: the pairs at offset 0 over the mean
+        pairs at the other accidental_offsets. nan if either is missing.
+        """
+        same = self.accidental_offsets == 0
+        if not same.any() or same.all():
+            return np.nan
+        accidentals = accidental_counts[~same].mean()
+        if accidentals == 0:
+            return np.nan
+        return accidental_counts[same].sum() / accidentals
+
+    def account_overflow(self, counts):
+        """Count what the rings overwrote, given the number of entries written to each."""
+        for name, count in zip(RING_BUFFERS, counts):
+            size = self.clock_bins if name == "clock" else self.max_bins
+            # index of the oldest entry still in the ring, counted since the last getData()
+            oldest = max(0, count - size)
+            self.oldest_index[name] = oldest
+            if oldest:
+                self.dropped[name] += oldest
+                print("Buffer full: dropped", oldest, name, "entries")
 
     def clear_impl(self):
         # The lock is already acquired within the backend.
         self.last_start_timestamp = 0
-        self.clock_data = np.zeros((self.max_bins,), dtype=np.int64)
-        self.lclock_data = np.zeros((self.max_bins,), dtype=np.int64)
-        self.lclock_data_dec = np.zeros(
-            (self.max_bins,), dtype=np.float64
-        )  # decimal component of clock0
-        
-        self.full_coinc_1 = np.zeros((self.max_bins,), dtype=np.float64)
-        self.full_coinc_2 = np.zeros((self.max_bins,), dtype=np.float64)
-        self.coinc_1 = np.zeros((self.max_bins,), dtype=np.float64)
-        self.coinc_2 = np.zeros((self.max_bins,), dtype=np.float64)
-        self.hist_1_tags_data = np.zeros((self.max_bins,), dtype=np.float64)
-        self.hist_2_tags_data = np.zeros((self.max_bins,), dtype=np.float64)
-        self.diff_1_data = np.zeros((self.max_bins,), dtype=np.float64)
-        self.diff_2_data = np.zeros((self.max_bins,), dtype=np.float64)
+        # process() fills the active set, getData() hands it out and swaps in the spare.
+        # Without stored tags, the kernels never write the tag rings, so they stay empty
+        # until request_tags()
+        n_offsets = len(self.accidental_offsets)
+        self.active = PLLBuffers(
+            self.max_bins,
+            self.n_hist_bins,
+            self.n_windows,
+            n_offsets,
+            self.position_dtype,
+            self.clock_bins,
+            self.tag_bins(),
+        )
+        self.spare = PLLBuffers(
+            self.max_bins,
+            self.n_hist_bins,
+            self.n_windows,
+            n_offsets,
+            self.position_dtype,
+            self.clock_bins,
+            self.tag_bins(),
+        )
+        self.frame_ready = False
+        self.frame_start = None
 
         # self.t_prime = np.zeros((self.max_time_walk_arr_len), dtype=np.float64)
         
@@ -165,15 +484,55 @@ class CustomPLLHistogram(TimeTagger.CustomMeasurement):
         self.zero_time_walk_arrays()
 
 
+    def request_tags(self):
+        """
+        Keep every data tag (hist_1_tags, hist_2_tags, diff_1, diff_2 of getData) until
+        the matching release_tags(). For consumers like the time walk analysis.
+        """
+        self._lock()
+        self.tag_consumers += 1
+        if not self.state[0]["store_tags"]:
+            # the kernels write the tag rings from the next block on, allocate them first
+            self.state[0]["store_tags"] = True
+            self.active.allocate_tags(self.tag_bins())
+            self.spare.allocate_tags(self.tag_bins())
+        self._unlock()
+
+    def release_tags(self):
+        self._lock()
+        self.tag_consumers = max(0, self.tag_consumers - 1)
+        if self.state[0]["store_tags"] and not (self.store_tags or self.tag_consumers):
+            # nobody reads the tags of this frame anymore, free the rings
+            self.state[0]["store_tags"] = False
+            self.state[0]["hist_1_idx"] = 0
+            self.state[0]["hist_2_idx"] = 0
+            self.active.allocate_tags(0)
+            self.spare.allocate_tags(0)
+        self._unlock()
+
+    def tag_bins(self):
+        """Entries of the tag rings: max_bins while tags are stored, else none."""
+        return self.max_bins if self.state[0]["store_tags"] else 0
+
     def load_time_walk_arrays(self, t_prime_res, offset_1, offset_2):
+        """
+        Time walk offsets of both channels, one per t_prime_res wide bin of the time
+        since the previous tag on the channel. The tables are padded with their last
+        entry, so correct_time_walk() clamps diffs past the end to it.
+        """
         assert len(offset_1) == len(offset_2)
         assert len(offset_1) < len(self.walk_offset_1)
 
-        self.t_prime_res = t_prime_res
-        self.walk_offset_1[:len(offset_1)] = offset_1
-        self.walk_offset_2[:len(offset_1)] = offset_2
+        n = len(offset_1)
+        self.walk_offset_1[:n] = offset_1
+        self.walk_offset_2[:n] = offset_2
+        self.walk_offset_1[n:] = self.walk_offset_1[n - 1]
+        self.walk_offset_2[n:] = self.walk_offset_2[n - 1]
+        self.state[0]["walk_inv_res"] = 1 / t_prime_res
+        self.state[0]["walk_max"] = n - 1
 
     def zero_time_walk_arrays(self):
+        self.state[0]["walk_max"] = -1
         self.walk_offset_1 = np.zeros((self.max_time_walk_arr_len), dtype=np.float64)
         self.walk_offset_2 = np.zeros((self.max_time_walk_arr_len), dtype=np.float64)
 
@@ -188,285 +547,13 @@ class CustomPLLHistogram(TimeTagger.CustomMeasurement):
     # I should support the measurment of the unfiltered clock with respect to the phase locked clock.
 
 
-    @staticmethod
-    @numba.jit(nopython=True, nogil=True, cache=True)
-    def fast_process(
-        tags,
-        clock_data,
-        lclock_data,
-        lclock_data_dec,
-        hist_1_tags_data: np.ndarray,
-        hist_2_tags_data: np.ndarray,
-        diff_1_data: np.ndarray, # used for jitterate analysis
-        diff_2_data: np.ndarray,
-        t_prime_res: int,
-        walk_offset_1: np.ndarray,
-        walk_offset_2: np.ndarray,
-        prev_raw_1: int, # used for jitterate analysis
-        prev_raw_2: int,
-        coinc_1,
-        coinc_2,
-        full_coinc_1,
-        full_coinc_2,
-        data_channel_1,
-        data_channel_2,
-        clock_channel,
-        init,
-        clock0,
-        period,
-        phi_old,
-        deriv,
-        prop,
-        phase,
-        mult,
-        clock_idx,
-        hist_1_idx,
-        hist_2_idx,
-        coinc_idx,
-        full_coinc_idx,
-        q,
-        cycle,
-        coincidence,
-    ):
-        """
-        A precompiled version of the histogram algorithm for better performance
-        nopython=True: Only a subset of the python syntax is supported.
-                       Avoid everything but primitives and numpy arrays.
-                       All slow operation will yield an exception
-        nogil=True:    This method will release the global interpreter lock. So
-                       this method can run in parallel with other python code
-        """
-
-        dead_walk = True
-        error = 0
-        ch1_siv_start = 90  # - 20  # blue
-        ch1_siv_end = 150  # + 20  # blue
-
-        ch2_siv_start = 90  # - 20  # red
-        ch2_siv_end = 150  # + 20  # red
-
-        center_buffer_tag_hist = 0
-        center_buffer_cycle = 0
-        general_buffer_tag_hist = 0
-        general_buffer_cycle = 0
-        buffer_cycle = 0
-        freq = 1 / period
-        test_factor = 0
-
-        if init:
-            print(
-                "Init PLL with clock channel ",
-                clock_channel,
-                " , data1 channel: ",
-                data_channel_1,
-                " , and data2 channel ",
-                data_channel_2,
-            )
-            clock_idx = 0
-            clock_portion = np.zeros(1000, dtype=np.uint64)
-
-            for clock_idx, tag in enumerate(tags[:1000]):
-                if tag["channel"] == clock_channel:
-                    clock_portion[clock_idx] = tag["time"] + test_factor
-                    clock_idx += 1
-
-            # Initial Estimates
-            clock_portion = clock_portion[clock_portion > 0]  # cut off extra zeros
-            period = (clock_portion[-1] - clock_portion[0]) / (len(clock_portion) - 1)
-            freq = 1 / period
-            init = 0
-            clock0 = -1
-            clock0_dec = -0.1
-            clock_idx = 0
-            hist_1_idx = 0
-            hist_2_idx = 0
-            coinc_idx = 0
-            full_coinc_idx = 0
-            print("[READY] Finished FastProcess Initialization")
-
-        if len(tags) > 10000000:
-            print("Danger: More than 10 million tags per iteration")
-        for i, tag in enumerate(tags):
-            q = q + 1
-            if q > 10000000:
-                print("Danger: Buffer half full. ")
-            if tag["channel"] == clock_channel:
-                current_clock = tag["time"] + test_factor
-                clock_data[clock_idx] = current_clock
-                if clock0 == -1:
-                    # clock0 = current_clock - period
-                    clock0 = np.int64(current_clock - period)
-                    clock0_dec = 0.0
-
-                arg_int = current_clock - clock0  # both int64
-                arg = arg_int - clock0_dec
-                arg = (arg - period) * 2 * math.pi  # now its a float
-                arg = arg / period
-                phi0 = math.sin(arg)
-                filterr = phi0 + (phi0 - phi_old) * deriv
-                freq = freq - filterr * prop
-
-                # this will handle missed clocks
-                cycles = round((current_clock - clock0) / period)
-                cycle += cycles
-                period = 1 / freq
-                adj = cycles * period
-                adj_int = np.int64(adj)
-                adj_dec = adj - adj_int
-
-                clock0 = clock0 + adj_int
-                clock0_dec = clock0_dec + adj_dec
-                if clock0_dec >= 1:
-                    int_add = np.int64(clock0_dec)
-                    clock0 = clock0 + int_add
-                    clock0_dec = clock0_dec - int_add
-
-                # clock0 = clock0 + adj
-
-                lclock_data[clock_idx] = clock0
-                lclock_data_dec[clock_idx] = clock0_dec
-                phi_old = phi0
-                clock_idx = clock_idx + 1
-
-            if (tag["channel"] == data_channel_1) or (tag["channel"] == data_channel_2):
-                if clock0 != -1:
-                    hist_tag = ((tag["time"] + test_factor) - clock0) - clock0_dec
-                    # hist_tag = (tag["time"]+test_factor) - current_clock # no PLL
-
-                    # calculate diffs and apply walk offset (if available)
-                    if tag["channel"] == data_channel_1:
-                        diff = tag["time"] - prev_raw_1
-                        prev_raw_1 = tag["time"]
-                        diff_1_data[hist_1_idx] = diff # time walk
-
-                        # if dead_walk:
-                        #     if diff < 200000:
-                        #         continue
-
-                        hist_tag = correct_time_walk(hist_tag, diff, t_prime_res, walk_offset_1)
-
-                    if tag["channel"] == data_channel_2:
-                        diff = tag["time"] - prev_raw_2 # time walk
-                        prev_raw_2 = tag["time"] # time walk
-                        diff_2_data[hist_2_idx] = diff # time walk
-
-                        # if dead_walk:
-                        #     if diff < 200000:
-                        #         continue
-
-                        hist_tag = correct_time_walk(hist_tag, diff, t_prime_res, walk_offset_2)
-
-                    
-                    sub_period = period / mult
-                    minor_cycles = (hist_tag + phase) // sub_period
-                    minor_cycle = cycle * mult + minor_cycles
-                    # minor_cycle is the number or 'index' of this experiment period
-                    hist_tag = hist_tag - (sub_period * minor_cycles)
-
-                    # look for general coincidence.
-                    # This does not tell you which is channel 1 and which is channel 2
-                    if minor_cycle == buffer_cycle:
-                        # it's a general coincidence
-                        coincidence += 1
-                        buffer_cycle = -200
-                    else:
-                        buffer_cycle = minor_cycle
-
-                    if tag["channel"] == data_channel_1:
-                        # diff = tag["time"] - prev_raw_1
-                        # prev_raw_1 = tag["time"]
-                        # diff_1_data[hist_1_idx] = diff # time walk
-
-                        hist_1_tags_data[hist_1_idx] = hist_tag
-                        hist_1_idx += 1
-
-                        # look for general coincidences
-                        if minor_cycle == general_buffer_cycle:
-                            full_coinc_1[full_coinc_idx] = hist_tag
-                            full_coinc_2[full_coinc_idx] = general_buffer_tag_hist
-                            general_buffer_tag_hist = -200
-
-                            full_coinc_idx += 1
-
-                        else:
-                            # no match, overwrite buffer with current tag
-                            general_buffer_tag_hist = hist_tag
-                            general_buffer_cycle = minor_cycle
-
-                        # look for center-bin coincidences
-                        if (hist_tag > ch1_siv_start) and (hist_tag < ch1_siv_end):
-                            # this cuts the blue
-                            if minor_cycle == center_buffer_cycle:
-                                coinc_1[coinc_idx] = hist_tag
-                                coinc_2[coinc_idx] = center_buffer_tag_hist
-                                center_buffer_tag_hist = -200
-
-                                coinc_idx += 1
-                            else:
-                                # no match, overwrite buffer with current tag
-                                center_buffer_tag_hist = hist_tag
-                                center_buffer_cycle = minor_cycle
-
-                    if tag["channel"] == data_channel_2:
-                        # diff = tag["time"] - prev_raw_2 # time walk
-                        # prev_raw_2 = tag["time"] # time walk
-                        # diff_2_data[hist_2_idx] = diff # time walk
-
-                        hist_2_tags_data[hist_2_idx] = hist_tag
-                        hist_2_idx += 1
-
-                        # look for general coincidences
-                        if minor_cycle == general_buffer_cycle:
-                            full_coinc_2[full_coinc_idx] = hist_tag
-                            full_coinc_1[full_coinc_idx] = general_buffer_tag_hist
-                            general_buffer_tag_hist = -200
-
-                            full_coinc_idx += 1
-
-                        else:
-                            # no match, overwrite buffer with current tag
-                            general_buffer_tag_hist = hist_tag
-                            general_buffer_cycle = minor_cycle
-
-                        # check for center bin coincidences
-                        if (hist_tag > ch2_siv_start) and (hist_tag < ch2_siv_end):
-                            if minor_cycle == center_buffer_cycle:
-                                # if the counts are from the same period
-                                coinc_2[coinc_idx] = hist_tag
-                                coinc_1[coinc_idx] = center_buffer_tag_hist
-                                center_buffer_tag_hist = -200
-
-                                coinc_idx += 1
-                            else:
-                                # no match, overwrite buffer with current tag
-                                center_buffer_tag_hist = hist_tag
-                                center_buffer_cycle = minor_cycle
-
-                    # if its in the correct time window, save it in buffer.
-                    # every time something gets added to the buffer you either
-                    # 1. check what's in the buffer if it matches the raw time add to coinc array, set buffer to zero
-                    # 2. check what's in the buffer if no match discard buffer and replace
-
-                else:
-                    continue
-
-        return (
-            clock0,
-            period,
-            phi_old,
-            init,
-            clock_idx,
-            hist_1_idx,
-            hist_2_idx,
-            prev_raw_1,
-            prev_raw_2,
-            coinc_idx,
-            full_coinc_idx,
-            error,
-            q,
-            cycle,
-            coincidence,
-            )
+    def kernel_variant(self):
+        """The pll_kernels kernel for the current settings."""
+        return make_kernel(
+            time_walk=self.state[0]["walk_max"] >= 0,
+            parallel=self.parallel,
+            compact=self.compact,
+        )
 
     def process(self, incoming_tags, begin_time, end_time):
         """
@@ -489,77 +576,135 @@ class CustomPLLHistogram(TimeTagger.CustomMeasurement):
         end_time
             End timestamp of the of the current data block.
         """
-        # maybe the jit function could change the memory location of that returned ints? So you need to pass them?
-        # but numpy arrays are just pointers, and the class already has those. No need to pass them back.
-
-        (
-            self.clock0,
-            self.period,
-            self.phi_old,
-            self.init,
-            self.clock_idx,
-            self.hist_1_idx,
-            self.hist_2_idx,
-            self.prev_raw_1,
-            self.prev_raw_2,
-            self.coinc_idx,
-            self.full_coinc_idx,
-            self.error,
-            self.i,
-            self.cycle,
-            self.coincidence,
-        ) = CustomPLLHistogram.fast_process(
+        # all scalars travel in self.state, which the kernel updates in place.
+        if self.parallel:
+            if self.n_threads is not None:
+                numba.set_num_threads(self.n_threads)
+            # a few chunks per thread evens out blocks with uneven count rates
+            self.state[0]["n_chunks"] = 4 * numba.get_num_threads()
+        b = self.active
+        self.kernel_variant()(
             incoming_tags,
-            self.clock_data,
-            self.lclock_data,
-            self.lclock_data_dec,
-            self.hist_1_tags_data,
-            self.hist_2_tags_data,
-            self.diff_1_data,
-            self.diff_2_data,
-            self.t_prime_res,
+            self.state,
+            b.clock_data,
+            b.lclock_data,
+            b.lclock_data_dec,
+            b.hist_1_tags_data,
+            b.hist_2_tags_data,
+            b.diff_1_data,
+            b.diff_2_data,
             self.walk_offset_1,
             self.walk_offset_2,
-            self.prev_raw_1,
-            self.prev_raw_2,
-            self.coinc_1,
-            self.coinc_2,
-            self.full_coinc_1,
-            self.full_coinc_2,
-            self.data_channel_1,
-            self.data_channel_2,
-            self.clock_channel,
-            self.init,
-            self.clock0,
-            self.period,
-            self.phi_old,
-            self.deriv,
-            self.prop,
-            self.phase,
-            self.mult,
-            self.clock_idx,
-            self.hist_1_idx,
-            self.hist_2_idx,
-            self.coinc_idx,
-            self.full_coinc_idx,
-            self.i,
-            self.cycle,
-            self.coincidence,
+            b.coinc_1,
+            b.coinc_2,
+            b.full_coinc_1,
+            b.full_coinc_2,
+            b.hist_counts,
+            self.coincidence_windows,
+            self.window_state,
+            b.window_counts,
+            self.accidental_offsets,
+            self.accidental_history,
+            self.accidental_idx,
+            b.accidental_counts,
         )
+        self.wake_get_data(begin_time, end_time)
+
+    def wake_get_data(self, begin_time, end_time):
+        """After a block, wake a waiting getData() once the frame holds enough data."""
+        if not self.frame_ready:
+            if self.frame_start is None:
+                self.frame_start = begin_time
+            if (self.state[0]["frame_clocks"] >= self.wake_clocks) or (
+                self.wake_duration is not None
+                and end_time - self.frame_start >= self.wake_duration
+            ):
+                with self.data_ready:
+                    self.frame_ready = True
+                    self.data_ready.notify_all()
+
+
+def merge_phase_stats(a, b):
+    """Phase error statistics of two frames together, a may be None."""
+    if a is None:
+        return {name: np.copy(value) for name, value in b.items()}
+    n_a, n_b = a["phase_count"], b["phase_count"]
+    n = n_a + n_b
+    if n == 0:
+        return a
+    delta = b["phase_mean"] - a["phase_mean"]
+    return {
+        "phase_count": n,
+        "phase_mean": a["phase_mean"] + delta * n_b / n,
+        "phase_m2": a["phase_m2"] + b["phase_m2"] + delta * delta * n_a * n_b / n,
+        "phase_min": min(a["phase_min"], b["phase_min"]),
+        "phase_max": max(a["phase_max"], b["phase_max"]),
+        "phase_counts": a["phase_counts"] + b["phase_counts"],
+    }
+
+
+def kernel_signature(position_dtype=None, readonly_tags=True):
+    """
+    numba signature of the kernels for the arrays process() passes them, with float64
+    storage or compact storage in position_dtype. The backend hands over the tags read
+    only, which numba compiles separately from writable arrays.
+    """
+    b = PLLBuffers(1, 1, position_dtype=position_dtype)
+    tags = numba.types.Array(numba.from_dtype(TAG_DTYPE), 1, "C", readonly=readonly_tags)
+    arrays = (
+        np.zeros(1, dtype=PLL_STATE_DTYPE),
+        b.clock_data,
+        b.lclock_data,
+        b.lclock_data_dec,
+        b.hist_1_tags_data,
+        b.hist_2_tags_data,
+        b.diff_1_data,
+        b.diff_2_data,
+        np.zeros(1),  # walk_offset_1
+        np.zeros(1),  # walk_offset_2
+        b.coinc_1,
+        b.coinc_2,
+        b.full_coinc_1,
+        b.full_coinc_2,
+        b.hist_counts,
+        np.zeros((1, 4)),  # coincidence_windows
+        np.zeros((1, 2)),  # window_state
+        b.window_counts,
+        np.zeros(1),  # accidental_offsets
+        np.zeros((2, ACCIDENTAL_HISTORY)),  # accidental_history
+        np.zeros(2, dtype=np.int64),  # accidental_idx
+        b.accidental_counts,
+    )
+    return numba.types.void(tags, *(numba.typeof(a) for a in arrays))
+
 
-# @numba.jit(nopython=True, nogil=True, cache=True)
-# def handle_time_walk(hist_tag, diff, t_prime_res, walk_offset):
-#     pass
+def precompile(
+    parallel=False,
+    compact=False,
+    position_dtype=np.uint16,
+    readonly_tags=True,
+):
+    """
+    Compile the kernels a CustomPLLHistogram with these settings runs, or load them from
+    numba's cache, so no process() call waits for the compiler: the one it starts with,
+    then the time walk variant it switches to once load_time_walk_arrays() is called.
+    """
+    signature = kernel_signature(position_dtype if compact else None, readonly_tags)
+    for time_walk in (False, True):
+        t0 = perf_counter()
+        kernel = make_kernel(time_walk=time_walk, parallel=parallel, compact=compact)
+        kernel.compile(signature)
+        print(
+            f"[READY] PLL kernel{' with time walk' if time_walk else ''} compiled in "
+            f"{perf_counter() - t0:.2f} s"
+        )
 
-@numba.jit(nopython=True, nogil=True, cache=True)
-def correct_time_walk(hist_tag, diff, t_prime_res, walk_offset):
-    diff_arg = int(diff/t_prime_res) #500 ps
-    if diff_arg > len(walk_offset):
-        return hist_tag
-    else:
-        # extremely basic interpolation
-        return hist_tag - walk_offset[diff_arg]
 
+def precompile_in_background(**settings):
+    """precompile() on a daemon thread, for the application to start at launch."""
+    thread = threading.Thread(target=precompile, kwargs=settings, daemon=True)
+    thread.start()
+    return thread
 
 # Channel definitions
 CHAN_START = 1
@@ -569,44 +714,39 @@ if __name__ == "__main__":
     print(
         """Custom Measurement example
 
-Implementation of a custom single start, multiple stop measurement, histogramming
-the time differences of the two input channels.
-
-The custom implementation will be comparted to a the build-in Histogram class,
-which is a multiple start, multiple stop measurement. But for the
-selected time span of the histogram, multiple start does not make a difference.
+Locks a PLL to the divided clock on channel 9 and histograms the tags of channels -5
+and -14 over the laser period, as startPLL in entanglement_control does with the
+settings of UI_params.yaml. Prints the counts and the lock quality of each frame.
 """
     )
-    # fig, ax = plt.subplots()
 
     tagger = TimeTagger.createTimeTagger()
-    data_channel = -5
+    data_channel_1 = -5
+    data_channel_2 = -14
     clock_channel = 9
-    tagger.setEventDivider(9, 100)
-    tagger.setTriggerLevel(-5, -0.014)
-    tagger.setTriggerLevel(9, 0.05)
+    tagger.setEventDivider(clock_channel, 100)
+    tagger.setTriggerLevel(data_channel_1, -0.014)
+    tagger.setTriggerLevel(data_channel_2, -0.014)
+    tagger.setTriggerLevel(clock_channel, 0.05)
     PLL = CustomPLLHistogram(
         tagger,
-        data_channel,
+        data_channel_1,
+        data_channel_2,
         clock_channel,
-        10,
+        mult=50000,
         phase=0,
-        deriv=0.001,
-        prop=2e-10,
-        n_bins=800000,
+        deriv=200,
+        prop=9e-13,
     )
-    # for i in range(40000):
-    #     sleep(.05)
-    #     clocks, pclocks, hist = PLL.getData()
-    #     # print("1: ", clks1[:10])
-    #     # print("HIST: ", hist[:20])
-    #     print("length of clocks: ", len(clocks))
-    #     diff = clocks - pclocks
-    #     print("difference: ", diff[:10])
-    for i in range(40000):
-        sleep(0.05)
-        clocks, pclocks, hist_1, hist_2 = PLL.getData()
-
-    clocks, pclocks, hist1, hist_2 = PLL.getData()
-
-    basis = np.linspace(clocks[0], clocks[-1], len(clocks))
+    for i in range(100):
+        # a frame of 0.1 s of tags, the fields are described in getData()
+        data = PLL.getData(min_clocks=np.inf, min_duration=0.1, timeout=1.0)
+        histograms = data[12]
+        phase_error = PLL.phase_error()
+        print(
+            f"period {data[11]} ps, {histograms[HIST_1].sum()} + "
+            f"{histograms[HIST_2].sum()} tags, {data[8]} coincidences, "
+            f"locked: {PLL.frame_locked}, phase error {phase_error['std']:.2f} ps rms"
+        )
+    PLL.stop()
+    TimeTagger.freeTimeTagger(tagger)
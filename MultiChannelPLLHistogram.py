@@ -0,0 +1,455 @@
+import TimeTagger
+import numpy as np
+import numba
+
+from pll_kernels import (
+    TIME_TAG,
+    PHASE_BINS,
+    acquire_lock,
+    pll_clock_step,
+    lock_detect,
+    place_data_tag,
+    histogram_add,
+)
+from histogram_geometry import HistogramGeometry
+
+
+"""
+Phase locked histograms of any number of detector channels against one clock.
+
+CustomPLLHistogram pairs up two data channels. This measurement takes a list of data
+channels and fills, in one pass over the tag stream, a histogram per channel and a
+coincidence matrix over all channel pairs, so every pairing is characterized at the same
+time instead of one pairing per run.
+"""
+
+MULTI_PLL_STATE_DTYPE = np.dtype(
+    [
+        # settings
+        ("clock_channel", np.int64),
+        ("channel_min", np.int64),  # channel_index[channel - channel_min] is the data index
+        ("mult", np.int64),
+        ("phase", np.float64),
+        ("deriv", np.float64),
+        ("prop", np.float64),
+        ("hist_start", np.float64),
+        ("bin_width", np.float64),
+        # time walk tables, as in CustomPLLHistogram: 1 / their step, and the index of
+        # their last entry (-1 without them)
+        ("walk_inv_res", np.float64),
+        ("walk_max", np.float64),
+        # loop filter
+        ("init", np.int64),
+        ("clock0", np.int64),
+        ("clock0_dec", np.float64),
+        ("period", np.float64),
+        ("phi_old", np.float64),
+        ("cycle", np.int64),
+        # lock acquisition and lock detector, as in CustomPLLHistogram
+        ("acquire_clocks", np.int64),
+        ("lock_threshold", np.float64),
+        ("lock_clocks", np.int64),
+        ("first_clock", np.int64),
+        ("tracked_clocks", np.int64),
+        ("lock_error", np.float64),
+        ("locked", np.int64),
+        ("lock_time", np.int64),
+        ("unlocked_clocks", np.int64),
+        # phase error statistics lock_detect() keeps, reset by getData()
+        ("phase_bin_width", np.float64),
+        ("phase_count", np.int64),
+        ("phase_mean", np.float64),
+        ("phase_m2", np.float64),
+        ("phase_min", np.float64),
+        ("phase_max", np.float64),
+        ("phase_counts", np.int64, (PHASE_BINS,)),
+        # reset by getData()
+        ("clock_idx", np.int64),
+        # n-fold coincidences: the minor cycle being collected and the bits of the
+        # channels that fired in it
+        ("multifold", np.int64),  # collect at all, off below three multifold channels
+        ("period_cycle", np.float64),
+        ("period_mask", np.int64),
+    ]
+)
+
+
+class MultiChannelPLLHistogram(TimeTagger.CustomMeasurement):
+    """
+    Histograms and pairwise coincidences of N data channels, phase locked to a clock.
+
+    Every channel remembers the minor cycle of its last tag. A tag is a coincidence with
+    every other channel whose last tag fell in the same minor cycle, and a center window
+    coincidence if both tags are in their channel's coincidence window. getData() returns
+    the matrices symmetric, with the singles of each channel on the diagonal, so the
+    efficiency of a pair is coincidences[i, j] / sqrt(coincidences[i, i] * coincidences[j, j]).
+
+    With three or more multifold_channels, the combination of channels that fired in
+    their windows is also counted for every period, for three- and four-fold
+    coincidences in multi-photon and heralding experiments.
+    """
+
+    def __init__(
+        self,
+        tagger,
+        data_channels,
+        clock_channel,
+        mult=1,
+        phase=0,
+        deriv=0.01,
+        prop=2e-9,
+        bin_width=1.0,
+        hist_range=(0.0, 250.0),
+        geometry=None,
+        coincidence_window=(90.0, 150.0),
+        multifold_channels=None,
+        acquire_clocks=100,
+        lock_threshold=5.0,
+        lock_clocks=100,
+        max_time_walk_arr_len=10000,
+    ):
+        TimeTagger.CustomMeasurement.__init__(self, tagger)
+        self.data_channels = list(data_channels)
+        self.clock_channel = clock_channel
+        self.n_channels = len(self.data_channels)
+        self.max_time_walk_arr_len = max_time_walk_arr_len
+        # a HistogramGeometry shared with the GUI, else one of bin_width over hist_range
+        if geometry is None:
+            geometry = HistogramGeometry(bin_width, hist_range)
+        self.geometry = geometry
+        self.bin_width = geometry.bin_width
+        self.hist_range = geometry.hist_range
+        self.n_hist_bins = geometry.n_bins
+        self.hist_bin_edges = geometry.edges
+
+        # one (start, end) for all channels, or one row per channel
+        windows = np.array(coincidence_window, dtype=np.float64).reshape(-1, 2)
+        self.coincidence_windows = np.ascontiguousarray(
+            np.broadcast_to(windows, (self.n_channels, 2))
+        )
+
+        # n-fold coincidences are counted per combination of multifold_channels (all data
+        # channels by default) that fired in their windows in the same period. Channel i
+        # of multifold_channels is bit i of a combination
+        if multifold_channels is None:
+            multifold_channels = self.data_channels
+        self.multifold_channels = list(multifold_channels)
+        assert len(self.multifold_channels) <= 16, "2**16 combinations at most"
+        self.multifold_bit = np.zeros(self.n_channels, dtype=np.int64)
+        for bit, channel in enumerate(self.multifold_channels):
+            self.multifold_bit[self.data_channels.index(channel)] = 1 << bit
+
+        # the kernel finds the data index of a tag in a lookup table over channel numbers
+        channels = self.data_channels + [clock_channel]
+        channel_min = min(channels)
+        self.channel_index = np.full(max(channels) - channel_min + 1, -1, dtype=np.int64)
+        for i, channel in enumerate(self.data_channels):
+            self.channel_index[channel - channel_min] = i
+
+        self.state = np.zeros(1, dtype=MULTI_PLL_STATE_DTYPE)
+        st = self.state[0]
+        st["clock_channel"] = clock_channel
+        st["channel_min"] = channel_min
+        st["mult"] = mult
+        st["phase"] = phase
+        st["deriv"] = deriv
+        st["prop"] = prop
+        st["hist_start"] = geometry.start
+        st["bin_width"] = geometry.bin_width
+        st["walk_inv_res"] = 1 / 500
+        st["init"] = 1
+        st["period"] = 1
+        st["acquire_clocks"] = acquire_clocks
+        # locked as in CustomPLLHistogram, getData() sets frame_locked
+        st["lock_threshold"] = lock_threshold
+        st["lock_clocks"] = lock_clocks
+        st["lock_time"] = -1
+        st["phase_bin_width"] = 1.0
+        self.reset_phase_stats()
+        self.frame_locked = False
+        st["multifold"] = len(self.multifold_channels) >= 3
+
+        for channel in channels:
+            self.register_channel(channel=channel)
+        self.clear_impl()
+
+        # At the end of a CustomMeasurement construction,
+        # we must indicate that we have finished.
+        self.finalize_init()
+
+    def __del__(self):
+        # The measurement must be stopped before deconstruction to avoid
+        # concurrent process() calls.
+        self.stop()
+
+    def getData(self):
+        """
+        Everything since the last call:
+        (histograms, coincidences, full_coincidences, n_clocks, period, multifold_counts)
+
+        histograms is (n_channels, n_hist_bins) over hist_bin_edges. coincidences counts
+        the pairs in the coincidence windows and full_coincidences all pairs in the same
+        period, both (n_channels, n_channels) with the singles on the diagonal.
+        multifold_counts[mask] is the number of periods in which exactly the
+        multifold_channels in mask fired, see combinations().
+
+        frame_locked tells whether the PLL was locked for the whole frame.
+        """
+        self._lock()
+        histograms = self.hist_counts.copy()
+        coincidences = self.coincidences.copy()
+        full_coincidences = self.full_coincidences.copy()
+        multifold_counts = self.multifold_counts.copy()
+        n_clocks = self.state[0]["clock_idx"]
+        period = self.state[0]["period"]
+        self.hist_counts[:] = 0
+        self.coincidences[:] = 0
+        self.full_coincidences[:] = 0
+        self.multifold_counts[:] = 0
+        self.state[0]["clock_idx"] = 0
+        self.frame_locked = bool(
+            self.state[0]["locked"] and not self.state[0]["unlocked_clocks"]
+        )
+        self.state[0]["unlocked_clocks"] = 0
+        self.reset_phase_stats()
+        self._unlock()
+
+        # the kernel counts each pair once, under the channel that fired second
+        coincidences += np.triu(coincidences.T, 1) + np.tril(coincidences.T, -1)
+        full_coincidences += np.triu(full_coincidences.T, 1) + np.tril(full_coincidences.T, -1)
+        return histograms, coincidences, full_coincidences, n_clocks, period, multifold_counts
+
+    def combinations(self, multifold_counts, fold=None):
+        """
+        Periods per combination of multifold_channels, as a dict from channel tuples to
+        counts. fold=3 gives the three-fold coincidences only. A period in which four
+        channels fired counts for the four-fold combination, not for its subsets.
+        """
+        combinations = {}
+        for mask in np.flatnonzero(multifold_counts):
+            channels = tuple(
+                channel
+                for bit, channel in enumerate(self.multifold_channels)
+                if mask >> bit & 1
+            )
+            if fold is None or len(channels) == fold:
+                combinations[channels] = int(multifold_counts[mask])
+        return combinations
+
+    def reset_phase_stats(self):
+        st = self.state[0]
+        st["phase_count"] = 0
+        st["phase_mean"] = 0.0
+        st["phase_m2"] = 0.0
+        st["phase_min"] = np.inf
+        st["phase_max"] = -np.inf
+        st["phase_counts"] = 0
+
+    def clear_impl(self):
+        # The lock is already acquired within the backend.
+        n = self.n_channels
+        self.hist_counts = np.zeros((n, self.n_hist_bins), dtype=np.int64)
+        self.coincidences = np.zeros((n, n), dtype=np.int64)
+        self.full_coincidences = np.zeros((n, n), dtype=np.int64)
+        self.multifold_counts = np.zeros(1 << len(self.multifold_channels), dtype=np.int64)
+        # minor cycle of the last tag of every channel, and whether it was in the window
+        self.last_cycle = np.full(n, np.nan)
+        self.last_in_window = np.zeros(n, dtype=np.bool_)
+        # raw time of the last tag of every channel, for the time walk correction
+        self.prev_raw = np.zeros(n, dtype=np.int64)
+        self.zero_time_walk_arrays()
+
+    def load_time_walk_arrays(self, t_prime_res, offsets):
+        """
+        Time walk offsets of every data channel, a row per channel in data_channels
+        order, as CustomPLLHistogram.load_time_walk_arrays() takes them for two.
+        """
+        offsets = np.asarray(offsets, dtype=np.float64)
+        assert offsets.shape[0] == self.n_channels
+        n = offsets.shape[1]
+        assert n < self.max_time_walk_arr_len
+
+        self.walk_offsets[:, :n] = offsets
+        self.walk_offsets[:, n:] = offsets[:, n - 1 : n]
+        self.state[0]["walk_inv_res"] = 1 / t_prime_res
+        self.state[0]["walk_max"] = n - 1
+
+    def zero_time_walk_arrays(self):
+        self.state[0]["walk_max"] = -1
+        self.walk_offsets = np.zeros(
+            (self.n_channels, self.max_time_walk_arr_len), dtype=np.float64
+        )
+
+    def on_start(self):
+        # The lock is already acquired within the backend.
+        pass
+
+    def on_stop(self):
+        # The lock is already acquired within the backend.
+        pass
+
+    @staticmethod
+    @numba.jit(nopython=True, nogil=True, cache=True)
+    def fast_process(
+        tags,
+        state,
+        channel_index,
+        windows,
+        last_cycle,
+        last_in_window,
+        prev_raw,
+        walk_offsets,
+        hist_counts,
+        coincidences,
+        full_coincidences,
+        multifold_bit,
+        multifold_counts,
+    ):
+        """
+        The loop filter step, lock detector and data tag placement with time walk
+        correction of the CustomPLLHistogram kernels, for every channel in
+        channel_index. The channel lookup table drops the tags of other channels. Clocks
+        are counted, not recorded. Pairs are counted in the row of the channel that fired
+        second.
+
+        For n-fold coincidences the bits of the channels that fired in their window are
+        collected while the minor cycle stays the same. When a later minor cycle starts,
+        a combination of two or more channels is counted. Tags from an earlier minor
+        cycle than the one being collected are left out.
+        """
+        st = state[0]
+        clock_channel = st.clock_channel
+        channel_min = st.channel_min
+        mult = st.mult
+        phase = st.phase
+        deriv = st.deriv
+        prop = st.prop
+        hist_start = st.hist_start
+        inv_bin_width = 1 / st.bin_width
+        walk_inv_res = st.walk_inv_res
+        walk_max = st.walk_max
+
+        init = st.init
+        clock0 = st.clock0
+        clock0_dec = st.clock0_dec
+        period = st.period
+        phi_old = st.phi_old
+        cycle = st.cycle
+        clock_idx = st.clock_idx
+        multifold = st.multifold
+        period_cycle = st.period_cycle
+        period_mask = st.period_mask
+        n_channels = len(last_cycle)
+        n_lookup = len(channel_index)
+
+        freq = 1 / period
+
+        if init:
+            print("Init multi channel PLL with clock channel ", clock_channel)
+            if not acquire_lock(tags, state):
+                print("Too few clocks to acquire lock, waiting for the next block")
+                return
+            period = st.period
+            freq = 1 / period
+            init = 0
+            clock0 = st.clock0
+            clock0_dec = st.clock0_dec
+            print("[READY] Finished FastProcess Initialization")
+
+        for tag in tags:
+            if tag["type"] != TIME_TAG:
+                continue
+            channel = tag["channel"]
+            if channel == clock_channel:
+                clock0, clock0_dec, period, freq, phi_old, cycle = pll_clock_step(
+                    tag["time"],
+                    clock0,
+                    clock0_dec,
+                    period,
+                    freq,
+                    phi_old,
+                    cycle,
+                    deriv,
+                    prop,
+                )
+                lock_detect(state, phi_old, period, tag["time"])
+                clock_idx += 1
+                continue
+
+            lookup = channel - channel_min
+            if lookup < 0 or lookup >= n_lookup:
+                continue
+            c = channel_index[lookup]
+            if c < 0 or clock0 == -1:
+                continue
+
+            time = tag["time"]
+            hist_tag, minor_cycle, _ = place_data_tag(
+                time,
+                prev_raw[c],
+                clock0,
+                clock0_dec,
+                period / mult,
+                cycle * mult,
+                phase,
+                walk_inv_res,
+                walk_max,
+                walk_offsets[c],
+            )
+            prev_raw[c] = time
+            histogram_add(hist_counts, c, hist_tag, hist_start, inv_bin_width)
+
+            in_window = (hist_tag > windows[c, 0]) and (hist_tag < windows[c, 1])
+            full_coincidences[c, c] += 1
+            if in_window:
+                coincidences[c, c] += 1
+            for d in range(n_channels):
+                if d != c and last_cycle[d] == minor_cycle:
+                    full_coincidences[c, d] += 1
+                    if in_window and last_in_window[d]:
+                        coincidences[c, d] += 1
+            last_cycle[c] = minor_cycle
+            last_in_window[c] = in_window
+
+            if multifold and in_window:
+                bit = multifold_bit[c]
+                if bit:
+                    if minor_cycle == period_cycle:
+                        period_mask |= bit
+                    elif minor_cycle > period_cycle:
+                        if period_mask & (period_mask - 1):
+                            multifold_counts[period_mask] += 1
+                        period_cycle = minor_cycle
+                        period_mask = bit
+
+        st.init = init
+        st.clock0 = clock0
+        st.clock0_dec = clock0_dec
+        st.period = period
+        st.phi_old = phi_old
+        st.cycle = cycle
+        st.clock_idx = clock_idx
+        st.period_cycle = period_cycle
+        st.period_mask = period_mask
+
+    def process(self, incoming_tags, begin_time, end_time):
+        """
+        Main processing method for the incoming raw time-tags.
+
+        The lock is already acquired within the backend.
+        """
+        MultiChannelPLLHistogram.fast_process(
+            incoming_tags,
+            self.state,
+            self.channel_index,
+            self.coincidence_windows,
+            self.last_cycle,
+            self.last_in_window,
+            self.prev_raw,
+            self.walk_offsets,
+            self.hist_counts,
+            self.coincidences,
+            self.full_coincidences,
+            self.multifold_bit,
+            self.multifold_counts,
+        )
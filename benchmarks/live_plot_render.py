@@ -0,0 +1,102 @@
+"""
+Frame time of the live plots of entanglement_control, with and without BlitRenderer.
+
+Builds the figure of the GUI, headless on the Agg backend: the phase error, count rate,
+four clock referenced histograms of n_bins bins, coincidence rate and efficiency plots.
+Every frame sets new data on all lines, as draw() does, and renders it once by relim(),
+autoscale_view() and a full canvas.draw(), and once with BlitRenderer.draw().
+
+run from the repo root:
+    python -m benchmarks.live_plot_render
+"""
+
+import time
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from blit_renderer import BlitRenderer
+
+
+def make_figure(n_bins, n_phase_bins=200, n_counter=200):
+    inner = [["innerA"], ["innerB"]]
+    outer = [["upper left", "upper right"], ["lower left", inner]]
+    fig = Figure(figsize=(12, 8), dpi=100, layout="constrained")
+    canvas = FigureCanvasAgg(fig)
+    axd = fig.subplot_mosaic(outer, gridspec_kw=dict(height_ratios=[1, 2]))
+    lines = {
+        "upper left": axd["upper left"].plot(np.zeros(n_phase_bins), color="red"),
+        "upper right": axd["upper right"].plot(np.zeros((n_counter, 3))),
+        "lower left": axd["lower left"].plot(np.zeros((n_bins, 4))),
+        "innerA": axd["innerA"].plot([], [], color="k"),
+        "innerB": axd["innerB"].plot([], [], color="red"),
+    }
+    for name, ax in axd.items():
+        ax.set_title(name)
+        ax.grid(True)
+    return fig, canvas, axd, lines
+
+
+def frames(n_frames, n_bins, n_phase_bins=200, n_counter=200, seed=0):
+    """data of every line per frame, count rates that drift slowly"""
+    rng = np.random.default_rng(seed)
+    peak = np.exp(-0.5 * ((np.arange(n_bins) - n_bins / 3) / (n_bins / 50)) ** 2)
+    phase = np.exp(-0.5 * ((np.arange(n_phase_bins) - n_phase_bins / 2) / 20) ** 2)
+    coinc = []
+    for i in range(n_frames):
+        rate = 1 + 0.1 * np.sin(i / 50)
+        coinc.append(rate * 1000 + rng.normal(0, 10))
+        yield {
+            "upper left": [rng.poisson(1000 * phase)],
+            "upper right": list(rng.poisson(rate * 500, (3, n_counter))),
+            "lower left": list(rng.poisson(rate * (5 + 200 * peak), (4, n_bins))),
+            "innerA": [(np.arange(len(coinc[-50:])) + max(0, i - 49), coinc[-50:])],
+            "innerB": [(np.arange(len(coinc[-50:])) + max(0, i - 49), np.array(coinc[-50:]) / 2000)],
+        }
+
+
+def set_data(lines, frame):
+    for name, data in frame.items():
+        for line, values in zip(lines[name], data):
+            if isinstance(values, tuple):
+                line.set_data(*values)
+            else:
+                line.set_ydata(values)
+
+
+def run(n_bins, n_frames, blit):
+    fig, canvas, axd, lines = make_figure(n_bins)
+    if blit:
+        renderer = BlitRenderer(canvas, frame_budget=0.03)
+        for name, ax in axd.items():
+            # the coincidence plots scroll
+            margin = 0.5 if name.startswith("inner") else None
+            renderer.add_axis(ax, lines[name], title=name == "upper left", margin=margin)
+    canvas.draw()
+    times = []
+    for i, frame in enumerate(frames(n_frames, n_bins)):
+        t0 = time.perf_counter()
+        set_data(lines, frame)
+        if blit:
+            axd["upper left"].set_title(f"phase error {i}")
+            renderer.draw()
+        else:
+            axd["upper left"].set_title(f"phase error {i}")
+            for ax in axd.values():
+                ax.relim()
+                ax.autoscale_view(True, True, True)
+            canvas.draw()
+        times.append(time.perf_counter() - t0)
+    times = np.array(times) * 1e3
+    full_draws = f", {renderer.full_draws} full draws" if blit else ""
+    return f"median {np.median(times):6.1f} ms, mean {times.mean():6.1f} ms, max {times.max():6.1f} ms{full_draws}"
+
+
+def main(n_frames=200):
+    for n_bins in (1000, 10000, 100000):
+        print(f"{n_bins:6d} bins, full draw: {run(n_bins, n_frames, blit=False)}")
+        print(f"{n_bins:6d} bins,  blitting: {run(n_bins, n_frames, blit=True)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Accidental coincidences and CAR counted by the PLL kernels.
+
+For a few pair fractions, runs the same synthetic stream through the single loop and
+parallel kernels, checks they count the same pairs at every offset, and compares the
+accidentals to the rate expected from the singles in the first window, n1 * n2 / periods.
+
+run from the repo root:
+    python -m benchmarks.pll_accidentals
+"""
+
+import numpy as np
+import TimeTagger
+
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+    MULT,
+    PERIOD,
+)
+
+
+def main(duration=0.2e12, singles_rate=5e6):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    for pair_fraction in (0.01, 0.05, 0.3):
+        tags = make_tag_stream(duration, singles_rate=singles_rate, pair_fraction=pair_fraction)
+        blocks = split_blocks(tags, 0.02e12)
+        results = []
+        for kwargs in ({}, {"parallel": True}):
+            pll = make_pll(tagger, len(tags), store_tags=True, **kwargs)
+            for block in blocks:
+                pll.process(block, 0, 0)
+            data = pll.getData()
+            results.append(np.array(data[14]))
+            del pll
+        assert all(np.array_equal(results[0], r) for r in results[1:]), results
+
+        start, end = 90, 150  # the default first window
+        n_1 = np.count_nonzero((data[2] > start) & (data[2] < end))
+        n_2 = np.count_nonzero((data[3] > start) & (data[3] < end))
+        expected = n_1 * n_2 / (duration / (PERIOD / MULT))
+        counts = results[0]
+        accidentals = counts[np.arange(len(counts)) != len(counts) // 2]
+        assert np.all(np.abs(accidentals - expected) < 5 * np.sqrt(expected)), counts
+        print(
+            f"pair fraction {pair_fraction}: pairs per offset {counts.tolist()}, "
+            f"expected accidentals {expected:.0f}, CAR {counts[len(counts) // 2] / accidentals.mean():.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Decimated clock recording of CustomPLLHistogram against full rate recording.
+
+Runs the same synthetic stream with clock_decimation=1 and checks, over the session:
+- decimation D records exactly every Dth clock and locked clock, also in compact storage
+- the envelope records, per window of D clocks, the clocks of the lowest and highest
+  clock - locked clock in it, to within the 1 ps of the locked clock stored as whole ps
+
+Then reports the memory of the clock rings and the getData() time of each setting.
+
+run from the repo root:
+    python -m benchmarks.pll_clock_decimation
+"""
+
+import time
+import numpy as np
+import TimeTagger
+
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+)
+
+
+def session(pll, blocks):
+    """clocks and locked clocks of all frames, and the mean getData() time"""
+    clocks, pclocks, times = [], [], []
+    for block in blocks:
+        pll.process(block, 0, 0)
+        t0 = time.perf_counter()
+        data = pll.getData()
+        times.append(time.perf_counter() - t0)
+        clocks.append(np.array(data[0]))
+        pclocks.append(np.array(data[1]))
+    return np.concatenate(clocks), np.concatenate(pclocks), np.mean(times)
+
+
+def clock_ring_bytes(pll):
+    b = pll.active
+    return b.clock_data.nbytes + b.lclock_data.nbytes + b.lclock_data_dec.nbytes
+
+
+def report(name, pll, n_clocks, get_data_time):
+    print(
+        f"{name:>22}: {n_clocks:7d} clocks, clock rings "
+        f"{clock_ring_bytes(pll) / 2**20:7.2f} MiB per buffer set, "
+        f"getData {get_data_time * 1e3:.3f} ms"
+    )
+
+
+def main(duration=0.4e12, singles_rate=5e6, decimation=16):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    tags = make_tag_stream(duration, singles_rate=singles_rate, clock_wander=0.5)
+    blocks = split_blocks(tags, 0.02e12)
+    n_bins = max(len(b) for b in blocks)
+
+    pll = make_pll(tagger, n_bins, clock_decimation=1)
+    clocks, pclocks, elapsed = session(pll, blocks)
+    report("full rate", pll, len(clocks), elapsed)
+    del pll
+
+    for compact in (False, True):
+        pll = make_pll(tagger, n_bins, clock_decimation=decimation, compact=compact)
+        dec_clocks, dec_pclocks, elapsed = session(pll, blocks)
+        assert np.array_equal(dec_clocks, clocks[::decimation])
+        assert np.array_equal(dec_pclocks, pclocks[::decimation])
+        report(f"1 in {decimation}" + (", compact" if compact else ""), pll, len(dec_clocks), elapsed)
+        del pll
+
+    pll = make_pll(tagger, n_bins, clock_decimation=decimation, clock_envelope=True)
+    env_clocks, env_pclocks, elapsed = session(pll, blocks)
+    report(f"envelope of {decimation}", pll, len(env_clocks), elapsed)
+    del pll
+    n_windows = len(clocks) // decimation
+    error = (clocks - pclocks)[: n_windows * decimation].reshape(n_windows, decimation)
+    window = np.searchsorted(clocks, env_clocks) // decimation
+    assert np.isin(env_clocks, clocks).all()
+    assert np.array_equal(np.unique(window), np.arange(n_windows))
+    env_error = env_clocks - env_pclocks
+    low = np.full(n_windows, np.inf)
+    high = np.full(n_windows, -np.inf)
+    np.minimum.at(low, window, env_error)
+    np.maximum.at(high, window, env_error)
+    assert np.abs(low - error.min(axis=1)).max() <= 1
+    assert np.abs(high - error.max(axis=1)).max() <= 1
+    print(f"decimated clocks are exact, envelope of {n_windows} windows within 1 ps")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compact storage of CustomPLLHistogram against the float64 path.
+
+Runs the same synthetic stream through both and checks the precision loss:
+- clocks, locked clocks, diffs, histograms and coincidence counts are identical
+- positions differ by at most half a position_resolution
+- clocks still decode when clock_decimation periods step past int32 (~2.1 ms)
+
+Then reports the memory of one buffer set and the getData() time, and checks that
+without store_tags the tag rings stay empty until request_tags(), and are freed again by
+release_tags().
+
+run from the repo root:
+    python -m benchmarks.pll_compact
+"""
+
+import time
+import numpy as np
+import TimeTagger
+
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+)
+
+POSITIONS = (2, 3, 4, 5, 6, 7)  # getData() entries holding positions in ps
+EXACT = (0, 1, 8, 9, 10, 11, 12, 13, 14)
+
+
+def frames(pll, blocks):
+    out = []
+    for i, block in enumerate(blocks):
+        pll.process(block, 0, 0)
+        if i % 4 == 3:
+            t0 = time.perf_counter()
+            data = pll.getData()
+            elapsed = time.perf_counter() - t0
+            out.append(([np.array(d) for d in data], elapsed))
+    return out
+
+
+def main(duration=0.4e12, singles_rate=5e6):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    tags = make_tag_stream(duration, singles_rate=singles_rate, pair_fraction=0.3)
+    blocks = split_blocks(tags, 0.025e12)
+    n_bins = len(tags)
+
+    pll = make_pll(tagger, n_bins, store_tags=True)
+    reference = frames(pll, blocks)
+    print(f"float64: {pll.active.nbytes() / 2**20:7.1f} MiB per buffer set, "
+          f"getData {np.mean([t for _, t in reference]) * 1e3:.2f} ms")
+    del pll
+
+    for position_dtype, resolution in ((np.uint16, 0.01), (np.int32, 0.001)):
+        pll = make_pll(
+            tagger,
+            n_bins,
+            store_tags=True,
+            compact=True,
+            position_dtype=position_dtype,
+            position_resolution=resolution,
+        )
+        result = frames(pll, blocks)
+        max_error = 0.0
+        for (ref, _), (data, _) in zip(reference, result):
+            for i in EXACT:
+                assert np.array_equal(ref[i], data[i]), f"entry {i} differs"
+            for i in POSITIONS:
+                if len(ref[i]):
+                    max_error = max(max_error, np.abs(ref[i] - data[i]).max())
+        assert max_error <= resolution / 2 * (1 + 1e-9), max_error
+        print(
+            f"{np.dtype(position_dtype).name:>7} at {resolution} ps: "
+            f"{pll.active.nbytes() / 2**20:7.1f} MiB per buffer set, "
+            f"getData {np.mean([t for _, t in result]) * 1e3:.2f} ms, "
+            f"max position error {max_error:.5f} ps (bound {resolution / 2} ps)"
+        )
+        del pll
+
+    # 256 clocks of ~12.2 us step the locked clock by ~3.1 ms between records
+    decimated = dict(store_tags=True, clock_decimation=256)
+    reference = frames(make_pll(tagger, n_bins, **decimated), blocks)
+    result = frames(make_pll(tagger, n_bins, compact=True, **decimated), blocks)
+    for (ref, _), (data, _) in zip(reference, result):
+        for i in (0, 1):
+            assert np.array_equal(ref[i], data[i]), f"entry {i} differs at clock_decimation=256"
+    print("clocks at clock_decimation=256: identical")
+
+    pll = make_pll(tagger, n_bins)
+    without_tags = pll.active.nbytes() + pll.spare.nbytes()
+    pll.process(blocks[0], 0, 0)
+    pll.request_tags()
+    with_tags = pll.active.nbytes() + pll.spare.nbytes()
+    pll.getData()
+    pll.process(blocks[1], 0, 0)
+    data = pll.getData()
+    assert len(data[2]) and len(data[9]) == len(data[2])
+    pll.process(blocks[2], 0, 0)
+    pll.release_tags()
+    data = pll.getData()
+    assert len(data[2]) == 0 and pll.active.nbytes() + pll.spare.nbytes() == without_tags
+    print(
+        f"float64, both buffer sets: {without_tags / 2**20:7.1f} MiB without stored tags, "
+        f"{with_tags / 2**20:7.1f} MiB after request_tags()"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Per-block dispatch cost of CustomPLLHistogram.process().
+
+Feeds many tiny blocks (one clock tag and a couple of detections) so the time per call is
+dominated by the Python -> numba call overhead rather than by the tag loop.
+
+The baseline is the per-call setup process() had before the state record: every scalar
+of the PLL passed into the kernel as an argument, and a tuple of 15 results unpacked
+back onto self. ScalarArgsPLL replays that around the same kernel, so the two differ in
+the dispatch only, and both must fill the same histograms.
+
+run from the repo root:
+    python -m benchmarks.pll_dispatch
+"""
+
+import time
+import numba
+import numpy as np
+import TimeTagger
+
+from CustomPLLHistogram import CustomPLLHistogram
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    CLOCK_CHANNEL,
+    DATA_CHANNEL_1,
+    DATA_CHANNEL_2,
+    PERIOD,
+    PLL_SETTINGS,
+)
+
+# the scalars the kernel took as arguments, and the results it returned
+ARGUMENTS = (
+    "data_channel_1",
+    "data_channel_2",
+    "clock_channel",
+    "init",
+    "clock0",
+    "period",
+    "phi_old",
+    "deriv",
+    "prop",
+    "phase",
+    "mult",
+    "clock_idx",
+    "hist_1_idx",
+    "hist_2_idx",
+    "coinc_idx",
+    "full_coinc_idx",
+    "cycle",
+    "coincidence",
+    "walk_inv_res",
+    "prev_raw_1",
+    "prev_raw_2",
+)
+RESULTS = (
+    "clock0",
+    "period",
+    "phi_old",
+    "init",
+    "clock_idx",
+    "hist_1_idx",
+    "hist_2_idx",
+    "prev_raw_1",
+    "prev_raw_2",
+    "coinc_idx",
+    "full_coinc_idx",
+    "cycle",
+    "coincidence",
+    "buffer_cycle",
+    "general_buffer_cycle",
+)
+
+
+def scalar_args_call(kernel):
+    """kernel behind the old signature: the scalars in, a tuple of results out"""
+
+    @numba.njit(nogil=True)
+    def call(
+        tags, state, clock_data, lclock_data, lclock_data_dec, hist_1_tags_data,
+        hist_2_tags_data, diff_1_data, diff_2_data, walk_offset_1, walk_offset_2,
+        coinc_1, coinc_2, full_coinc_1, full_coinc_2, hist_counts, windows,
+        window_state, window_counts, accidental_offsets, accidental_history,
+        accidental_idx, accidental_counts, data_channel_1, data_channel_2,
+        clock_channel, init, clock0, period, phi_old, deriv, prop, phase, mult,
+        clock_idx, hist_1_idx, hist_2_idx, coinc_idx, full_coinc_idx, cycle,
+        coincidence, walk_inv_res, prev_raw_1, prev_raw_2,
+    ):
+        st = state[0]
+        st.data_channel_1 = data_channel_1
+        st.data_channel_2 = data_channel_2
+        st.clock_channel = clock_channel
+        st.init = init
+        st.clock0 = clock0
+        st.period = period
+        st.phi_old = phi_old
+        st.deriv = deriv
+        st.prop = prop
+        st.phase = phase
+        st.mult = mult
+        st.clock_idx = clock_idx
+        st.hist_1_idx = hist_1_idx
+        st.hist_2_idx = hist_2_idx
+        st.coinc_idx = coinc_idx
+        st.full_coinc_idx = full_coinc_idx
+        st.cycle = cycle
+        st.coincidence = coincidence
+        st.walk_inv_res = walk_inv_res
+        st.prev_raw_1 = prev_raw_1
+        st.prev_raw_2 = prev_raw_2
+        kernel(
+            tags, state, clock_data, lclock_data, lclock_data_dec, hist_1_tags_data,
+            hist_2_tags_data, diff_1_data, diff_2_data, walk_offset_1, walk_offset_2,
+            coinc_1, coinc_2, full_coinc_1, full_coinc_2, hist_counts, windows,
+            window_state, window_counts, accidental_offsets, accidental_history,
+            accidental_idx, accidental_counts,
+        )
+        return (
+            st.clock0,
+            st.period,
+            st.phi_old,
+            st.init,
+            st.clock_idx,
+            st.hist_1_idx,
+            st.hist_2_idx,
+            st.prev_raw_1,
+            st.prev_raw_2,
+            st.coinc_idx,
+            st.full_coinc_idx,
+            st.cycle,
+            st.coincidence,
+            st.buffer_cycle,
+            st.general_buffer_cycle,
+        )
+
+    return call
+
+
+class ScalarArgsPLL(CustomPLLHistogram):
+    """CustomPLLHistogram with the per-call setup of the scalar argument kernel."""
+
+    def process(self, incoming_tags, begin_time, end_time):
+        if not hasattr(self, "call"):
+            self.call = scalar_args_call(self.kernel_variant())
+            for name in ARGUMENTS:
+                setattr(self, name, self.state[0][name].item())
+        b = self.active
+        results = self.call(
+            incoming_tags,
+            self.state,
+            b.clock_data,
+            b.lclock_data,
+            b.lclock_data_dec,
+            b.hist_1_tags_data,
+            b.hist_2_tags_data,
+            b.diff_1_data,
+            b.diff_2_data,
+            self.walk_offset_1,
+            self.walk_offset_2,
+            b.coinc_1,
+            b.coinc_2,
+            b.full_coinc_1,
+            b.full_coinc_2,
+            b.hist_counts,
+            self.coincidence_windows,
+            self.window_state,
+            b.window_counts,
+            self.accidental_offsets,
+            self.accidental_history,
+            self.accidental_idx,
+            b.accidental_counts,
+            *(getattr(self, name) for name in ARGUMENTS),
+        )
+        for name, value in zip(RESULTS, results):
+            setattr(self, name, value)
+        self.wake_get_data(begin_time, end_time)
+
+    def getData(self, *args, **kwargs):
+        data = super().getData(*args, **kwargs)
+        # getData() reset the counters in the record, the scalars follow
+        for name in RESULTS[4:7] + RESULTS[9:11] + ("coincidence",):
+            setattr(self, name, 0)
+        return data
+
+
+def run(pll, tags, clocks, blocks):
+    # warm up: initializes the PLL and compiles the kernel
+    pll.process(tags[: clocks[50]], 0, 0)
+    histograms = 0
+    t0 = time.perf_counter()
+    for i, block in enumerate(blocks):
+        pll.process(block, 0, 0)
+        if i % 10000 == 0:
+            histograms = histograms + pll.getData()[12]  # keep the buffers from filling
+    elapsed = time.perf_counter() - t0
+    return elapsed, histograms + pll.getData()[12]
+
+
+def main(n_calls=200000):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+
+    tags = make_tag_stream(PERIOD * (n_calls + 100), singles_rate=2e5)
+    clocks = np.flatnonzero(tags["channel"] == CLOCK_CHANNEL)
+    # one block per clock period, so timestamps keep increasing from call to call
+    blocks = [tags[a:b] for a, b in zip(clocks[50:-1], clocks[51:])][:n_calls]
+    print(f"average tags per block: {np.mean([len(b) for b in blocks]):.1f}")
+
+    baseline = ScalarArgsPLL(
+        tagger, DATA_CHANNEL_1, DATA_CHANNEL_2, CLOCK_CHANNEL, n_bins=4000000, **PLL_SETTINGS
+    )
+    elapsed, reference = run(baseline, tags, clocks, blocks)
+    del baseline
+    print(f"scalar arguments: {elapsed / n_calls * 1e6:.2f} us per block")
+
+    elapsed_record, histograms = run(make_pll(tagger, 4000000), tags, clocks, blocks)
+    assert np.array_equal(histograms, reference)
+    print(
+        f"state record:     {elapsed_record / n_calls * 1e6:.2f} us per block, "
+        f"{elapsed / elapsed_record:.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Time the GUI thread spends getting PLL frames, with and without PLLFrameWorker.
+
+A feeder thread plays the backend and calls process() with 1 ms blocks of the synthetic
+stream, paced in real time. The main thread plays the GUI: a 50 ms timer tick that gets
+a frame and then renders for render_time, with a stall of stall_time every 20 ticks.
+Once calling getData() on the GUI thread, as draw() used to, and once taking the latest
+frame of a PLLFrameWorker. Reports the time per tick spent on getting the frame and the
+frames the worker took, dropped from its full queue and skipped.
+
+First it checks that a short frame, with fewer than 2 recorded clocks, is merged into
+the next one: the merged frame must equal the one frame a second PLL takes over both.
+
+run from the repo root:
+    python -m benchmarks.pll_frame_worker
+"""
+
+import time
+import threading
+import numpy as np
+import TimeTagger
+
+from pll_frames import PLLFrameWorker
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+    PERIOD,
+)
+
+
+def percentiles(times):
+    times = np.array(times) * 1e3
+    return f"median {np.median(times):7.2f} ms, 99% {np.percentile(times, 99):7.2f} ms, max {times.max():7.2f} ms"
+
+
+def feed(pll, blocks, done):
+    t_start = time.perf_counter()
+    for i, block in enumerate(blocks):
+        # the backend hands over one block per ms
+        wait = t_start + i * 1e-3 - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        pll._lock()
+        pll.process(block, block["time"][0], block["time"][-1])
+        pll._unlock()
+    done.set()
+
+
+def gui(get_frame, done, tick=0.05, render_time=0.01, stall_time=0.3):
+    """GUI timer ticks until done, the time get_frame() took in each"""
+    frame_times = []
+    n_ticks = 0
+    while not done.is_set():
+        time.sleep(tick)
+        t0 = time.perf_counter()
+        get_frame()
+        frame_times.append(time.perf_counter() - t0)
+        n_ticks += 1
+        time.sleep(stall_time if n_ticks % 20 == 0 else render_time)
+    return frame_times
+
+
+def session(tagger, blocks, worker):
+    pll = make_pll(tagger, store_tags=True)
+    pll.process(blocks[0], blocks[0]["time"][0], blocks[0]["time"][-1])  # compile and initialize
+    done = threading.Event()
+    thread = threading.Thread(target=feed, args=(pll, blocks[1:], done))
+    if worker:
+        frames = PLLFrameWorker(pll, frame_time=0.05).start()
+        thread.start()
+        frame_times = gui(frames.latest, done)
+        frames.stop()
+        counts = frames.frame_counts()
+    else:
+        thread.start()
+        frame_times = gui(lambda: pll.getData(timeout=0.2), done)
+        counts = None
+    thread.join()
+    return frame_times, counts
+
+
+def check_short_frames(tagger):
+    tags = make_tag_stream(0.1e12)
+    # a block to lock on, a few clocks, and the rest
+    start = tags["time"][0] + 0.05e12
+    cuts = np.searchsorted(tags["time"], (start, start + 4 * PERIOD))
+    first, short, rest = np.split(tags, cuts)
+
+    pll = make_pll(tagger, store_tags=True)
+    worker = PLLFrameWorker(pll)
+    pll.process(first, 0, 0)
+    pll.getData()
+    pll.process(short, 0, 0)
+    data = pll.getData()
+    assert len(data[0]) < 2
+    worker.keep_short_frame(data, pll.frame_locked)
+    pll.process(rest, 0, 0)
+    merged = worker.merge_short_frame(pll.getData())
+
+    pll = make_pll(tagger, store_tags=True)
+    pll.process(first, 0, 0)
+    pll.getData()
+    pll.process(short, 0, 0)
+    pll.process(rest, 0, 0)
+    for i, (a, b) in enumerate(zip(merged, pll.getData())):
+        assert np.array_equal(a, b), f"entry {i} differs"
+    print(f"short frame of {len(short)} tags merged into the next: identical")
+
+
+def main(duration=4e12, singles_rate=2.5e6):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    check_short_frames(tagger)
+    tags = make_tag_stream(duration, singles_rate=singles_rate)
+    blocks = split_blocks(tags, 1e9)  # 1 ms of tags per process() call
+    print(f"{len(tags) / duration * 1e12 / 1e6:.1f}M tags/s in {len(blocks)} blocks")
+
+    frame_times, _ = session(tagger, blocks, worker=False)
+    print("getData() on the GUI thread: ", percentiles(frame_times))
+    frame_times, counts = session(tagger, blocks, worker=True)
+    print("PLLFrameWorker.latest():     ", percentiles(frame_times))
+    print(
+        f"worker took {counts['taken']} frames, dropped {counts['dropped']} from the full "
+        f"queue, the GUI skipped {counts['skipped']}, {counts['merged']} with a short "
+        f"frame merged in"
+    )
+
+
+if __name__ == "__main__":
+    main()
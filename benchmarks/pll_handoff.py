@@ -0,0 +1,82 @@
+"""
+Lock hold time of CustomPLLHistogram.getData() and the stall it causes in process().
+
+A feeder thread plays the backend: it takes the measurement lock and calls process()
+with 1 ms blocks of a 5M tags/s stream, paced in real time. The main thread plays the
+GUI and calls getData() every 50 ms. Reported are the time getData() holds the lock and
+the time the feeder waits for it.
+
+run from the repo root:
+    python -m benchmarks.pll_handoff
+"""
+
+import time
+import threading
+import numpy as np
+import TimeTagger
+
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+)
+
+
+def percentiles(times):
+    times = np.array(times) * 1e6
+    return f"median {np.median(times):8.1f} us, 99% {np.percentile(times, 99):8.1f} us, max {times.max():8.1f} us"
+
+
+def main(duration=2e12, singles_rate=2.5e6, frame_time=0.05, store_tags=True):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    tags = make_tag_stream(duration, singles_rate=singles_rate)
+    blocks = split_blocks(tags, 1e9)  # 1 ms of tags per process() call
+    print(f"{len(tags) / duration * 1e12 / 1e6:.1f}M tags/s in {len(blocks)} blocks")
+
+    pll = make_pll(tagger, store_tags=store_tags)
+    pll.process(blocks[0], 0, 0)  # compile and initialize
+
+    # time how long getData() keeps the lock
+    hold_times = []
+    lock, unlock = pll._lock, pll._unlock
+    in_get_data = threading.local()
+
+    def timed_lock():
+        lock()
+        in_get_data.t0 = time.perf_counter()
+
+    def timed_unlock():
+        hold_times.append(time.perf_counter() - in_get_data.t0)
+        unlock()
+
+    stalls = []
+    done = threading.Event()
+
+    def feeder():
+        t_start = time.perf_counter()
+        for i, block in enumerate(blocks[1:]):
+            # the backend hands over one block per ms
+            wait = t_start + i * 1e-3 - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            t0 = time.perf_counter()
+            lock()
+            stalls.append(time.perf_counter() - t0)
+            pll.process(block, 0, 0)
+            unlock()
+        done.set()
+
+    thread = threading.Thread(target=feeder)
+    thread.start()
+    pll._lock, pll._unlock = timed_lock, timed_unlock
+    while not done.is_set():
+        time.sleep(frame_time)
+        pll.getData()
+    thread.join()
+
+    print("getData() lock hold: ", percentiles(hold_times[1:]))
+    print("process() lock wait: ", percentiles(stalls))
+
+
+if __name__ == "__main__":
+    main()
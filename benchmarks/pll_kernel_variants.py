@@ -0,0 +1,210 @@
+"""
+The kernel variants of pll_kernels.make_kernel() against CustomPLLHistogram.
+
+Runs SNSPDPLLHistogram, with and without the second channel, the time walk correction
+and coincidences, over the stream CustomPLLHistogram gets with the same settings, and
+checks that the clocks, histograms, tags and coincidences they share are bit for bit
+identical. Then checks the snspd defaults: the phase gate drops clocks a quarter period
+off, which would pull the loop filter, and proximity coincidences pair tags of the center
+window in the same period. Reports the throughput of every variant and, in a fresh
+interpreter with an empty numba cache, how long each first block takes to compile.
+
+run from the repo root:
+    python -m benchmarks.pll_kernel_variants
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import numpy as np
+import TimeTagger
+
+from CustomPLLHistogram import HIST_1, HIST_2, COINC_1, COINC_2
+from snspd_pll_histogram import SNSPDPLLHistogram
+from pll_kernels import TAG_DTYPE
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+    CLOCK_CHANNEL,
+    DATA_CHANNEL_1,
+    DATA_CHANNEL_2,
+    PERIOD,
+    PLL_SETTINGS,
+)
+
+# on top of PLL_SETTINGS
+SETTINGS = dict(
+    store_tags=True,
+    clock_decimation=1,
+    coincidence_windows=((90.0, 150.0),),
+)
+# (two channels, time walk, coincidences)
+VARIANTS = (
+    (False, False, False),
+    (False, True, False),
+    (True, False, False),
+    (True, True, False),
+    (True, False, True),
+    (True, True, True),
+)
+
+
+def walk_table(pll):
+    recovery = np.exp(-np.arange(200) / 40)
+    pll.load_time_walk_arrays(500, 30 * recovery, 20 * recovery)
+
+
+def make_variant(
+    tagger, n_bins, two_channels, time_walk, coincidences, proximity=False, phase_gate=False
+):
+    pll = SNSPDPLLHistogram(
+        tagger,
+        DATA_CHANNEL_1,
+        DATA_CHANNEL_2 if two_channels else None,
+        CLOCK_CHANNEL,
+        coincidences=coincidences,
+        proximity=proximity,
+        phase_gate=phase_gate,
+        n_bins=n_bins,
+        **PLL_SETTINGS,
+        **SETTINGS,
+    )
+    if time_walk:
+        walk_table(pll)
+    return pll
+
+
+def run(pll, blocks):
+    t0 = time.perf_counter()
+    for block in blocks:
+        pll.process(block, 0, 0)
+    return time.perf_counter() - t0
+
+
+def check(variant, data, reference):
+    two_channels, time_walk, coincidences = variant
+    assert np.array_equal(data[0], reference[0]) and np.array_equal(data[1], reference[1])
+    assert np.array_equal(data[2], reference[2])
+    assert np.array_equal(data[12][HIST_1], reference[12][HIST_1])
+    if two_channels:
+        assert np.array_equal(data[3], reference[3])
+        assert np.array_equal(data[12][HIST_2], reference[12][HIST_2])
+    else:
+        assert len(data[3]) == 0 and not data[12][HIST_2].any()
+    if coincidences:
+        for i in (4, 5, 6, 7, 8, 12, 13, 14):
+            assert np.array_equal(data[i], reference[i])
+    else:
+        assert len(data[4]) == 0 and not data[12][[COINC_1, COINC_2]].any()
+
+
+def with_quarter_clocks(tags, after, every=10):
+    """
+    tags with an extra clock tag a quarter period after every 10th clock from after on,
+    past the clocks lock is acquired from
+    """
+    clocks = tags[(tags["channel"] == CLOCK_CHANNEL) & (tags["time"] > after)][::every]
+    extra = np.zeros(len(clocks), dtype=TAG_DTYPE)
+    extra["channel"] = CLOCK_CHANNEL
+    extra["time"] = clocks["time"] + int(PERIOD / 4)
+    tags = np.concatenate((tags, extra))
+    return tags[np.argsort(tags["time"], kind="stable")]
+
+
+def check_snspd_defaults(tagger, tags, blocks, reference):
+    n_bins = len(tags)
+    gated = with_quarter_clocks(tags, blocks[1]["time"][0])
+    gated_blocks = split_blocks(gated, 0.05e12)
+    for phase_gate in (False, True):
+        pll = make_variant(tagger, n_bins, True, False, True, phase_gate=phase_gate)
+        run(pll, gated_blocks)
+        same = np.array_equal(pll.getFrame()[12], reference[12])
+        print(f"quarter period clocks, phase gate {phase_gate!s:>5}: histograms identical {same}")
+        assert same == phase_gate
+        del pll
+
+    pll = make_variant(tagger, n_bins, True, False, True, proximity=True)
+    run(pll, blocks)
+    frame = pll.getFrame()
+    window = SETTINGS["coincidence_windows"][0]
+    assert np.array_equal(frame[12][:2], reference[12][:2])
+    # pairs come from the same period, so their positions are within the window
+    assert len(frame[4]) and np.all(np.abs(frame[4] - frame[5]) < window[1] - window[0])
+    print(
+        f"proximity coincidences: {len(frame[4])} pairs, "
+        f"{reference[13][0]} same period center window pairs"
+    )
+    del pll
+
+
+def child():
+    """first block times of CustomPLLHistogram, then of every variant, in this process"""
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    tags = make_tag_stream(0.01e12)
+    times = {}
+    pll = make_pll(tagger, len(tags), **SETTINGS)
+    times["CustomPLLHistogram"] = run(pll, [tags])
+    for variant in VARIANTS:
+        pll = make_variant(tagger, len(tags), *variant)
+        times[str(variant)] = run(pll, [tags])
+    print(json.dumps(times))
+
+
+def compile_times():
+    env = dict(os.environ, NUMBA_CACHE_DIR=tempfile.mkdtemp())
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.pll_kernel_variants", "child"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(duration=0.4e12, singles_rate=5e6):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    tags = make_tag_stream(duration, singles_rate=singles_rate, pair_fraction=0.3)
+    blocks = split_blocks(tags, 0.05e12)
+    n_tags = sum(len(b) for b in blocks[1:])
+    n_bins = len(tags)
+
+    references = {}
+    for time_walk in (False, True):
+        pll = make_pll(tagger, n_bins, **SETTINGS)
+        if time_walk:
+            walk_table(pll)
+        run(pll, blocks[:1])
+        elapsed = run(pll, blocks[1:])
+        references[time_walk] = [np.array(d) for d in pll.getData()]
+        print(f"CustomPLLHistogram, time walk {time_walk!s:>5}: {n_tags / elapsed / 1e6:5.1f} Mtags/s")
+        del pll
+
+    for variant in VARIANTS:
+        pll = make_variant(tagger, n_bins, *variant)
+        run(pll, blocks[:1])
+        elapsed = run(pll, blocks[1:])
+        check(variant, pll.getFrame(), references[variant[1]])
+        del pll
+        two_channels, time_walk, coincidences = variant
+        print(
+            f"{'two channels' if two_channels else ' one channel'}, time walk {time_walk!s:>5}, "
+            f"coincidences {coincidences!s:>5}: {n_tags / elapsed / 1e6:5.1f} Mtags/s, identical"
+        )
+
+    check_snspd_defaults(tagger, tags, blocks, references[False])
+
+    print("first block with an empty numba cache, in order:")
+    for name, elapsed in compile_times().items():
+        print(f"{name:>22}: {elapsed:6.2f} s")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["child"]:
+        child()
+    else:
+        main()
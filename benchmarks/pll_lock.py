@@ -0,0 +1,56 @@
+"""
+Lock acquisition of CustomPLLHistogram.
+
+Fits period and phase over 2 (about what a first/last clock estimate gives) up to 1000
+initial clocks, and reports the time to lock, the rms residual of the clocks against the
+locked clocks for the first frames of 5 ms, and which frames getData() tags as locked.
+Then checks that discard_unlocked returns the frames before lock empty.
+
+run from the repo root:
+    python -m benchmarks.pll_lock
+"""
+
+import numpy as np
+import TimeTagger
+
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+)
+
+
+def frames(pll, blocks, blocks_per_frame=5):
+    for i, block in enumerate(blocks):
+        pll.process(block, 0, 0)
+        if i % blocks_per_frame == blocks_per_frame - 1:
+            yield pll.getData(), pll.frame_locked
+
+
+def main(duration=0.05e12, singles_rate=5e6, n_frames=6):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    tags = make_tag_stream(duration, singles_rate=singles_rate)
+    blocks = split_blocks(tags, 1e9)  # 1 ms per process() call
+
+    for acquire_clocks in (2, 10, 100, 1000):
+        pll = make_pll(tagger, len(tags), acquire_clocks=acquire_clocks)
+        residuals, tagged = [], []
+        for data, locked in frames(pll, blocks):
+            residual = (data[0] - data[1]).astype(np.float64)
+            residuals.append(f"{residual.std():6.2f}")
+            tagged.append("L" if locked else "-")
+        print(
+            f"{acquire_clocks:>5} clocks: lock after {pll.time_to_lock() * 1e3:5.2f} ms, "
+            f"frames {''.join(tagged[:n_frames])}, "
+            f"clock residual rms {' '.join(residuals[:n_frames])} ps"
+        )
+        del pll
+
+    pll = make_pll(tagger, len(tags), acquire_clocks=2, discard_unlocked=True)
+    for data, locked in frames(pll, blocks):
+        assert (len(data[0]) > 0) == locked
+    print("discard_unlocked returns exactly the unlocked frames empty")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+MultiChannelPLLHistogram against CustomPLLHistogram, and its cost per channel.
+
+With two data channels, the per-channel histograms must equal the HIST_1 and HIST_2 rows
+of CustomPLLHistogram, the lock detector must lock on the same clock, and the pair counts
+come close to its center window and full coincidence counts. They differ for periods
+with two tags on one channel, which CustomPLLHistogram pairs with each other and this
+measurement doesn't. With the same time walk tables loaded into both, the histograms
+must still be equal.
+Then streams of several independent channel pairs are merged, and the coincidence
+matrix and throughput are reported for 2 to 8 channels.
+
+run from the repo root:
+    python -m benchmarks.pll_multichannel
+"""
+
+import time
+import numpy as np
+import TimeTagger
+
+from CustomPLLHistogram import HIST_1, HIST_2
+from MultiChannelPLLHistogram import MultiChannelPLLHistogram
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+    CLOCK_CHANNEL,
+    DATA_CHANNEL_1,
+    DATA_CHANNEL_2,
+    PLL_SETTINGS,
+)
+
+
+def pair_streams(duration, n_pairs, singles_rate, pair_fraction):
+    """
+    n_pairs independent channel pairs against one clock: pair p is on channels
+    2p + 1 and 2p + 2 (the first pair keeps DATA_CHANNEL_1 and DATA_CHANNEL_2).
+    """
+    parts = []
+    channels = []
+    for p in range(n_pairs):
+        tags = make_tag_stream(
+            duration, singles_rate=singles_rate, pair_fraction=pair_fraction, seed=p
+        )
+        if p == 0:
+            channels += [DATA_CHANNEL_1, DATA_CHANNEL_2]
+        else:
+            tags = tags[tags["channel"] != CLOCK_CHANNEL]
+            for old, new in ((DATA_CHANNEL_1, 2 * p + 1), (DATA_CHANNEL_2, 2 * p + 2)):
+                tags["channel"][tags["channel"] == old] = new
+            channels += [2 * p + 1, 2 * p + 2]
+        parts.append(tags)
+    tags = np.concatenate(parts)
+    return tags[np.argsort(tags["time"], kind="stable")], channels
+
+
+def run(pll, blocks):
+    t0 = time.perf_counter()
+    for block in blocks:
+        pll.process(block, 0, 0)
+    return time.perf_counter() - t0
+
+
+def main(duration=0.2e12, singles_rate=5e6, pair_fraction=0.3):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+
+    tags = make_tag_stream(duration, singles_rate=singles_rate, pair_fraction=pair_fraction)
+    blocks = split_blocks(tags, 0.05e12)
+    pll = make_pll(tagger, len(tags))
+    multi = MultiChannelPLLHistogram(
+        tagger, [DATA_CHANNEL_1, DATA_CHANNEL_2], CLOCK_CHANNEL, **PLL_SETTINGS
+    )
+    run(pll, blocks)
+    run(multi, blocks)
+    data = pll.getData()
+    histograms, coincidences, full_coincidences, n_clocks, period, _ = multi.getData()
+    assert np.array_equal(histograms[0], data[12][HIST_1])
+    assert np.array_equal(histograms[1], data[12][HIST_2])
+    assert multi.state[0]["locked"] and multi.state[0]["lock_time"] == pll.state[0]["lock_time"]
+    print(
+        f"2 channels: center window pairs {coincidences[0, 1]} "
+        f"(CustomPLLHistogram {data[13][0]}), all pairs {full_coincidences[0, 1]} "
+        f"(CustomPLLHistogram {len(data[6])})"
+    )
+    del pll, multi
+
+    # an offset that falls with the time since the previous tag on the channel
+    res = 500
+    offset_1 = np.linspace(-300, 0, 200)
+    offset_2 = np.linspace(-150, 0, 200)
+    pll = make_pll(tagger, len(tags))
+    pll.load_time_walk_arrays(res, offset_1, offset_2)
+    multi = MultiChannelPLLHistogram(
+        tagger, [DATA_CHANNEL_1, DATA_CHANNEL_2], CLOCK_CHANNEL, **PLL_SETTINGS
+    )
+    multi.load_time_walk_arrays(res, [offset_1, offset_2])
+    run(pll, blocks)
+    run(multi, blocks)
+    data = pll.getData()
+    histograms = multi.getData()[0]
+    assert np.array_equal(histograms[0], data[12][HIST_1])
+    assert np.array_equal(histograms[1], data[12][HIST_2])
+    print("2 channels with time walk correction: histograms identical")
+    del pll, multi
+
+    for n_pairs in (1, 2, 4):
+        tags, channels = pair_streams(duration, n_pairs, singles_rate, pair_fraction)
+        blocks = split_blocks(tags, 0.05e12)
+        best = None
+        for repeat in range(3):
+            multi = MultiChannelPLLHistogram(tagger, channels, CLOCK_CHANNEL, **PLL_SETTINGS)
+            run(multi, blocks[:1])  # compile and initialize
+            elapsed = run(multi, blocks[1:])
+            best = elapsed if best is None else min(best, elapsed)
+            coincidences = multi.getData()[1]
+            del multi
+        n_tags = sum(len(b) for b in blocks[1:])
+        print(f"{len(channels)} channels: {n_tags / best / 1e6:.1f} Mtags/s")
+    print("center window coincidence matrix, singles on the diagonal:")
+    print(coincidences)
+
+
+if __name__ == "__main__":
+    main()
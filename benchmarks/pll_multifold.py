@@ -0,0 +1,81 @@
+"""
+n-fold coincidences of MultiChannelPLLHistogram.
+
+Two copies of one synthetic stream are merged on four channels, so every period with a
+center window pair on the first copy is a four-fold coincidence. Checks that:
+- the four-fold count equals the three-fold count of a measurement on three of the channels
+- it comes close to the center window pairs of the first copy
+Then reports the counts per combination and the throughput with and without n-fold
+collection.
+
+run from the repo root:
+    python -m benchmarks.pll_multifold
+"""
+
+import time
+import numpy as np
+import TimeTagger
+
+from MultiChannelPLLHistogram import MultiChannelPLLHistogram
+from benchmarks.synthetic_tags import (
+    make_tag_stream,
+    split_blocks,
+    CLOCK_CHANNEL,
+    DATA_CHANNEL_1,
+    DATA_CHANNEL_2,
+    PLL_SETTINGS,
+)
+
+CHANNELS = [DATA_CHANNEL_1, DATA_CHANNEL_2, 3, 4]
+
+
+def copied_stream(duration, singles_rate, pair_fraction):
+    tags = make_tag_stream(duration, singles_rate=singles_rate, pair_fraction=pair_fraction)
+    copy = tags[tags["channel"] != CLOCK_CHANNEL]
+    for old, new in ((DATA_CHANNEL_1, 3), (DATA_CHANNEL_2, 4)):
+        copy["channel"][copy["channel"] == old] = new
+    tags = np.concatenate((tags, copy))
+    return tags[np.argsort(tags["time"], kind="stable")]
+
+
+def run(pll, blocks):
+    t0 = time.perf_counter()
+    for block in blocks:
+        pll.process(block, 0, 0)
+    return time.perf_counter() - t0
+
+
+def main(duration=0.2e12, singles_rate=5e6, pair_fraction=0.3):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    blocks = split_blocks(copied_stream(duration, singles_rate, pair_fraction), 0.05e12)
+
+    four = MultiChannelPLLHistogram(tagger, CHANNELS, CLOCK_CHANNEL, **PLL_SETTINGS)
+    three = MultiChannelPLLHistogram(tagger, CHANNELS[:3], CLOCK_CHANNEL, **PLL_SETTINGS)
+    run(four, blocks)
+    run(three, blocks)
+    _, coincidences, _, _, _, multifold_counts = four.getData()
+    combinations = four.combinations(multifold_counts)
+    four_fold = combinations.get(tuple(CHANNELS), 0)
+    three_fold = three.combinations(three.getData()[5], fold=3).get(tuple(CHANNELS[:3]), 0)
+    assert four_fold == three_fold, (four_fold, three_fold)
+    print(f"four-fold {four_fold}, center window pairs of the first copy {coincidences[0, 1]}")
+    for channels, count in sorted(combinations.items(), key=lambda item: -item[1]):
+        print(f"{str(channels):>18}: {count}")
+    del four, three
+
+    for name, multifold_channels in (("pairs only", CHANNELS[:2]), ("n-fold", CHANNELS)):
+        best = None
+        for repeat in range(3):
+            multi = MultiChannelPLLHistogram(
+                tagger, CHANNELS, CLOCK_CHANNEL, multifold_channels=multifold_channels, **PLL_SETTINGS
+            )
+            run(multi, blocks[:1])  # compile and initialize
+            elapsed = run(multi, blocks[1:])
+            best = elapsed if best is None else min(best, elapsed)
+            del multi
+        n_tags = sum(len(b) for b in blocks[1:])
+        print(f"4 channels, {name:>10}: {n_tags / best / 1e6:.1f} Mtags/s")
+
+
+if __name__ == "__main__":
+    main()
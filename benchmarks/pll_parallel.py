@@ -0,0 +1,62 @@
+"""
+Thread scaling of the parallel PLL kernel.
+
+Checks that the parallel kernel gives bit for bit the same getData() output as the
+single loop kernel, then reports its throughput for 1 up to numba's thread count.
+The thread count can be raised above the number of cores with NUMBA_NUM_THREADS to
+test the chunk stitching.
+
+run from the repo root:
+    python -m benchmarks.pll_parallel
+"""
+
+import time
+import numba
+import numpy as np
+import TimeTagger
+
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+)
+
+
+def run(pll, blocks):
+    t0 = time.perf_counter()
+    for block in blocks:
+        pll.process(block, 0, 0)
+    return time.perf_counter() - t0
+
+
+def main(duration=0.4e12, singles_rate=10e6, pair_fraction=0.3):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    tags = make_tag_stream(duration, singles_rate=singles_rate, pair_fraction=pair_fraction)
+    blocks = split_blocks(tags, 0.05e12)
+    n_tags = sum(len(b) for b in blocks[1:])
+    print(f"{len(tags)} tags in {len(blocks)} blocks, {numba.get_num_threads()} threads available")
+
+    pll = make_pll(tagger, len(tags), store_tags=True)
+    run(pll, blocks)
+    reference = pll.getData()
+    del pll
+
+    for n_threads in range(1, numba.config.NUMBA_NUM_THREADS + 1):
+        best = None
+        for repeat in range(3):
+            pll = make_pll(
+                tagger, len(tags), store_tags=True, parallel=True, n_threads=n_threads
+            )
+            run(pll, blocks[:1])  # compile and initialize
+            elapsed = run(pll, blocks[1:])
+            best = elapsed if best is None else min(best, elapsed)
+        identical = all(np.array_equal(a, b) for a, b in zip(reference, pll.getData()))
+        del pll
+        print(
+            f"{n_threads:>3} threads: {n_tags / best / 1e6:.1f} Mtags/s, "
+            f"bit for bit identical: {identical}"
+        )
+
+
+if __name__ == "__main__":
+    main()
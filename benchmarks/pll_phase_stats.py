@@ -0,0 +1,84 @@
+"""
+Phase error statistics kept by the PLL kernel against the clock arrays.
+
+Checks, frame by frame and over the session, that count, mean, std, min and max of
+phase_error() agree with clocks - pclocks from getData(). They differ by up to 1 ps
+because the locked clocks are stored as whole ps. Beyond that, a locked clock already
+includes the frequency step of its own clock, while the statistics take the phase
+detector's error before it. Then compares the time of reading the
+statistics with the clock array arithmetic draw() used to do.
+
+run from the repo root:
+    python -m benchmarks.pll_phase_stats
+"""
+
+import time
+import numpy as np
+import TimeTagger
+
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+)
+
+
+def clock_arrays(clocks, pclocks, divider=2):
+    """what draw() computed from the clock arrays every frame"""
+    clocks_div = clocks[::divider]
+    pclocks_div = pclocks[::divider]
+    step = int((pclocks_div[-1] - pclocks_div[0]) / (len(pclocks_div) - 1))
+    basis_div = np.arange(pclocks_div[0], pclocks_div[-1] + step, step, dtype=np.int64)
+    basis_div = basis_div[: len(clocks_div)]
+    clock_clean = basis_div - pclocks_div
+    final_offset = np.linspace(clock_clean[0], clock_clean[-1], len(clock_clean))
+    return basis_div - clocks_div - final_offset, clock_clean - final_offset
+
+
+def main(duration=0.4e12, singles_rate=5e6):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    tags = make_tag_stream(duration, singles_rate=singles_rate, clock_wander=0.5)
+    blocks = split_blocks(tags, 0.02e12)
+    pll = make_pll(
+        tagger,
+        max(len(b) for b in blocks),
+        clock_decimation=1,  # every clock, to check against
+    )
+    errors = []
+    stats_time, arrays_time = [], []
+    for block in blocks:
+        pll.process(block, 0, 0)
+        clocks, pclocks = pll.getData()[:2]
+        error = (clocks - pclocks).astype(np.float64)
+        errors.append(error)
+
+        t0 = time.perf_counter()
+        stats = pll.phase_error()
+        stats_time.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        clock_arrays(clocks, pclocks)
+        arrays_time.append(time.perf_counter() - t0)
+
+        assert stats["count"] == len(error) == stats["counts"].sum()
+        assert abs(stats["mean"] - error.mean()) < 1
+        assert abs(stats["std"] - error.std(ddof=1)) < 1
+        assert abs(stats["min"] - error.min()) < 1.5
+        assert abs(stats["max"] - error.max()) < 1.5
+
+    error = np.concatenate(errors)
+    session = pll.phase_error(session=True)
+    assert session["count"] == len(error)
+    assert abs(session["mean"] - error.mean()) < 1
+    assert abs(session["std"] - error.std(ddof=1)) < 0.1
+    print(
+        f"{len(blocks)} frames agree, session: mean {session['mean']:.2f} ps, "
+        f"std {session['std']:.2f} ps over {session['count']} clocks"
+    )
+    print(
+        f"phase_error(): {np.median(stats_time) * 1e6:.1f} us per frame, "
+        f"clock arrays: {np.median(arrays_time) * 1e6:.1f} us per frame"
+    )
+
+
+if __name__ == "__main__":
+    main()
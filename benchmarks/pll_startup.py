@@ -0,0 +1,98 @@
+"""
+Time from application launch to the first processed PLL block.
+
+Every run is a fresh interpreter that imports CustomPLLHistogram, spends launch_time
+bringing up the application, then creates the measurement and processes one block, as
+clockRefMode does. With precompile the kernels are compiled on a background thread right
+after the import. Then, a while later, a time walk table is loaded, as TimeWalkAnalysis
+does, and the first block of the time walk kernel is timed too. Runs with an empty numba
+cache (a fresh install or a cache miss) and with a warm one.
+
+run from the repo root:
+    python -m benchmarks.pll_startup
+"""
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+from time import perf_counter, sleep
+
+LAUNCHED = perf_counter()
+
+
+def child(precompile, launch_time):
+    import TimeTagger
+    import numpy as np
+    from CustomPLLHistogram import precompile_in_background
+    from benchmarks.synthetic_tags import (
+        make_pll,
+        make_tag_stream,
+        PERIOD,
+    )
+
+    if precompile:
+        thread = precompile_in_background()
+    tags = make_tag_stream(0.01e12)
+    tags.flags.writeable = False  # as the backend hands them over
+    sleep(max(0.0, LAUNCHED + launch_time - perf_counter()))
+
+    pll = make_pll(TimeTagger.createTimeTaggerVirtual())
+    t0_first = perf_counter()
+    pll.process(tags, 0, 0)
+    done = perf_counter()
+
+    # the time walk analysis starts long after launch, by then precompile() is done
+    if precompile:
+        thread.join()
+    later = make_tag_stream(0.01e12, start_time=1_000_000 + PERIOD * 1000)
+    later.flags.writeable = False
+    pll.load_time_walk_arrays(500, np.zeros(100), np.zeros(100))
+    t0 = perf_counter()
+    pll.process(later, 0, 0)
+    walk_block = perf_counter() - t0
+    print(
+        json.dumps(
+            {
+                "first_block": done - t0_first,
+                "launch_to_first_block": done - LAUNCHED,
+                "first_time_walk_block": walk_block,
+            }
+        )
+    )
+
+
+def run(cache_dir, precompile, launch_time):
+    env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.pll_startup", str(int(precompile)), str(launch_time)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    # the kernels print from numba, whose output can land on the line of the result
+    return json.loads(out[out.rindex('{"first_block"'):].split("}")[0] + "}")
+
+
+def main(launch_time=3.0):
+    warm = tempfile.mkdtemp()
+    run(warm, False, 0.0)  # fill the cache
+    for name, precompile in (("lazy", False), ("precompiled", True)):
+        for cache in ("cold", "warm"):
+            cache_dir = tempfile.mkdtemp() if cache == "cold" else warm
+            r = run(cache_dir, precompile, launch_time)
+            print(
+                f"{name:>12}, {cache} cache: first block {r['first_block']:6.2f} s, "
+                f"launch to first block {r['launch_to_first_block']:6.2f} s "
+                f"(launch {launch_time} s), first time walk block "
+                f"{r['first_time_walk_block']:6.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        child(bool(int(sys.argv[1])), float(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,127 @@
+"""
+Time walk correction: the interpolated table lookup against a nearest bin lookup.
+
+Checks that correct_time_walk() gives the table entries at the bin middles, linear
+interpolation in between and the end entries outside the table, and that both kernels
+agree with a table loaded. Then reports the correction throughput per tag and over whole
+blocks.
+
+run from the repo root:
+    python -m benchmarks.pll_time_walk
+"""
+
+import time
+import numba
+import numpy as np
+import TimeTagger
+
+from pll_kernels import correct_time_walk, correct_time_walk_batch
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+)
+
+T_PRIME_RES = 500.0
+N_OFFSETS = 200
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def nearest_bin(hist_tag, diff, t_prime_res, walk_offset):
+    """the lookup correct_time_walk() replaced, with its bounds check fixed"""
+    diff_arg = int(diff / t_prime_res)
+    if diff_arg < 0 or diff_arg >= len(walk_offset):
+        return hist_tag
+    return hist_tag - walk_offset[diff_arg]
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def nearest_bin_loop(hist_tags, diffs, t_prime_res, walk_offset):
+    total = 0.0
+    for i in range(len(hist_tags)):
+        total += nearest_bin(hist_tags[i], diffs[i], t_prime_res, walk_offset)
+    return total
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def interpolated_loop(hist_tags, diffs, walk_inv_res, walk_max, walk_offset):
+    total = 0.0
+    for i in range(len(hist_tags)):
+        total += correct_time_walk(hist_tags[i], diffs[i], walk_inv_res, walk_max, walk_offset)
+    return total
+
+
+def offsets(n=N_OFFSETS):
+    # detector recovery: tags shortly after another arrive late
+    return 30 * np.exp(-np.arange(n) / 40)
+
+
+def best_time(f, *args, repeats=5):
+    f(*args)  # compile
+    best = None
+    for repeat in range(repeats):
+        t0 = time.perf_counter()
+        f(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def check_interpolation():
+    table = offsets()
+    padded = np.full(N_OFFSETS + 10, table[-1])
+    padded[:N_OFFSETS] = table
+    inv_res, walk_max = 1 / T_PRIME_RES, N_OFFSETS - 1
+
+    def offset(diff):
+        return -correct_time_walk(0.0, diff, inv_res, walk_max, padded)
+
+    middles = (np.arange(N_OFFSETS) + 0.5) * T_PRIME_RES
+    assert np.allclose([offset(d) for d in middles], table)
+    between = middles[:-1] + 0.25 * T_PRIME_RES
+    assert np.allclose([offset(d) for d in between], table[:-1] + 0.25 * np.diff(table))
+    assert offset(-1e6) == table[0] and offset(0.0) == table[0]
+    assert offset(1e12) == table[-1] and offset(N_OFFSETS * T_PRIME_RES) == table[-1]
+    assert correct_time_walk(12.5, 1e3, inv_res, -1.0, padded) == 12.5
+    print("interpolation, clamping and the empty table check out")
+
+
+def check_kernels(duration=0.2e12, singles_rate=5e6):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    blocks = split_blocks(make_tag_stream(duration, singles_rate=singles_rate), 0.05e12)
+    results = []
+    for kernel in ({}, {"parallel": True}):
+        pll = make_pll(
+            tagger, sum(len(b) for b in blocks), store_tags=True, **kernel
+        )
+        pll.load_time_walk_arrays(T_PRIME_RES, offsets(), offsets() / 2)
+        for block in blocks:
+            pll.process(block, 0, 0)
+        results.append(pll.getData())
+        del pll
+    for other in results[1:]:
+        assert all(np.array_equal(a, b) for a, b in zip(results[0], other))
+    print("all kernels agree with a time walk table loaded")
+
+
+def main(n_tags=10_000_000):
+    check_interpolation()
+    check_kernels()
+
+    rng = np.random.default_rng(0)
+    diffs = rng.exponential(0.5 * N_OFFSETS * T_PRIME_RES, n_tags)
+    hist_tags = rng.uniform(0, 244, n_tags)
+    table = offsets(len(offsets()) + 1)
+    inv_res, walk_max = 1 / T_PRIME_RES, N_OFFSETS - 1.0
+
+    elapsed = best_time(nearest_bin_loop, hist_tags, diffs, T_PRIME_RES, table[:N_OFFSETS])
+    print(f"nearest bin:         {n_tags / elapsed / 1e6:7.1f} Mtags/s")
+    elapsed = best_time(interpolated_loop, hist_tags, diffs, inv_res, walk_max, table)
+    print(f"interpolated:        {n_tags / elapsed / 1e6:7.1f} Mtags/s")
+    corrected = hist_tags.copy()
+    elapsed = best_time(correct_time_walk_batch, corrected, diffs, inv_res, walk_max, table)
+    print(f"interpolated, batch: {n_tags / elapsed / 1e6:7.1f} Mtags/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Counting center bin coincidences in many windows at once.
+
+Checks that the count of every window in a multi-window run equals a run with that
+window alone, then reports throughput against the number of windows.
+
+run from the repo root:
+    python -m benchmarks.pll_windows
+"""
+
+import time
+import numpy as np
+import TimeTagger
+
+from benchmarks.synthetic_tags import (
+    make_pll,
+    make_tag_stream,
+    split_blocks,
+)
+
+
+def run(pll, blocks):
+    t0 = time.perf_counter()
+    for block in blocks:
+        pll.process(block, 0, 0)
+    return time.perf_counter() - t0
+
+
+def nested_windows(n, center=120, half_width=30, step=5):
+    return [(center - half_width - step * i, center + half_width + step * i) for i in range(n)]
+
+
+def main(duration=0.4e12, singles_rate=10e6, pair_fraction=0.3):
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    tags = make_tag_stream(duration, singles_rate=singles_rate, pair_fraction=pair_fraction)
+    blocks = split_blocks(tags, 0.05e12)
+    n_tags = sum(len(b) for b in blocks[1:])
+
+    windows = nested_windows(8)
+    pll = make_pll(tagger, len(tags), coincidence_windows=windows)
+    run(pll, blocks)
+    counts = pll.getData()[13]
+    for k, window in enumerate(windows):
+        single = make_pll(tagger, len(tags), coincidence_windows=[window])
+        run(single, blocks)
+        assert single.getData()[13][0] == counts[k], f"window {window} differs"
+        del single
+    print("window (ps)   center bin pairs")
+    for window, count in zip(windows, counts):
+        print(f"{window[0]:>4} - {window[1]:<4} {count:>10}")
+    del pll
+
+    for n_windows in (1, 4, 16, 64):
+        best = None
+        for repeat in range(3):
+            pll = make_pll(
+                tagger, len(tags), coincidence_windows=nested_windows(n_windows, step=1)
+            )
+            run(pll, blocks[:1])  # compile and initialize
+            elapsed = run(pll, blocks[1:])
+            best = elapsed if best is None else min(best, elapsed)
+            del pll
+        print(f"{n_windows:>3} windows: {n_tags / best / 1e6:.1f} Mtags/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Checks of the settings diff behind the debounced reconfiguration, without Qt.
+
+- ReconfigurationManager with delay_ms=None applies every request() right away, and
+  changes() only returns the settings that differ from the last ones applied
+- apply_input_settings() pushes only the channels whose inputs changed, and with two
+  inputs on one channel, as C and D on 9 in UI_params.yaml, the later one still wins
+- dragging a spinner through a burst of values only pushes the input it belongs to
+
+run from the repo root:
+    python -m benchmarks.reconfiguration
+"""
+
+from reconfiguration import ReconfigurationManager, apply_input_settings
+
+
+class RecordingTagger:
+    """Keeps the last value set per (setter, channel), and counts the calls."""
+
+    def __init__(self):
+        self.values = {}
+        self.calls = 0
+
+    def __getattr__(self, setter):
+        def record(channel, value):
+            self.values[(setter, channel)] = value
+            self.calls += 1
+
+        return record
+
+
+def ui_settings():
+    # the input channels of UI_params.yaml
+    settings = {}
+    for name, channel in zip("ABCD", (-1, -5, 9, 9)):
+        settings[f"{name}.channel"] = channel
+        settings[f"{name}.delay"] = 0
+        settings[f"{name}.trigger"] = 0.1
+        settings[f"{name}.dead_time"] = 1000
+    settings["A.test_signal"] = False
+    settings["B.test_signal"] = False
+    settings["coincidence_window"] = 1000
+    return settings
+
+
+def main():
+    settings = ui_settings()
+    tagger = RecordingTagger()
+    pushed = []
+
+    def apply():
+        changes = manager.changes(settings)
+        _, changed = apply_input_settings(tagger, settings, changes, manager.previous)
+        pushed.append((set(changes), changed))
+
+    manager = ReconfigurationManager(apply, delay_ms=None)
+    manager.request()
+    assert manager.applies == 1 and pushed[-1][1]
+    assert tagger.values[("setTriggerLevel", 9)] == settings["D.trigger"]
+
+    # nothing changed, nothing pushed
+    calls = tagger.calls
+    manager.request()
+    assert pushed[-1] == (set(), False) and tagger.calls == calls
+
+    # C changes on the channel it shares with D: both are re-applied, D still wins
+    settings["C.trigger"] = -0.3
+    settings["D.trigger"] = -0.047
+    manager.request()
+    assert pushed[-1][0] == {"C.trigger", "D.trigger"}
+    assert tagger.values[("setTriggerLevel", 9)] == -0.047
+    settings["C.delay"] = 120
+    manager.request()
+    assert pushed[-1][0] == {"C.delay"}
+    assert tagger.values[("setInputDelay", 9)] == settings["D.delay"]
+    assert tagger.values[("setTriggerLevel", 9)] == -0.047
+
+    # D moves off 9, so C's settings take the channel back
+    settings["D.channel"] = 3
+    manager.request()
+    assert tagger.values[("setTriggerLevel", 9)] == -0.3
+    assert tagger.values[("setInputDelay", 9)] == 120
+    assert tagger.values[("setTriggerLevel", 3)] == -0.047
+
+    # a burst of spinner values, only the channel of A is pushed each time
+    calls = tagger.calls
+    for delay in range(10, 110, 10):
+        settings["A.delay"] = delay
+        manager.request()
+    per_apply = (tagger.calls - calls) / 10
+    assert tagger.values[("setInputDelay", -1)] == 100
+    print(f"{manager.requests} requests, {manager.applies} applies, "
+          f"{per_apply:.0f} tagger calls per A.delay change")
+    print("settings diff and per channel re-apply: OK")
+
+
+if __name__ == "__main__":
+    main()
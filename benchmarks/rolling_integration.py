@@ -0,0 +1,47 @@
+"""
+Cost per frame of the integrated histograms of entanglement_control, against the
+integration time.
+
+Once summing the whole block of IntTime * 10 frames every frame, as draw() used to, and
+once with RollingIntegrator, which adds the frame and subtracts the evicted one. Checks
+that both give the same sums.
+
+run from the repo root:
+    python -m benchmarks.rolling_integration
+"""
+
+import time
+import numpy as np
+
+from rolling_integration import RollingIntegrator
+from pll_kernels import N_HISTOGRAMS
+
+
+def main(n_bins=2000, int_times=(1, 10, 60), n_frames=300):
+    rng = np.random.default_rng(0)
+    frames = rng.poisson(5, (n_frames, N_HISTOGRAMS, n_bins))
+    for int_time in int_times:
+        n_rows = int_time * 10
+        block = np.zeros((n_rows, N_HISTOGRAMS, n_bins), dtype=np.int64)
+        t0 = time.perf_counter()
+        for i, frame in enumerate(frames):
+            block[i % n_rows] = frame
+            summed = np.sum(block, axis=0)
+        block_time = (time.perf_counter() - t0) / n_frames
+
+        integrator = RollingIntegrator(n_rows, (N_HISTOGRAMS, n_bins))
+        t0 = time.perf_counter()
+        for frame in frames:
+            integrator.add(frame)
+            rolling = integrator.rolling()
+        rolling_time = (time.perf_counter() - t0) / n_frames
+        assert np.array_equal(summed, rolling)
+        print(
+            f"IntTime {int_time:3d} s: block sum {block_time * 1e3:7.3f} ms, "
+            f"rolling {rolling_time * 1e3:7.3f} ms per frame"
+        )
+    print("sums are identical")
+
+
+if __name__ == "__main__":
+    main()
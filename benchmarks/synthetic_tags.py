@@ -0,0 +1,107 @@
+"""
+Synthetic time tag streams for benchmarking the PLL histogram kernels without hardware.
+
+The stream mimics the entanglement setup: a divided clock on one channel and two SNSPD
+channels that fire in a fraction of the ~244.5 ps laser periods, with some of those
+detections arriving as pairs in the same period.
+
+"""
+
+import numpy as np
+
+from pll_kernels import TAG_DTYPE
+from CustomPLLHistogram import CustomPLLHistogram
+from pll_tuner import split_blocks  # the benchmarks replay blocks as the tuner does
+
+CLOCK_CHANNEL = 9
+DATA_CHANNEL_1 = -5
+DATA_CHANNEL_2 = -14
+MULT = 50000
+PERIOD = 12227780.32947103  # ps, one divided clock period
+# loop filter the benchmarks run on these streams
+PLL_SETTINGS = dict(mult=MULT, phase=0, deriv=200, prop=9e-13)
+
+
+def make_pll(tagger, n_bins=16000000, **kwargs):
+    """CustomPLLHistogram on the channels of the stream, with PLL_SETTINGS"""
+    return CustomPLLHistogram(
+        tagger,
+        DATA_CHANNEL_1,
+        DATA_CHANNEL_2,
+        CLOCK_CHANNEL,
+        n_bins=n_bins,
+        **PLL_SETTINGS,
+        **kwargs,
+    )
+
+
+def make_tag_stream(
+    duration,
+    singles_rate=5e6,
+    pair_fraction=0.05,
+    clock_jitter=3.0,
+    clock_wander=0.0,
+    data_jitter=20.0,
+    peak_offset=120.0,
+    extra_channels=(),
+    extra_rate=1e6,
+    start_time=1_000_000,
+    seed=0,
+):
+    """
+    Returns a time-sorted array of TAG_DTYPE records covering ``duration`` ps.
+
+    singles_rate is per data channel in counts/s. pair_fraction of the channel 1 counts
+    get a partner on channel 2 in the same sub-period. extra_channels get uncorrelated
+    tags at extra_rate, like counters or test signals left enabled on the tagger.
+    clock_wander is a random walk of the laser phase, which the divided clock and the
+    detections follow, in ps rms per clock period.
+    """
+    rng = np.random.default_rng(seed)
+    sub_period = PERIOD / MULT
+    n_clocks = int(duration // PERIOD) + 1
+    wander = np.zeros(n_clocks)
+    if clock_wander:
+        wander = np.cumsum(rng.normal(0, clock_wander, n_clocks))
+    clock_times = (
+        start_time
+        + np.arange(n_clocks) * PERIOD
+        + wander
+        + rng.normal(0, clock_jitter, n_clocks)
+    ).astype(np.int64)
+
+    n_sub = int(duration // sub_period)
+    n_singles = rng.poisson(singles_rate * duration * 1e-12)
+    sub_1 = rng.integers(0, n_sub, n_singles)
+    sub_2 = rng.integers(0, n_sub, n_singles)
+    n_pairs = int(n_singles * pair_fraction)
+    sub_2[:n_pairs] = sub_1[:n_pairs]
+
+    def detections(sub):
+        return (
+            start_time
+            + sub * sub_period
+            + np.interp(sub / MULT, np.arange(n_clocks), wander)
+            + peak_offset
+            + rng.normal(0, data_jitter, len(sub))
+        ).astype(np.int64)
+
+    parts = [
+        (clock_times, CLOCK_CHANNEL),
+        (detections(sub_1), DATA_CHANNEL_1),
+        (detections(sub_2), DATA_CHANNEL_2),
+    ]
+    for channel in extra_channels:
+        n_extra = rng.poisson(extra_rate * duration * 1e-12)
+        parts.append(
+            (start_time + rng.integers(0, int(duration), n_extra), channel)
+        )
+
+    tags = np.zeros(sum(len(t) for t, _ in parts), dtype=TAG_DTYPE)
+    pos = 0
+    for times, channel in parts:
+        tags["time"][pos : pos + len(times)] = times
+        tags["channel"][pos : pos + len(times)] = channel
+        pos += len(times)
+    return tags[np.argsort(tags["time"], kind="stable")]
+
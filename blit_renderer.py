@@ -0,0 +1,180 @@
+import time
+import numpy as np
+from matplotlib.transforms import Bbox
+
+"""
+Blitting for the live plots of the GUI.
+
+A full canvas.draw() of the figure redraws every axis, tick and label, which dominates
+the frame time once the histograms have thousands of bins. BlitRenderer caches the
+background of each axis after a full draw and then only restores the backgrounds of the
+axes whose lines changed, draws those lines and blits. The axis limits are only changed,
+with a full draw, when the data leaves them by a margin.
+
+Built on the blitting example of the matplotlib documentation.
+"""
+
+
+class BlitRenderer:
+    """
+    Draws the line artists registered with add_axis() on canvas. draw() renders a frame
+    in about frame_budget seconds: axes left over are drawn first in the next frame.
+
+    A limit is extended to the data plus margin times the data range when the data leaves
+    it, and shrunk the same way when the data fills less than shrink of the view.
+    """
+
+    def __init__(self, canvas, frame_budget=0.03, margin=0.1, shrink=0.25):
+        self.canvas = canvas
+        self.frame_budget = frame_budget
+        self.margin = margin
+        self.shrink = shrink
+        # per axis: its artists, the axes it autoscales ("x", "y") and its background
+        self.axes = []
+        self.backgrounds = None
+        self.full_draw = True
+
+        # frames drawn, frames that needed a full draw, axes deferred to the next frame
+        self.frames = 0
+        self.full_draws = 0
+        self.deferred = 0
+
+        self.draw_cid = canvas.mpl_connect("draw_event", self.on_draw)
+
+    def add_axis(self, ax, artists, autoscale="xy", title=False, margin=None):
+        """
+        Blit artists, lines of ax, and autoscale ax along autoscale. With title, the axis
+        title is blitted as well, for a title that changes every frame. margin overrides
+        the margin of the renderer for this axis, a larger one for data that scrolls.
+        """
+        artists = list(artists)
+        if title:
+            artists.append(ax.title)
+        for artist in artists:
+            artist.set_animated(True)
+        self.axes.append(
+            {
+                "ax": ax,
+                "artists": artists,
+                "autoscale": autoscale,
+                "title": title,
+                "margin": self.margin if margin is None else margin,
+            }
+        )
+        self.full_draw = True
+
+    def clear(self):
+        """Forget every axis, before the plots are rebuilt."""
+        for entry in self.axes:
+            for artist in entry["artists"]:
+                artist.set_animated(False)
+        self.axes = []
+        self.backgrounds = None
+        self.full_draw = True
+
+    def disconnect(self):
+        self.canvas.mpl_disconnect(self.draw_cid)
+
+    def invalidate(self):
+        """Do a full draw next frame, after a change to something that isn't blitted."""
+        self.full_draw = True
+
+    def region(self, entry):
+        """Part of the canvas an axis is blitted in: the axes, and the title above them"""
+        ax = entry["ax"]
+        if not entry["title"]:
+            return ax.bbox
+        renderer = self.canvas.get_renderer()
+        top = max(ax.bbox.y1, ax.title.get_window_extent(renderer).y1)
+        return Bbox.from_extents(ax.bbox.x0, ax.bbox.y0, ax.bbox.x1, top)
+
+    def on_draw(self, event):
+        """After every full draw, cache the backgrounds and draw the lines on them."""
+        if event is not None and event.canvas is not self.canvas:
+            return
+        self.backgrounds = [
+            self.canvas.copy_from_bbox(self.region(entry)) for entry in self.axes
+        ]
+        for entry in self.axes:
+            self.draw_artists(entry)
+
+    def draw_artists(self, entry):
+        for artist in entry["artists"]:
+            entry["ax"].draw_artist(artist)
+        entry["drawn"] = time.perf_counter()
+
+    def data_limits(self, entry, axis):
+        """Smallest and largest data of the artists along axis, None without data"""
+        lows, highs = [], []
+        log = getattr(entry["ax"], f"get_{axis}scale")() == "log"
+        for artist in entry["artists"]:
+            if artist is entry["ax"].title:
+                continue
+            data = np.asarray(
+                artist.get_xdata() if axis == "x" else artist.get_ydata(), dtype=float
+            )
+            data = data[np.isfinite(data) & (data > 0)] if log else data[np.isfinite(data)]
+            if len(data):
+                lows.append(data.min())
+                highs.append(data.max())
+        if not lows:
+            return None
+        low, high = min(lows), max(highs)
+        return (np.log10(low), np.log10(high), log) if log else (low, high, log)
+
+    def rescale(self, entry):
+        """Move the limits that the data left, or fills too little of. Returns if any did."""
+        ax = entry["ax"]
+        changed = False
+        for axis in entry["autoscale"]:
+            limits = self.data_limits(entry, axis)
+            if limits is None:
+                continue
+            low, high, log = limits
+            view_low, view_high = getattr(ax, f"get_{axis}lim")()
+            if log:
+                view_low, view_high = np.log10(view_low), np.log10(view_high)
+            span = high - low
+            view_span = view_high - view_low
+            if low >= view_low and high <= view_high and span >= self.shrink * view_span:
+                continue
+            margin = entry["margin"]
+            pad = margin * span if span > 0 else max(abs(high) * margin, 1)
+            new_limits = (low - pad, high + pad)
+            if log:
+                new_limits = (10 ** new_limits[0], 10 ** new_limits[1])
+            getattr(ax, f"set_{axis}lim")(*new_limits)
+            changed = True
+        return changed
+
+    def draw(self):
+        """Render a frame of every axis whose lines changed since the last one."""
+        t0 = time.perf_counter()
+        self.frames += 1
+        for entry in self.axes:
+            if self.rescale(entry):
+                self.full_draw = True
+        if self.full_draw or self.backgrounds is None:
+            # draws the lines as well, through on_draw()
+            self.full_draw = False
+            self.full_draws += 1
+            self.canvas.draw()
+            self.canvas.blit(self.canvas.figure.bbox)
+            return
+
+        # the axes drawn least recently first, so the ones a frame ran out of time for
+        # are drawn in the next
+        changed = [
+            (entry, background)
+            for entry, background in zip(self.axes, self.backgrounds)
+            if any(artist.stale for artist in entry["artists"])
+        ]
+        changed.sort(key=lambda item: item[0].get("drawn", 0))
+        for n, (entry, background) in enumerate(changed):
+            if n and time.perf_counter() - t0 > self.frame_budget:
+                self.deferred += len(changed) - n
+                break
+            self.canvas.restore_region(background)
+            self.draw_artists(entry)
+            self.canvas.blit(self.region(entry))
+        self.canvas.flush_events()
@@ -14,7 +14,20 @@ from matplotlib.figure import Figure
 from entanglement_control_window import EntanglementControlWindow
 
 # from CustomPLLHistogram import CustomPLLHistogram
-from CustomPLLHistogram import CustomPLLHistogram
+from CustomPLLHistogram import (
+    CustomPLLHistogram,
+    HIST_1,
+    HIST_2,
+    COINC_1,
+    COINC_2,
+    N_HISTOGRAMS,
+    precompile_in_background,
+)
+from pll_frames import PLLFrameWorker
+from blit_renderer import BlitRenderer
+from rolling_integration import RollingIntegrator
+from histogram_geometry import HistogramGeometry
+from reconfiguration import ReconfigurationManager, apply_input_settings
 from snspd_measure.inst.teledyneT3PS import teledyneT3PS
 import viz
 import threading
@@ -100,35 +113,37 @@ class CoincidenceExample(QMainWindow):
         self.ui.initScan.clicked.connect(self.initMeasurement)
         self.ui.set_intf_voltage.clicked.connect(self.set_intf_voltage)
 
-        # Update the measurements whenever any input configuration changes
-        self.ui.channelA.valueChanged.connect(self.updateMeasurements)
-        self.ui.channelB.valueChanged.connect(self.updateMeasurements)
-        self.ui.channelC.valueChanged.connect(self.updateMeasurements)
-        self.ui.channelD.valueChanged.connect(self.updateMeasurements)
-        self.ui.delayA.valueChanged.connect(self.updateMeasurements)
-        self.ui.delayB.valueChanged.connect(self.updateMeasurements)
-        self.ui.delayC.valueChanged.connect(self.updateMeasurements)
-        self.ui.delayD.valueChanged.connect(self.updateMeasurements)
-        self.ui.triggerA.valueChanged.connect(self.updateMeasurements)
-        self.ui.triggerB.valueChanged.connect(self.updateMeasurements)
-        self.ui.triggerC.valueChanged.connect(self.updateMeasurements)
-        self.ui.triggerD.valueChanged.connect(self.updateMeasurements)
-        self.ui.deadTimeA.valueChanged.connect(self.updateMeasurements)
-        self.ui.deadTimeB.valueChanged.connect(self.updateMeasurements)
-        self.ui.deadTimeC.valueChanged.connect(self.updateMeasurements)
-        self.ui.deadTimeD.valueChanged.connect(self.updateMeasurements)
+        # Update the measurements whenever any input configuration changes. The changes
+        # of a burst, like dragging a spinner, are applied once it settles
+        self.reconfiguration = ReconfigurationManager(self.updateMeasurements, delay_ms=200)
+        self.ui.channelA.valueChanged.connect(self.reconfiguration.request)
+        self.ui.channelB.valueChanged.connect(self.reconfiguration.request)
+        self.ui.channelC.valueChanged.connect(self.reconfiguration.request)
+        self.ui.channelD.valueChanged.connect(self.reconfiguration.request)
+        self.ui.delayA.valueChanged.connect(self.reconfiguration.request)
+        self.ui.delayB.valueChanged.connect(self.reconfiguration.request)
+        self.ui.delayC.valueChanged.connect(self.reconfiguration.request)
+        self.ui.delayD.valueChanged.connect(self.reconfiguration.request)
+        self.ui.triggerA.valueChanged.connect(self.reconfiguration.request)
+        self.ui.triggerB.valueChanged.connect(self.reconfiguration.request)
+        self.ui.triggerC.valueChanged.connect(self.reconfiguration.request)
+        self.ui.triggerD.valueChanged.connect(self.reconfiguration.request)
+        self.ui.deadTimeA.valueChanged.connect(self.reconfiguration.request)
+        self.ui.deadTimeB.valueChanged.connect(self.reconfiguration.request)
+        self.ui.deadTimeC.valueChanged.connect(self.reconfiguration.request)
+        self.ui.deadTimeD.valueChanged.connect(self.reconfiguration.request)
         self.ui.intf_voltage.valueChanged.connect(self.set_intf_voltage)
 
-        self.ui.testsignalA.stateChanged.connect(self.updateMeasurements)
-        self.ui.testsignalB.stateChanged.connect(self.updateMeasurements)
-        self.ui.testsignalB.stateChanged.connect(self.updateMeasurements)
-        self.ui.coincidenceWindow.valueChanged.connect(self.updateMeasurements)
-        self.ui.IntType.currentTextChanged.connect(self.updateMeasurements)
-        # self.ui.LogScaleCheck.stateChanged.connect(self.updateMeasurements)
-        self.ui.IntTime.valueChanged.connect(self.updateMeasurements)
+        self.ui.testsignalA.stateChanged.connect(self.reconfiguration.request)
+        self.ui.testsignalB.stateChanged.connect(self.reconfiguration.request)
+        self.ui.testsignalB.stateChanged.connect(self.reconfiguration.request)
+        self.ui.coincidenceWindow.valueChanged.connect(self.reconfiguration.request)
+        self.ui.IntType.currentTextChanged.connect(self.reconfiguration.request)
+        # self.ui.LogScaleCheck.stateChanged.connect(self.reconfiguration.request)
+        self.ui.IntTime.valueChanged.connect(self.reconfiguration.request)
 
-        self.ui.correlationBinwidth.valueChanged.connect(self.updateMeasurements)
-        self.ui.correlationBins.valueChanged.connect(self.updateMeasurements)
+        self.ui.correlationBinwidth.valueChanged.connect(self.reconfiguration.request)
+        self.ui.correlationBins.valueChanged.connect(self.reconfiguration.request)
         self.ent = False
         self.init_ent = False
         self.coinc_idx = 0
@@ -137,7 +152,6 @@ class CoincidenceExample(QMainWindow):
         self.offset_b = 0
         self.p = 0
         self.vSource_initialized = False
-        self.prev_time = 0
 
         # Create the matplotlib figure with its subplots for the counter and correlation
         Colors, palette = viz.phd_style(text=-2)
@@ -164,18 +178,18 @@ class CoincidenceExample(QMainWindow):
         self.toolbar = NavigationToolbar2QT(self.canvas, self)
         self.ui.plotLayout.addWidget(self.toolbar)
         self.ui.plotLayout.addWidget(self.canvas)
+        # draw() blits the lines that changed instead of redrawing the whole figure
+        self.renderer = BlitRenderer(self.canvas, frame_budget=0.03)
 
         # Create the TimeTagger measurements
         self.running = True
         self.measurements_dirty = False
         self.tagger = tagger
-        self.IntType = "Rolling"
         self.last_channels = [-1, -5, 9, 9]
         self.active_channels = []
         self.last_coincidenceWindow = 0
 
         self.updateMeasurements()
-        self.divider = 2
         self.scanRunning = False
         self.multiScan = False
         self.event_loop_action = None
@@ -195,6 +209,8 @@ class CoincidenceExample(QMainWindow):
         self.tagger.setEventDivider(9, self.clock_divider)
 
         self.pll_store = [None] # a silly way to make a mutable reference
+        self.pll_frames = None
+        self.unlocked_frames = 0  # frames of the PLL not integrated for lack of lock
 
         for arg in sys.argv:
             if arg == "-auto_init":
@@ -267,10 +283,9 @@ class CoincidenceExample(QMainWindow):
         self.running = True
         self.measurements_dirty = False
         self.tagger = tagger
-        self.IntType = "Rolling"
         self.last_channels = [-1, -5, 9, 9]
         self.last_coincidenceWindow = 0
-        self.updateMeasurements()
+        self.updateMeasurements(force=True)
         self.inputValid = False  # used for staring visibility scan
 
         # Use a timer to redraw the plots every 100ms
@@ -288,90 +303,66 @@ class CoincidenceExample(QMainWindow):
     def show_dialog(self, message):
         self.td.get_text(self, message)
 
-    def updateMeasurements(self):
-        """Create/Update all TimeTagger measurement objects"""
+    def measurement_settings(self):
+        """The settings updateMeasurements() applies, as read from the UI, by name"""
+        settings = {}
+        for name in "ABCD":
+            settings[f"{name}.channel"] = getattr(self.ui, f"channel{name}").value()
+            settings[f"{name}.delay"] = getattr(self.ui, f"delay{name}").value()
+            settings[f"{name}.trigger"] = getattr(self.ui, f"trigger{name}").value()
+            settings[f"{name}.dead_time"] = int(
+                getattr(self.ui, f"deadTime{name}").value() * 1000
+            )
+        settings["A.test_signal"] = self.ui.testsignalA.isChecked()
+        settings["B.test_signal"] = self.ui.testsignalB.isChecked()
+        settings["coincidence_window"] = self.ui.coincidenceWindow.value()
+        settings["correlation_binwidth"] = self.ui.correlationBinwidth.value()
+        settings["correlation_bins"] = self.ui.correlationBins.value()
+        settings["int_time"] = self.ui.IntTime.value()
+        settings["ent"] = self.ent
+        settings["pll"] = self.PLL if self.ent else None
+        return settings
+
+    def apply_log_scale(self):
+        yscale = "log" if self.ui.LogScaleCheck.isChecked() else "linear"
+        if self.correlationAxis.get_yscale() != yscale:
+            # ticks and grid are in the blitted background
+            self.correlationAxis.set_yscale(yscale)
+            self.renderer.invalidate()
+
+    def updateMeasurements(self, force=False):
+        """
+        Create/Update all TimeTagger measurement objects. Only the tagger settings that
+        changed since the last call are pushed, and measurements and plots are only
+        rebuilt when their geometry changed. force applies and rebuilds everything, for
+        after a tagger.reset().
+        """
 
         # If any configuration is changed while the measurements are stopped, recreate them on the start button
         if not self.running:
             self.measurements_dirty = True
             return
 
-        # Set the input delay, trigger level, and test signal of both channels
-        channels = [
-            self.ui.channelA.value(),
-            self.ui.channelB.value(),
-            self.ui.channelC.value(),
-            self.ui.channelD.value(),
-        ]
-        self.active_channels = []
-
-        if channels[0] != 0:
-            self.tagger.setInputDelay(channels[0], self.ui.delayA.value())
-            self.tagger.setTriggerLevel(channels[0], self.ui.triggerA.value())
-            self.tagger.setDeadtime(channels[0], int(self.ui.deadTimeA.value() * 1000))
-            self.tagger.setDeadtime(
-                channels[0] * -1, int(self.ui.deadTimeA.value() * 1000)
-            )
-            self.tagger.setInputImpedanceHigh(channels[0], False)
-            self.tagger.setTestSignal(channels[0], self.ui.testsignalA.isChecked())
-            self.active_channels.append(channels[0])
-
-        if channels[1] != 0:
-            self.tagger.setInputDelay(channels[1], self.ui.delayB.value())
-            self.tagger.setTriggerLevel(channels[1], self.ui.triggerB.value())
-            self.tagger.setDeadtime(channels[1], int(self.ui.deadTimeB.value() * 1000))
-            self.tagger.setDeadtime(
-                channels[1] * -1, int(self.ui.deadTimeB.value() * 1000)
-            )
-            self.tagger.setInputImpedanceHigh(channels[1], False)
-            self.tagger.setTestSignal(channels[1], self.ui.testsignalB.isChecked())
-            self.active_channels.append(channels[1])
-
-        if channels[2] != 0:
-            self.tagger.setInputDelay(channels[2], self.ui.delayC.value())
-            self.tagger.setTriggerLevel(channels[2], self.ui.triggerC.value())
-            self.tagger.setDeadtime(channels[2], int(self.ui.deadTimeC.value() * 1000))
-            self.tagger.setDeadtime(
-                channels[2] * -1, int(self.ui.deadTimeC.value() * 1000)
-            )
-            self.tagger.setInputImpedanceHigh(channels[2], False)
-            self.active_channels.append(channels[2])
+        settings = self.measurement_settings()
+        changes = self.reconfiguration.changes(settings, force)
 
-        if channels[3] != 0:
-            self.tagger.setInputDelay(channels[3], self.ui.delayD.value())
-            self.tagger.setTriggerLevel(channels[3], self.ui.triggerD.value())
-            self.tagger.setDeadtime(channels[3], int(self.ui.deadTimeD.value() * 1000))
-            self.tagger.setDeadtime(
-                channels[3] * -1, int(self.ui.deadTimeD.value() * 1000)
-            )
-            self.tagger.setInputImpedanceHigh(channels[3], False)
-            self.active_channels.append(channels[3])
-
-        if self.ui.LogScaleCheck.isChecked():
-            self.correlationAxis.set_yscale("log")
-            # self.correlationAxis.set_ylim(.005,.04)
-        else:
-            self.correlationAxis.set_yscale("linear")
-
-        # print(self.ui.IntType.currentText())
-
-        self.seconds = 1
-        self.histBlock = numpy.zeros(
-            (int(self.ui.IntTime.value() * 10), self.ui.correlationBins.value())
+        # Set the input delay, trigger level, dead time and test signal of every channel
+        # whose settings changed
+        self.active_channels, tagger_changed = apply_input_settings(
+            self.tagger, settings, changes, self.reconfiguration.previous
         )
 
-        self.buffer = numpy.zeros((1, self.ui.correlationBins.value()))
-        self.buffer_old = numpy.zeros((1, self.ui.correlationBins.value()))
-
-        self.BlockIndex = 0
+        self.seconds = 1
 
         # Only recreate the counter if its parameter has changed,
         # else we'll clear the count trace too often
-        coincidenceWindow = self.ui.coincidenceWindow.value()
-        if (
-            self.last_channels != self.active_channels
+        coincidenceWindow = settings["coincidence_window"]
+        counter_changed = (
+            force
+            or self.last_channels != self.active_channels
             or self.last_coincidenceWindow != coincidenceWindow
-        ):
+        )
+        if counter_changed:
             self.last_channels = self.active_channels
             self.last_coincidenceWindow = coincidenceWindow
 
@@ -391,11 +382,16 @@ class CoincidenceExample(QMainWindow):
 
         # print("coincidences on ch", self.coincidences.getChannels())
 
-        # Measure the correlation between A and B
-
-        if self.ent:
-            pass
-        else:
+        # Measure the correlation between A and B, again only if its geometry changed
+        correlation_keys = {
+            "A.channel",
+            "B.channel",
+            "correlation_binwidth",
+            "correlation_bins",
+            "ent",
+        }
+        correlation_changed = not self.ent and bool(changes.keys() & correlation_keys)
+        if correlation_changed:
             self.correlation = Histogram(
                 self.tagger,
                 # self.a_combined.getChannel(),
@@ -407,9 +403,36 @@ class CoincidenceExample(QMainWindow):
             )
             self.correlation.start()
 
-        self.tagger.sync()
+        if tagger_changed or counter_changed or correlation_changed:
+            self.tagger.sync()
+
+        plots_changed = counter_changed or correlation_changed or bool(
+            changes.keys() & {"ent", "pll"}
+        )
+        if plots_changed or changes.keys() & {"int_time", "correlation_bins"}:
+            # frames integrated, 10 per second
+            n_frames = int(settings["int_time"] * 10)
+            self.correlation_integrator = RollingIntegrator(
+                n_frames, (settings["correlation_bins"],)
+            )
+            self.buffer = numpy.zeros((1, settings["correlation_bins"]))
+            self.buffer_old = numpy.zeros((1, settings["correlation_bins"]))
+            if self.ent:
+                # every histogram of the PLL frames, and the coincidence rate and
+                # coupling efficiency of the lower right plots
+                self.hist_integrator = RollingIntegrator(
+                    n_frames, (N_HISTOGRAMS, self.PLL.geometry.n_bins)
+                )
+                self.rate_integrator = RollingIntegrator(
+                    n_frames, (2,), dtype=numpy.float64
+                )
+
+        if not plots_changed:
+            self.apply_log_scale()
+            return
 
         # Create the measurement plots
+        self.renderer.clear()
         self.counterAxis.clear()
         colors = [
             "#6d6acc",
@@ -443,60 +466,24 @@ class CoincidenceExample(QMainWindow):
         self.efficiencyAxis.clear()
 
         if self.ent:
-            (
-                clocks,
-                pclocks,
-                hist1,
-                hist2,
-                coinc1,
-                coinc2,
-                full_coinc_1,
-                full_coicc_2,
-                coincidence,
-                diff_1,
-                diff_2,
-                period
-            ) = self.PLL.getData()
-
-            try:
-                max = numpy.max(hist1)
-            except:
-                max = 0
-            self.bins = numpy.arange(1, max)
-            histogram1, bins = numpy.histogram(hist1, bins=self.bins)
-            histogram2, bins = numpy.histogram(hist2, bins=self.bins)
-            histogram_coinc_1, bins = numpy.histogram(coinc1, bins=self.bins)
-            histogram_coinc_2, bins = numpy.histogram(coinc2, bins=self.bins)
-
-            self.histBlock_ent1 = numpy.zeros(
-                (int(self.ui.IntTime.value() * 10), len(histogram1))
-            )
-            self.histBlock_ent2 = numpy.zeros(
-                (int(self.ui.IntTime.value() * 10), len(histogram2))
-            )
-            self.histBlock_coinc_1 = numpy.zeros(
-                (int(self.ui.IntTime.value() * 10), len(histogram_coinc_1))
-            )
-
-            # this includes all three bins
-            self.full_coincidence_block = numpy.zeros(int(self.ui.IntTime.value() * 10))
-            self.hist_avg_rate_block = numpy.zeros(int(self.ui.IntTime.value() * 10))
-
-            self.histBlock_coinc_2 = numpy.zeros(
-                (int(self.ui.IntTime.value() * 10), len(histogram_coinc_2))
-            )
-
-            clocks_div = clocks[:: self.divider]
-            pclocks_div = pclocks[:: self.divider]
-            x_clocks = numpy.linspace(0, 1, len(clocks_div))
-            basis_div = numpy.linspace(pclocks[0], pclocks_div[-1], len(pclocks_div))
-
-            self.plt_clock_dirty = self.clockAxis.plot(
-                x_clocks, basis_div - clocks_div, color="k", alpha=0.2, lw=0.3
-            )
-            self.plt_clock_clean = self.clockAxis.plot(
-                x_clocks, basis_div - pclocks_div, color="red", lw=0.3
+            # the PLL bins the tags itself, over the geometry made when it started. Its
+            # frames are taken by self.pll_frames, so only the shapes are needed here
+            geometry = self.PLL.geometry
+            bins = geometry.edges
+            histogram1 = geometry.zeros()
+            histogram2 = geometry.zeros()
+            histogram_coinc_1 = geometry.zeros()
+            histogram_coinc_2 = geometry.zeros()
+
+            # lock quality from the phase error statistics the PLL keeps of every frame
+            edges = self.PLL.phase_bin_edges
+            self.plt_phase_error = self.clockAxis.plot(
+                (edges[:-1] + edges[1:]) / 2,
+                numpy.zeros(len(edges) - 1),
+                color="red",
+                lw=0.8,
             )
+            self.clockAxis.set_xlabel("phase error (ps)")
 
             self.plt_clock_corr_1 = self.correlationAxis.plot(
                 bins[:-1] * 1e-3, histogram1, color="#6d6acc"
@@ -515,8 +502,10 @@ class CoincidenceExample(QMainWindow):
             # self.box = self.correlationAxis.axvspan(
             #     xmin=80 * 1e-3, xmax=160 * 1e-3, alpha=0.1, color="red"
             # )
+            # the center window the PLL counts coincidences in
+            window_start, window_end = self.PLL.coincidence_windows[0, :2]
             self.box = self.correlationAxis.axvspan(
-                xmin=80 * 1e-3, xmax=160 * 1e-3, alpha=0.1, color="blue"
+                xmin=window_start * 1e-3, xmax=window_end * 1e-3, alpha=0.1, color="blue"
             )
             self.coinc_x = []
             self.coinc_y = []
@@ -528,10 +517,6 @@ class CoincidenceExample(QMainWindow):
                 self.coinc_x, self.coinc_y, color="red", label="coupling efficiency"
             )
             # self.coincAxis.legend()
-            if self.ui.LogScaleCheck.isChecked():
-                self.correlationAxis.set_yscale("log")
-            else:
-                self.correlationAxis.set_yscale("linear")
 
         else:
             index = self.correlation.getIndex()
@@ -543,7 +528,6 @@ class CoincidenceExample(QMainWindow):
         self.correlationAxis.set_title("Clock Referenced Histograms")
         self.correlationAxis.grid(True, which="both")
 
-        self.clockAxis.set_ylim(-100, 100)
         self.clockAxis.grid()
         self.clockAxis.set_title("PLL Locking Performance")
 
@@ -551,7 +535,23 @@ class CoincidenceExample(QMainWindow):
         self.coincAxis.set_yscale("linear")
         self.efficiencyAxis.grid(which="both")
         self.efficiencyAxis.set_yscale("linear")
+        self.apply_log_scale()
         # self.coincAxis.set_ylim(0, 600)
+        self.renderer.add_axis(self.counterAxis, self.plt_counter)
+        if self.ent:
+            self.renderer.add_axis(self.clockAxis, self.plt_phase_error, title=True)
+            self.renderer.add_axis(
+                self.correlationAxis,
+                self.plt_clock_corr_1
+                + self.plt_clock_corr_2
+                + self.plt_clock_corr_coinc_1
+                + self.plt_clock_corr_coinc_2,
+            )
+            # these scroll, a wide margin keeps them from rescaling every few frames
+            self.renderer.add_axis(self.coincAxis, self.coinc_line, margin=0.5)
+            self.renderer.add_axis(self.efficiencyAxis, self.coinc_eff_line, margin=0.5)
+        else:
+            self.renderer.add_axis(self.correlationAxis, self.plt_correlation)
         # Generate nicer plots
         self.fig.tight_layout()
 
@@ -614,7 +614,7 @@ class CoincidenceExample(QMainWindow):
         if self.measurements_dirty:
             # If any configuration is changed while the measurements are stopped,
             # recreate them on the start button
-            self.updateMeasurements()
+            self.updateMeasurements(force=True)
         else:
             # else manually start them
             self.counter.start()
@@ -976,7 +976,7 @@ class CoincidenceExample(QMainWindow):
         print("done!")
 
         # self.reInit()
-        self.updateMeasurements()
+        self.updateMeasurements(force=True)
         R = input("Save numpy array? (y/n): ")
         if R == "y" or R == "Y":
             name = input("Input save Name: ")
@@ -1043,10 +1043,11 @@ class CoincidenceExample(QMainWindow):
         plt.show()
 
     def saveHistData(self):
-        persistentData_ent1 = numpy.sum(self.histBlock_ent1, axis=0)
-        persistentData_ent2 = numpy.sum(self.histBlock_ent2, axis=0)
-        persistentData_coinc_1 = numpy.sum(self.histBlock_coinc_1, axis=0)
-        persistentData_coinc_2 = numpy.sum(self.histBlock_coinc_2, axis=0)
+        integrated = self.hist_integrator.rolling()
+        persistentData_ent1 = integrated[HIST_1]
+        persistentData_ent2 = integrated[HIST_2]
+        persistentData_coinc_1 = integrated[COINC_1]
+        persistentData_coinc_2 = integrated[COINC_2]
 
         dic = {
             "channel_1": persistentData_ent1.tolist(),
@@ -1121,8 +1122,9 @@ class CoincidenceExample(QMainWindow):
         time.sleep(0.02)
         self.updateMeasurements()
 
-        persistentData_ent1 = numpy.sum(self.histBlock_ent1, axis=0)
-        persistentData_ent2 = numpy.sum(self.histBlock_ent2, axis=0)
+        integrated = self.hist_integrator.rolling()
+        persistentData_ent1 = integrated[HIST_1]
+        persistentData_ent2 = integrated[HIST_2]
 
         persistentData_ent1_z = persistentData_ent1 - numpy.sum(
             persistentData_ent1
@@ -1215,24 +1217,47 @@ class CoincidenceExample(QMainWindow):
         self.updateMeasurements()
 
     def startPLL(self, data_channel_1, data_channel_2, clock_channel):
-        self.tagger.setEventDivider(self.active_channels[2], 100)
+        # the PLL section of UI_params.yaml, with loop filter gains from pll_tuner.py
+        with open("./UI_params.yaml", "r", encoding="utf8") as stream:
+            pll_params = yaml.safe_load(stream)["PLL"]
+        self.tagger.setEventDivider(
+            self.active_channels[2], int(pll_params["clock_divider"])
+        )
+        # one set of histogram bins over a laser period, for the PLL, the plots and the
+        # actions alike
+        geometry = HistogramGeometry.from_period(
+            float(pll_params["clock_period"]),
+            int(pll_params["mult"]),
+            bin_width=float(pll_params["bin_width"]),
+        )
 
-        # I should be pulling these settings from a local diccionary...
         self.PLL = CustomPLLHistogram(
             self.tagger,
             data_channel_1,
             data_channel_2,
             clock_channel,
-            mult=50000,  # clock multiplier
+            mult=int(pll_params["mult"]),  # clock multiplier
             phase=0,
-            deriv=200,
-            prop=9e-13,
-            n_bins=16000000,
-            # ideally I would figure out how to make the program not crash when 16 million bins runs out. 
-            # but that's a few seconds of integration at the highest count rates. Which hasn't been a problem. 
+            deriv=float(pll_params["deriv"]),
+            prop=float(pll_params["prop"]),
+            n_bins=int(pll_params["n_bins"]),
+            clock_decimation=int(pll_params["clock_decimation"]),
+            clock_envelope=bool(pll_params["clock_envelope"]),
+            acquire_clocks=int(pll_params["acquire_clocks"]),
+            lock_threshold=float(pll_params["lock_threshold"]),
+            lock_clocks=int(pll_params["lock_clocks"]),
+            geometry=geometry,
+            # ring buffers: if 16 million bins run out between two draw() calls the oldest
+            # tags are overwritten, and counted in self.PLL.dropped
         )
         self.pll_store[0] = self.PLL
 
+        # getData() and the frame analysis run on a worker thread, draw() takes the
+        # latest frame
+        if self.pll_frames is not None:
+            self.pll_frames.stop()
+        self.pll_frames = PLLFrameWorker(self.PLL, frame_time=0.05).start()
+        self.unlocked_frames = 0
 
     def clockRefMode(self):
         # self.load_file_params()
@@ -1277,6 +1302,8 @@ class CoincidenceExample(QMainWindow):
 
     def initMeasurement(self):
         cindex = self.ui.measurement_combobox.currentIndex()
+        if self.event_loop_action is not None:
+            self.event_loop_action.cleanup()
         self.event_loop_action = self.measurement_list.load_measurement(cindex)
 
     def saveClicked(self):
@@ -1328,206 +1355,138 @@ class CoincidenceExample(QMainWindow):
         self.fig.tight_layout()
         self.canvas.draw()
 
+    def update_pll_frame(self, frame):
+        """
+        Lock quality, integrations and the event loop action of a new PLL frame. Returns
+        whether the frame was integrated, only frames taken in lock are.
+        """
+        # lock quality from the statistics the PLL keeps, not the clock arrays
+        phase_error = frame["phase_error"]
+        self.plt_phase_error[0].set_ydata(phase_error["counts"])
+        frame_counts = self.pll_frames.frame_counts()
+        title = (
+            f"PLL phase error {phase_error['std']:.2f} ps rms, "
+            f"{frame_counts['dropped'] + frame_counts['skipped']} frames dropped"
+        )
+        if not frame["locked"]:
+            # integrations only start on frames taken in lock. Say so in the title, else
+            # the plots just freeze with a clock noisier than lock_threshold
+            self.unlocked_frames += 1
+            self.clockAxis.set_title(
+                f"{title}, UNLOCKED (lock_threshold "
+                f"{self.PLL.state[0]['lock_threshold']:g} ps): "
+                f"{self.unlocked_frames} frames not integrated",
+                color="red",
+            )
+            return False
+        self.clockAxis.set_title(title, color="black")
+
+        histograms = frame["histograms"]
+        histogram1 = histograms[HIST_1]
+        histogram2 = histograms[HIST_2]
+        self.hist_integrator.add(histograms)
+
+        current_time = frame["time"]
+        efficiency = (
+            frame["coincidence_rate"] / frame["hist_avg_rate"]
+            if frame["hist_avg_rate"]
+            else 0.0
+        )
+        self.rate_integrator.add((frame["coincidence_rate"], efficiency))
+
+        if self.event_loop_action is not None:
+            # actions may open dialogs and drive instruments, so they stay on
+            # the GUI thread
+            self.event_loop_action.evaluate(
+                current_time,
+                len(frame["coinc1"]),
+                main_window=self,
+                coincidence_array_1=frame["coinc1"].tolist(),
+                coincidence_array_2=frame["coinc2"].tolist(),
+                hist_1=histogram1,
+                hist_2=histogram2,
+                full_coinc_1=frame["full_coinc_1"].tolist(),
+                full_coinc_2=frame["full_coinc_2"].tolist(),
+                coincidences=frame["coincidence"],  # count of all period-level coincidences
+                window_counts=frame["window_counts"],  # center bin pairs per PLL coincidence window
+                accidental_counts=frame["accidental_counts"],  # pairs at PLL.accidental_offsets
+                car=frame["car"],
+                phase_error=phase_error,  # PLL phase error statistics of the frame
+                diff_1 = frame["diff_1"],# for time walk analysis
+                diff_2 = frame["diff_2"],
+                period = frame["period"],
+                hist_tags_1 = frame["hist1"],
+                hist_tags_2 = frame["hist2"],
+                geometry=self.PLL.geometry,  # bins of hist_1 and hist_2
+            )
+        return True
+
     def draw(self):
         """Handler for the timer event to update the plots"""
         if self.running:
-            if self.BlockIndex >= int(self.ui.IntTime.value() * 10):
-                self.BlockIndex = 0
-
             data = self.counter.getData()[:3] * self.getCouterNormalizationFactor()
             for data_line, plt_counter in zip(
                 data, self.plt_counter
             ):  # loop though coincidences, Ch1, Ch2
                 plt_counter.set_ydata(data_line)
-            self.counterAxis.relim()
-            self.counterAxis.autoscale_view(True, True, True)
 
+            pll_updated = False
             if self.ent:
-                if self.ui.LogScaleCheck.isChecked():
-                    self.correlationAxis.set_yscale("log")
-                    # self.correlationAxis.set_ylim(.005,.04)
-                else:
-                    self.correlationAxis.set_yscale("linear")
+                self.apply_log_scale()
                 ##############
-                (
-                    clocks,
-                    pclocks,
-                    hist1,
-                    hist2,
-                    coinc1,
-                    coinc2,
-                    full_coinc_1,
-                    full_coinc_2,
-                    coincidence,
-                    diff_1,
-                    diff_2,
-                    period,
-                ) = self.PLL.getData()
-                # print(diff_1[:7])
-                # print(diff_2[:7])
-
-                clocks_div = clocks[:: self.divider]
-                pclocks_div = pclocks[:: self.divider]
-                x_clocks = numpy.linspace(0, 1, len(clocks_div))
-                step = int((pclocks_div[-1] - pclocks_div[0]) / (len(pclocks_div) - 1))
-                basis_div = numpy.arange(
-                    pclocks_div[0], pclocks_div[-1], step, dtype=numpy.int64
-                )
-
-                # do the big subtraction with int64s:
-                try:
-                    clock_dirty = basis_div - clocks_div
-                    clock_clean = basis_div - pclocks_div
-                except ValueError:
-                    # sometimes the basis_div above is not big enough
-                    basis_div = numpy.arange(
-                        pclocks_div[0], pclocks_div[-1] + step, step, dtype=numpy.int64
-                    )
-                    clock_dirty = basis_div - clocks_div
-                    clock_clean = basis_div - pclocks_div
-
-                # make a array to remove that last bit of offset:
-                final_offset = numpy.linspace(
-                    clock_clean[0], clock_clean[-1], len(clock_clean)
-                )
-
-                # then another subtraction
-                clock_dirty = clock_dirty - final_offset  # typecast to float
-                clock_clean = clock_clean - final_offset  # typecast to float
-                self.plt_clock_dirty[0].set_data(x_clocks, clock_dirty)
-                self.plt_clock_clean[0].set_data(x_clocks, clock_clean)
-                self.clockAxis.relim()
-
-                histogram1, bins = numpy.histogram(hist1, bins=self.bins)
-                histogram2, bins = numpy.histogram(hist2, bins=self.bins)
-                histogram_coinc_1, bins = numpy.histogram(coinc1, bins=self.bins)
-                histogram_coinc_2, bins = numpy.histogram(coinc2, bins=self.bins)
-                self.histBlock_ent1[self.BlockIndex] = histogram1
-                self.histBlock_ent2[self.BlockIndex] = histogram2
-                self.histBlock_coinc_1[self.BlockIndex] = histogram_coinc_1
-                self.histBlock_coinc_2[self.BlockIndex] = histogram_coinc_2
-
-                current_time = time.time()
-
-
-                delta_time = current_time - self.prev_time
-                hist_avg_rate = (numpy.sum(histogram1) + numpy.sum(histogram2)) / 2
-                self.full_coincidence_block[self.BlockIndex] = coincidence / delta_time
-                self.hist_avg_rate_block[self.BlockIndex] = hist_avg_rate / delta_time
-                self.prev_time = current_time
-
-                
-
-                if self.event_loop_action is not None:
-                    self.event_loop_action.evaluate(
-                        current_time,
-                        len(coinc1),
-                        main_window=self,
-                        coincidence_array_1=coinc1.tolist(),
-                        coincidence_array_2=coinc2.tolist(),
-                        hist_1=histogram1,
-                        hist_2=histogram2,
-                        full_coinc_1=full_coinc_1.tolist(),
-                        full_coinc_2=full_coinc_2.tolist(),
-                        coincidences=coincidence,  # count of all period-level coincidences
-                        diff_1 = diff_1,# for time walk analysis
-                        diff_2 = diff_2,
-                        period = period,
-                        hist_tags_1 = hist1,
-                        hist_tags_2 = hist2,
-                    )
-
+                frame = self.pll_frames.latest()
+                # without a new frame, with no clock or before lock, only the count
+                # rates are updated
+                if frame is not None:
+                    pll_updated = self.update_pll_frame(frame)
             else:
                 index = self.correlation.getIndex()
                 q = self.correlation.getData()
-                self.histBlock[self.BlockIndex] = q
+                self.correlation_integrator.add(q)
                 self.p += 1
-                self.plt_correlation[0].set_ydata(q)
                 self.correlation.clear()
 
                 # index = self.correlation.getIndex()
                 # data = self.correlation.getData()
                 # self.plt_correlation = self.correlationAxis.plot(index * 1e-3, data)
 
-            if self.ui.IntType.currentText() == "Discrete":
-                if self.BlockIndex == 0:
-                    self.persistentData = numpy.sum(self.histBlock, axis=0)
-                    if self.ent:
-                        self.persistentData_ent1 = numpy.sum(
-                            self.histBlock_ent1, axis=0
-                        )
-                else:
-                    if self.IntType == "Rolling":
-                        # first time changing from Rolling to Discrete
-                        self.persistentData = numpy.sum(self.histBlock, axis=0)
-                        # self.BlockIndex == 1
-                        self.IntType = "Discrete"
-                        if self.ent:
-                            pass
-                currentData = self.persistentData
-                if self.ent:
-                    currentData_ent1 = self.persistentData_ent1
-            else:
-                if self.ent:
-                    # histogram singles
-                    self.persistentData_ent1 = numpy.sum(self.histBlock_ent1, axis=0)
-                    self.persistentData_ent2 = numpy.sum(self.histBlock_ent2, axis=0)
-
-                    # histogram coinc hists
-                    self.persistentData_coinc_1 = numpy.sum(
-                        self.histBlock_coinc_1, axis=0
-                    )
-                    self.persistentData_coinc_2 = numpy.sum(
-                        self.histBlock_coinc_2, axis=0
-                    )
-
-                    currentData_ent1 = self.persistentData_ent1
-                    currentData_ent2 = self.persistentData_ent2
-                    currentData_coinc_1 = self.persistentData_coinc_1
-                    currentData_coinc_2 = self.persistentData_coinc_2
-                    self.plt_clock_corr_1[0].set_ydata(currentData_ent1)
-                    self.plt_clock_corr_2[0].set_ydata(currentData_ent2)
-                    # multiplied by 10 just for better visibility in the UI
-                    self.plt_clock_corr_coinc_1[0].set_ydata(currentData_coinc_1 * 10)
-                    self.plt_clock_corr_coinc_2[0].set_ydata(currentData_coinc_2 * 10)
-
-                    # if self.BlockIndex == 0:
-                    #     coincidences = numpy.sum(self.persistentData_coinc_1)
-
-                    self.coinc_idx += 1
-                    self.coinc_x.append(self.coinc_idx)
-
-                    self.coinc_y.append(numpy.average(self.full_coincidence_block))
-                    self.efficiency_y.append(
-                        numpy.average(
-                            self.full_coincidence_block / self.hist_avg_rate_block
-                        )
-                    )
-                    if len(self.coinc_x) > 50:
-                        self.coinc_x.pop(0)
-                        self.coinc_y.pop(0)
-                        self.efficiency_y.pop(0)
-                    self.coinc_line[0].set_xdata(self.coinc_x)
-                    self.coinc_line[0].set_ydata(self.coinc_y)
-                    self.coinc_eff_line[0].set_xdata(self.coinc_x)
-                    self.coinc_eff_line[0].set_ydata(self.efficiency_y)
-                    self.prev_time = current_time
-
-                else:
-                    currentData = numpy.sum(self.histBlock, axis=0)
-                    self.plt_correlation[0].set_ydata(currentData)
-
-            self.IntType = self.ui.IntType.currentText()
-            self.correlationAxis.relim()
-            self.coincAxis.relim()
-            self.efficiencyAxis.relim()
-            self.coincAxis.autoscale_view(True, True, True)
-            self.efficiencyAxis.autoscale_view(True, True, True)
-            self.correlationAxis.autoscale_view(True, True, True)
-
-            self.canvas.draw()
-
-            self.BlockIndex = self.BlockIndex + 1
+            # both modes read the running sums of the integrators, so a frame costs the
+            # same for any integration time
+            discrete = self.ui.IntType.currentText() == "Discrete"
+            if self.ent and pll_updated:
+                integrated = (
+                    self.hist_integrator.discrete()
+                    if discrete
+                    else self.hist_integrator.rolling()
+                )
+                self.plt_clock_corr_1[0].set_ydata(integrated[HIST_1])
+                self.plt_clock_corr_2[0].set_ydata(integrated[HIST_2])
+                # multiplied by 10 just for better visibility in the UI
+                self.plt_clock_corr_coinc_1[0].set_ydata(integrated[COINC_1] * 10)
+                self.plt_clock_corr_coinc_2[0].set_ydata(integrated[COINC_2] * 10)
+
+                self.coinc_idx += 1
+                self.coinc_x.append(self.coinc_idx)
+                coincidence_rate, efficiency = self.rate_integrator.mean()
+                self.coinc_y.append(coincidence_rate)
+                self.efficiency_y.append(efficiency)
+                if len(self.coinc_x) > 50:
+                    self.coinc_x.pop(0)
+                    self.coinc_y.pop(0)
+                    self.efficiency_y.pop(0)
+                self.coinc_line[0].set_xdata(self.coinc_x)
+                self.coinc_line[0].set_ydata(self.coinc_y)
+                self.coinc_eff_line[0].set_xdata(self.coinc_x)
+                self.coinc_eff_line[0].set_ydata(self.efficiency_y)
+            elif not self.ent:
+                self.plt_correlation[0].set_ydata(
+                    self.correlation_integrator.discrete()
+                    if discrete
+                    else self.correlation_integrator.rolling()
+                )
+
+            # blits the changed lines, rescaling an axis only once its data leaves it
+            self.renderer.draw()
 
 
 # If this file is executed, initialize PySide2, create a TimeTagger object, and show the UI
@@ -1537,6 +1496,10 @@ if __name__ == "__main__":
     # print(sys.argv)
     app = QApplication(sys.argv)
 
+    # compile the PLL kernel while the tagger and the window come up, so clockRefMode
+    # doesn't wait for numba
+    precompile_in_background()
+
     logger = logging.getLogger("measure")
 
     # To override the default severity of logging
@@ -0,0 +1,56 @@
+import math
+import numpy as np
+
+"""
+The bins of the clock referenced histograms.
+
+One HistogramGeometry is made when the PLL starts. The PLL kernels bin the data tags
+with it, draw() plots over its edges and the actions integrate into arrays of its shape.
+Every histogram of a session then has the same length, so they add up without
+truncating or reshaping.
+"""
+
+
+class HistogramGeometry:
+    """
+    n_bins bins of bin_width ps from hist_range[0], covering hist_range. sub_period, the
+    period the data tags are placed in (clock period / mult), is None if not known.
+    """
+
+    def __init__(self, bin_width=1.0, hist_range=(0.0, 250.0), sub_period=None):
+        self.bin_width = float(bin_width)
+        self.hist_range = (float(hist_range[0]), float(hist_range[1]))
+        self.start = self.hist_range[0]
+        self.n_bins = int(math.ceil((self.hist_range[1] - self.start) / self.bin_width))
+        self.edges = self.start + self.bin_width * np.arange(self.n_bins + 1)
+        self.sub_period = sub_period
+
+    @classmethod
+    def from_period(cls, period, mult, bin_width=1.0, phase=0.0):
+        """
+        Bins over one sub period of a clock of period ps, multiplied by mult. The kernels
+        place the data tags in [-phase, sub period - phase), covered by these bins at the
+        nominal period.
+        """
+        sub_period = period / mult
+        return cls(bin_width, (0.0 - phase, sub_period - phase), sub_period)
+
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    def zeros(self, *rows, dtype=np.int64):
+        """A histogram, or an array of rows histograms, to integrate into"""
+        return np.zeros(rows + (self.n_bins,), dtype=dtype)
+
+    def __eq__(self, other):
+        return isinstance(other, HistogramGeometry) and (
+            self.bin_width,
+            self.hist_range,
+            self.sub_period,
+        ) == (other.bin_width, other.hist_range, other.sub_period)
+
+    def __repr__(self):
+        return (
+            f"HistogramGeometry(bin_width={self.bin_width}, hist_range={self.hist_range}, "
+            f"sub_period={self.sub_period})"
+        )
@@ -30,6 +30,7 @@ class ContinuousIntegrate(Action):
             if response["state"] == "abort":
                 self.pass_state = True
                 print("aborting ", self.n)
+                self.cleanup()
                 return {"state": "abort", "name": self.n}
 
             if response["state"] == "finished_continuous":
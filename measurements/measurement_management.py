@@ -65,6 +65,7 @@ class Action:
             if response["state"] == "abort":
                 self.pass_state = True
                 print("aborting ", self.n)
+                self.cleanup()
                 return {"state": "abort", "name": self.n}
             if response["state"] != "finished":
                 break  # break from the 'check if finished' loop and return waiting state (at the bottom)
@@ -87,6 +88,11 @@ class Action:
 
         # how do I bubble up the results from the scan? In each evaluate?
 
+    def cleanup(self):
+        # releases what the actions still pending hold, for when they will never finish
+        for action in getattr(self, "event_list", []):
+            action.cleanup()
+
     def flatten(self, results):
         # to be overridden by child classes
         return results
@@ -333,7 +339,6 @@ class Integrate(Action):
         self.hist_1 = None
         self.hist_2 = None
         self.continuous = continuous
-        self.min_hist_length = 1000
         self.include_histograms = include_histograms
 
     def evaluate(self, current_time, counts, **kwargs):
@@ -341,16 +346,14 @@ class Integrate(Action):
         if self.init_time == -1:
             self.init_time = current_time
 
-            # fix some varying length histograms (kind of a bad hack)
-            hist_1 = kwargs.get("hist_1")
-            hist_2 = kwargs.get("hist_2")
-            if len(hist_1) < self.min_hist_length:
-                self.min_hist_length = len(hist_1)
-            if len(hist_2) < self.min_hist_length:
-                self.min_hist_length = len(hist_2)
-
-            self.hist_1 = np.zeros_like(hist_1[: self.min_hist_length])
-            self.hist_2 = np.zeros_like(hist_2[: self.min_hist_length])
+            # the histograms of a session all have the bins of the PLL geometry
+            geometry = kwargs.get("geometry")
+            if geometry is not None:
+                self.hist_1 = geometry.zeros()
+                self.hist_2 = geometry.zeros()
+            else:
+                self.hist_1 = np.zeros_like(kwargs.get("hist_1"))
+                self.hist_2 = np.zeros_like(kwargs.get("hist_2"))
             if self.label != "default_label":
                 print(f"################################## Beginning: {self.label}")
             return {"state": "integrating"}
@@ -358,17 +361,8 @@ class Integrate(Action):
             # only add counts for evaluations after the init evaluation
             self.counts = self.counts + counts  # add counts
             self.coincidences += kwargs.get("coincidences")
-
-            # fix some varying length histograms
-            hist_1 = kwargs.get("hist_1")
-            hist_2 = kwargs.get("hist_2")
-            if len(hist_1) < self.min_hist_length:
-                self.min_hist_length = len(hist_1)
-            if len(hist_2) < self.min_hist_length:
-                self.min_hist_length = len(hist_2)
-
-            self.hist_1 += hist_1[: self.min_hist_length]
-            self.hist_2 += hist_2[: self.min_hist_length]
+            self.hist_1 += kwargs.get("hist_1")
+            self.hist_2 += kwargs.get("hist_2")
             # print("counts: ", counts)
 
         if (current_time - self.init_time) > self.current_value(self.int_time):
@@ -1058,6 +1052,10 @@ class ConcurrentAction(Action):
         # self.action_information = {"action": "concurrent_action", "state": "working"}
         self.pass_state = False
 
+    def cleanup(self):
+        for action in self.objects:
+            action.cleanup()
+
     def evaluate(self, current_time, counts, **kwargs):
         if self.pass_state:
             return {"state": "passed"}
@@ -238,6 +238,18 @@ class TimeWalkAnalysis(Action):
         self.process.start()
 
         self.mode = Mode.INTEGRATE
+        self.tags_requested = False
+
+    def release_tags(self):
+        if self.tags_requested:
+            self.tags_requested = False
+            self.pll.release_tags()
+
+    def cleanup(self):
+        # aborted or replaced before finishing, stop the pll storing tags for us
+        self.release_tags()
+        if self.process.is_alive():
+            self.process.terminate()
 
     def evaluate(self, current_time, counts, **kwargs):
         logger.debug(f"Evaluating Action: {self.n}")
@@ -250,6 +262,9 @@ class TimeWalkAnalysis(Action):
 
         if self.init_time == -1:
             self.init_time = current_time
+            # the pll only keeps every tag and its diff while someone asks for them
+            self.pll.request_tags()
+            self.tags_requested = True
 
             if self.progress_bar:
                 self.progress_bar = tqdm(total=100)
@@ -310,6 +325,7 @@ class TimeWalkAnalysis(Action):
 
             self.input_queue.put(InputMessage(None, Mode.COMPUTE))
             self.mode = Mode.FINISHED
+            self.release_tags()
 
         if self.mode == Mode.FINISHED:
 
@@ -34,8 +34,8 @@ class Rates(Action):
             return {"state": "integrating"}
         delta_time = current_time - self.prev_time
 
-        self.singles_1_rate.append(len(kwargs["hist_tags_1"])/delta_time)
-        self.singles_2_rate.append(len(kwargs["hist_tags_2"])/delta_time)
+        self.singles_1_rate.append(np.sum(kwargs["hist_1"])/delta_time)
+        self.singles_2_rate.append(np.sum(kwargs["hist_2"])/delta_time)
         self.coinc_rate.append(kwargs["coincidences"]/delta_time)
 
         if (current_time - self.init_time) > self.integration_time:
@@ -0,0 +1,178 @@
+import time
+import threading
+import collections
+import numpy as np
+
+from pll_kernels import HIST_1, HIST_2
+
+"""
+Frames of a CustomPLLHistogram, taken on a worker thread.
+
+getData() waits for the PLL and hands out views into its buffers, and the GUI timer
+used to do that and the frame analysis itself. PLLFrameWorker calls getData() in a loop
+on its own thread (the numba kernels release the GIL), copies the frame out of the PLL
+buffers, adds the statistics draw() needs and keeps the newest frames in a bounded queue.
+The GUI takes the latest frame with latest() and only updates its plots.
+"""
+
+# getData() fields, in order
+FRAME_FIELDS = (
+    "clocks",
+    "pclocks",
+    "hist1",
+    "hist2",
+    "coinc1",
+    "coinc2",
+    "full_coinc_1",
+    "full_coinc_2",
+    "coincidence",
+    "diff_1",
+    "diff_2",
+    "period",
+    "histograms",
+    "window_counts",
+    "accidental_counts",
+)
+# the fields a short frame adds its counts to, the arrays are appended
+SUMMED_FIELDS = ("coincidence", "histograms", "window_counts", "accidental_counts")
+
+
+class PLLFrameWorker:
+    """
+    Takes a frame from pll every frame_time seconds of tags, on a daemon thread. At most
+    max_frames frames wait for the GUI: when it falls behind, the oldest is dropped.
+    getData() has already reset the PLL for a frame with fewer than 2 recorded clocks,
+    so such a short frame is carried over and merged into the next one.
+
+    Every frame is a dict of the getData() fields, named as in FRAME_FIELDS, and of
+    - time: time.time() when the frame was taken, delta_time: since the frame before
+    - locked: the PLL was locked for the whole frame, and any short frame merged into it
+    - phase_error: pll.phase_error() of the frame, without the short frames merged into it
+    - car: coincidence to accidental ratio, pll.car()
+    - coincidence_rate and hist_avg_rate: period coincidences and the mean singles of the
+      two histograms per second
+    """
+
+    def __init__(self, pll, frame_time=0.05, max_frames=4, timeout=0.2):
+        self.pll = pll
+        self.frame_time = frame_time
+        self.timeout = timeout
+        self.frames = collections.deque(maxlen=max_frames)
+        self.frames_lock = threading.Lock()
+        self.running = threading.Event()
+        self.thread = None
+        self.prev_time = None
+        # a short frame waiting to be merged into the next one, with its lock state
+        self.short_frame = None
+        self.short_locked = True
+
+        # frames taken, dropped from the full queue, passed over by latest(), and taken
+        # with a short frame merged in
+        self.taken_frames = 0
+        self.dropped_frames = 0
+        self.skipped_frames = 0
+        self.merged_frames = 0
+
+    def start(self):
+        self.running.set()
+        self.prev_time = time.time()
+        self.short_frame = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop taking frames, returns once the thread is done with the PLL."""
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while self.running.is_set():
+            data = self.pll.getData(
+                min_clocks=np.inf, min_duration=self.frame_time, timeout=self.timeout
+            )
+            locked = self.pll.frame_locked
+            if self.short_frame is not None:
+                data = self.merge_short_frame(data)
+                locked = locked and self.short_locked
+            if len(data[0]) < 2:
+                # the timeout passed without tags, or too few clocks for a frame: getData()
+                # has reset the PLL already, so carry the counts over to the next frame
+                if len(data[0]) or data[8] or data[12].any():
+                    self.keep_short_frame(data, locked)
+                continue
+            if self.short_frame is not None:
+                self.short_frame = None
+                self.merged_frames += 1
+            frame = self.make_frame(data, locked)
+            with self.frames_lock:
+                if len(self.frames) == self.frames.maxlen:
+                    self.dropped_frames += 1
+                self.frames.append(frame)
+                self.taken_frames += 1
+
+    def keep_short_frame(self, data, locked):
+        # getData() recycles its buffers on the next call, so keep a copy
+        self.short_frame = tuple(
+            np.array(value) if isinstance(value, np.ndarray) else value for value in data
+        )
+        self.short_locked = locked
+
+    def merge_short_frame(self, data):
+        """data with the counts of the short frame before it added, and its arrays prepended."""
+        merged = []
+        for name, old, new in zip(FRAME_FIELDS, self.short_frame, data):
+            if name in SUMMED_FIELDS:
+                merged.append(old + new)
+            elif isinstance(new, np.ndarray):
+                merged.append(np.concatenate((old, new)))
+            else:
+                merged.append(new)
+        return tuple(merged)
+
+    def make_frame(self, data, locked):
+        # the arrays are views into PLL buffers the next getData() recycles
+        frame = {
+            name: np.array(value) if isinstance(value, np.ndarray) else value
+            for name, value in zip(FRAME_FIELDS, data)
+        }
+        current_time = time.time()
+        delta_time = current_time - self.prev_time
+        self.prev_time = current_time
+        histograms = frame["histograms"]
+        hist_avg_rate = (histograms[HIST_1].sum() + histograms[HIST_2].sum()) / 2
+        frame.update(
+            time=current_time,
+            delta_time=delta_time,
+            locked=locked,
+            phase_error=self.pll.phase_error(),
+            car=self.pll.car(frame["accidental_counts"]),
+            coincidence_rate=frame["coincidence"] / delta_time,
+            hist_avg_rate=hist_avg_rate / delta_time,
+        )
+        return frame
+
+    def latest(self):
+        """The newest frame, None if there is none since the last call."""
+        with self.frames_lock:
+            if not self.frames:
+                return None
+            frame = self.frames.pop()
+            self.skipped_frames += len(self.frames)
+            self.frames.clear()
+        return frame
+
+    def frame_counts(self):
+        """
+        Frames taken, dropped because the queue was full, skipped by latest(), and taken
+        with a short frame merged in.
+        """
+        with self.frames_lock:
+            return {
+                "taken": self.taken_frames,
+                "dropped": self.dropped_frames,
+                "skipped": self.skipped_frames,
+                "merged": self.merged_frames,
+            }
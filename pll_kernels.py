@@ -0,0 +1,1524 @@
+import numpy as np
+import numba
+import math
+
+
+"""
+Numba kernels shared by the PLL measurements.
+
+The PLL state record and the pieces every kernel is built from live here: the loop
+filter step, lock acquisition and detection, clock recording, data tag placement with
+time walk correction, histogramming and coincidence matching. CustomPLLHistogram,
+MultiChannelPLLHistogram and snspd_pll_histogram compile against the same functions, so
+a fix or an optimization here reaches all of them, and numba caches each function once.
+
+make_kernel() builds the kernels of CustomPLLHistogram and snspd_pll_histogram from them:
+the single loop and parallel kernels, specialized at compile time for the channels, time
+walk correction, coincidences and storage in use. A clock tag goes through track_clock()
+in all of them. MultiChannelPLLHistogram runs its own loop over N channels on the same
+pll_clock_step(), acquire_lock(), lock_detect(), place_data_tag() and histogram_add(). It
+finds the channel of a tag in a lookup table instead of filter_tags(), and counts the
+clocks instead of recording them.
+"""
+
+# bins of the phase error histogram the lock detector keeps, centered on 0
+PHASE_BINS = 64
+# the phase error statistics in the state, reset by getData()
+PHASE_STATS = ("phase_count", "phase_mean", "phase_m2", "phase_min", "phase_max", "phase_counts")
+
+# All scalar state of the PLL lives in a single structured record. The kernels read and
+# write it in place, so process() doesn't need to pass dozens of scalars into the kernel
+# and unpack a tuple of results back onto self for every block.
+PLL_STATE_DTYPE = np.dtype(
+    [
+        # settings
+        ("data_channel_1", np.int64),
+        ("data_channel_2", np.int64),
+        ("clock_channel", np.int64),
+        ("mult", np.int64),
+        ("phase", np.float64),
+        ("deriv", np.float64),
+        ("prop", np.float64),
+        # time walk table: 1 / its step, and the index of its last entry (-1 without one)
+        ("walk_inv_res", np.float64),
+        ("walk_max", np.float64),
+        ("n_chunks", np.int64),  # block chunks of the parallel kernel
+        ("buffer_mask", np.int64),  # buffers are rings of buffer_mask + 1 entries
+        ("clock_mask", np.int64),  # the clock rings, of clock_mask + 1 entries
+        ("clock_decimation", np.int64),  # clocks per recorded clock window
+        ("clock_envelope", np.int64),  # record the extremes of each window, not its first
+        ("store_tags", np.int64),  # keep every data tag, not only the histograms
+        ("hist_start", np.float64),
+        ("bin_width", np.float64),
+        # compact storage: fixed-point positions, int32 diffs and clock deltas
+        ("compact", np.int64),
+        ("position_scale", np.float64),  # codes per ps, 0 stores plain floats
+        ("position_max", np.float64),  # largest code the position dtype holds
+        # loop filter
+        ("init", np.int64),
+        ("clock0", np.int64),
+        ("clock0_dec", np.float64),  # decimal component of clock0
+        ("period", np.float64),
+        ("phi_old", np.float64),
+        ("cycle", np.int64),
+        ("last_lclock", np.int64),  # last stored locked clock, compact clock deltas start here
+        # clock recording: clocks into the current decimation window, and with
+        # clock_envelope the clocks of the lowest and highest phase error in it so far
+        ("window_clocks", np.int64),
+        ("low_error", np.float64),
+        ("low_clock", np.int64),
+        ("low_lclock", np.int64),
+        ("low_dec", np.float64),
+        ("high_error", np.float64),
+        ("high_clock", np.int64),
+        ("high_lclock", np.int64),
+        ("high_dec", np.float64),
+        # lock acquisition and lock detector
+        ("acquire_clocks", np.int64),  # clocks of the least squares fit at init
+        ("lock_threshold", np.float64),  # ps, rms phase error below which the loop is locked
+        ("lock_clocks", np.int64),  # clocks the rms phase error is averaged over
+        ("first_clock", np.int64),
+        ("tracked_clocks", np.int64),  # clocks since the fit
+        ("lock_error", np.float64),  # running mean of the squared phase error, ps^2
+        ("locked", np.int64),
+        ("lock_time", np.int64),  # ps from the first clock to lock, -1 before
+        ("unlocked_clocks", np.int64),  # clocks of the frame before lock, reset by getData()
+        ("frame_clocks", np.int64),  # clocks of the frame, recorded or not, reset by getData()
+        # phase error statistics of the frame in ps, reset by getData(): count, mean and
+        # sum of squared deviations (Welford), extremes and a histogram of PHASE_BINS
+        # bins of phase_bin_width, the outer bins taking everything beyond
+        ("phase_bin_width", np.float64),
+        ("phase_count", np.int64),
+        ("phase_mean", np.float64),
+        ("phase_m2", np.float64),
+        ("phase_min", np.float64),
+        ("phase_max", np.float64),
+        ("phase_counts", np.int64, (PHASE_BINS,)),
+        # time walk
+        ("prev_raw_1", np.int64),
+        ("prev_raw_2", np.int64),
+        # buffer indices, in RING_BUFFERS order, and the coincidence counter.
+        # reset by getData()
+        ("clock_idx", np.int64),
+        ("hist_1_idx", np.int64),
+        ("hist_2_idx", np.int64),
+        ("coinc_idx", np.int64),
+        ("full_coinc_idx", np.int64),
+        ("coincidence", np.int64),
+        # coincidence buffers
+        ("buffer_cycle", np.float64),
+        ("general_buffer_cycle", np.float64),
+        ("general_buffer_tag_hist", np.float64),
+        # proximity coincidences: raw time and position of the buffered tag
+        ("proximity_raw", np.int64),
+        ("proximity_tag", np.float64),
+    ]
+)
+
+# rows of the histogram array the kernels fill
+HIST_1 = 0
+HIST_2 = 1
+COINC_1 = 2  # center bin coincidences, in the first coincidence window
+COINC_2 = 3
+FULL_COINC_1 = 4  # all coincidences in the same period
+FULL_COINC_2 = 5
+N_HISTOGRAMS = 6
+
+# compact storage counts positions from here, so that slightly negative positions and the
+# -200 marker of an already matched buffer tag fit in an unsigned code
+POSITION_ORIGIN = -256.0
+
+# center window tags per channel remembered for accidental coincidences
+ACCIDENTAL_HISTORY = 16
+# window tags the kernels collect before matching them for accidentals
+ACCIDENTAL_BATCH = 4096
+
+# ring buffers, named after their write index in the state
+RING_BUFFERS = ("clock", "hist_1", "hist_2", "coinc", "full_coinc")
+
+# layout of the raw tag records handed to CustomMeasurement.process()
+TAG_DTYPE = np.dtype(
+    [
+        ("type", np.uint8),
+        ("reserved", np.uint8),
+        ("missed_events", np.uint16),
+        ("channel", np.int32),
+        ("time", np.int64),
+    ]
+)
+# type of a regular time tag. Errors, overflow markers and missed event counts have
+# other types
+TIME_TAG = 0
+
+# sources of the tags filter_tags() keeps
+CLOCK = 0
+DATA_1 = 1
+DATA_2 = 2
+# tags the single loop kernels filter at a time, so the columns stay in cache
+FILTER_BATCH = 4096
+
+# with phase_gate, the loop filter skips clocks whose clock_phase() is beyond this
+PHASE_GATE = 0.13
+# ps between the raw times of the two tags of a proximity coincidence
+PROXIMITY = 80
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def filter_tags(
+    tags, start, stop, clock_channel, data_channel_1, data_channel_2, times, sources, clock_pos
+):
+    """
+    Pre-pass over tags[start:stop] of a block, which holds the tags of every channel
+    enabled on the tagger. Writes the time tags of the clock and data channels as a times
+    and a sources column (CLOCK, DATA_1 or DATA_2) in stream order, and the positions of
+    the clock tags among them to clock_pos. Other channels and tag types are dropped.
+    Returns the number of tags and of clock tags written.
+    """
+    kept = 0
+    n_clocks = 0
+    for i in range(start, stop):
+        # every tag is written and only kept ones advance, so the loop doesn't branch on
+        # the channel, which changes unpredictably from tag to tag
+        channel = tags[i]["channel"]
+        is_clock = channel == clock_channel
+        is_1 = channel == data_channel_1
+        keep = (tags[i]["type"] == TIME_TAG) and (
+            is_clock or is_1 or channel == data_channel_2
+        )
+        times[kept] = tags[i]["time"]
+        sources[kept] = CLOCK if is_clock else (DATA_1 if is_1 else DATA_2)
+        clock_pos[n_clocks] = kept
+        n_clocks += keep and is_clock
+        kept += keep
+    return kept, n_clocks
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def filter_block(tags, clock_channel, data_channel_1, data_channel_2):
+    """filter_tags() over a whole block, returning the times, sources and clock_pos."""
+    n = len(tags)
+    times = np.empty(n, dtype=np.int64)
+    sources = np.empty(n, dtype=np.int8)
+    clock_pos = np.empty(n, dtype=np.int64)
+    kept, n_clocks = filter_tags(
+        tags, 0, n, clock_channel, data_channel_1, data_channel_2, times, sources, clock_pos
+    )
+    return times[:kept], sources[:kept], clock_pos[:n_clocks]
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def acquire_lock(tags, state):
+    """
+    Period and phase of the clock from a least squares fit of the clock times against
+    the clock numbers, over the first acquire_clocks clocks of the block. Missed clocks
+    are numbered by the median clock spacing. The loop filter starts from the fitted
+    clock one period before the first clock, with the lock detector reset.
+    Returns False if the block has fewer than two clocks.
+    """
+    st = state[0]
+    clock_channel = st.clock_channel
+    times = np.empty(st.acquire_clocks, dtype=np.int64)
+    n = 0
+    for tag in tags:
+        if tag["channel"] == clock_channel and tag["type"] == TIME_TAG:
+            times[n] = tag["time"]
+            n += 1
+            if n == len(times):
+                break
+    if n < 2:
+        return False
+
+    t = (times[:n] - times[0]).astype(np.float64)
+    k = np.round(t / np.median(np.diff(t)))
+    dk = k - k.mean()
+    period = np.sum(dk * (t - t.mean())) / np.sum(dk * dk)
+    start = t.mean() - period * (k.mean() + 1)  # relative to the first clock
+    whole = math.floor(start)
+
+    st.period = period
+    st.clock0 = times[0] + np.int64(whole)
+    st.clock0_dec = start - whole
+    st.first_clock = times[0]
+    st.tracked_clocks = 0
+    st.lock_error = 0.0
+    st.locked = 0
+    st.lock_time = -1
+    print("Period from", n, "clocks:", period, "ps")
+    return True
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def lock_detect(state, phi0, period, current_clock):
+    """
+    Lock detector, after every loop filter step. The squared phase error in ps is
+    averaged over about lock_clocks clocks. Lock is declared once that many clocks were
+    tracked and the rms error is below lock_threshold, and lost above twice the threshold.
+    Also adds the phase error to the statistics of the frame.
+    """
+    st = state[0]
+    error = phi0 * period / (2 * math.pi)
+
+    st.phase_count += 1
+    delta = error - st.phase_mean
+    st.phase_mean += delta / st.phase_count
+    st.phase_m2 += delta * (error - st.phase_mean)
+    st.phase_min = min(st.phase_min, error)
+    st.phase_max = max(st.phase_max, error)
+    i = int(math.floor(error / st.phase_bin_width)) + PHASE_BINS // 2
+    st.phase_counts[min(max(i, 0), PHASE_BINS - 1)] += 1
+
+    st.tracked_clocks += 1
+    st.lock_error += (error * error - st.lock_error) / min(st.tracked_clocks, st.lock_clocks)
+    threshold = st.lock_threshold * st.lock_threshold
+    if st.locked:
+        if st.lock_error > 4 * threshold:
+            st.locked = 0
+            print("PLL lost lock")
+    elif st.tracked_clocks >= st.lock_clocks and st.lock_error < threshold:
+        st.locked = 1
+        if st.lock_time < 0:
+            st.lock_time = current_clock - st.first_clock
+            print("PLL locked after", st.tracked_clocks, "clocks")
+    if not st.locked:
+        st.unlocked_clocks += 1
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def pll_clock_step(
+    current_clock, clock0, clock0_dec, period, freq, phi_old, cycle, deriv, prop
+):
+    """
+    One update of the loop filter for a new clock tag.
+    Returns the new (clock0, clock0_dec, period, freq, phi_old, cycle).
+    """
+    if clock0 == -1:
+        # clock0 = current_clock - period
+        clock0 = np.int64(current_clock - period)
+        clock0_dec = 0.0
+
+    phi0 = clock_phase(current_clock, clock0, clock0_dec, period)
+    filterr = phi0 + (phi0 - phi_old) * deriv
+    freq = freq - filterr * prop
+
+    # this will handle missed clocks
+    cycles = round((current_clock - clock0) / period)
+    cycle += cycles
+    period = 1 / freq
+    adj = cycles * period
+    adj_int = np.int64(adj)
+    adj_dec = adj - adj_int
+
+    clock0 = clock0 + adj_int
+    clock0_dec = clock0_dec + adj_dec
+    if clock0_dec >= 1:
+        int_add = np.int64(clock0_dec)
+        clock0 = clock0 + int_add
+        clock0_dec = clock0_dec - int_add
+
+    # clock0 = clock0 + adj
+    return clock0, clock0_dec, period, freq, phi0, cycle
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def clock_phase(current_clock, clock0, clock0_dec, period):
+    """sin of the phase of a clock tag against the next locked clock after clock0"""
+    arg_int = current_clock - clock0  # both int64
+    arg = arg_int - clock0_dec
+    arg = (arg - period) * 2 * math.pi  # now its a float
+    arg = arg / period
+    return math.sin(arg)
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def track_clock(
+    state,
+    clock_data,
+    lclock_data,
+    lclock_data_dec,
+    current_clock,
+    clock0,
+    clock0_dec,
+    period,
+    freq,
+    phi_old,
+    cycle,
+    phase_gate,
+):
+    """
+    Everything the kernels do for a clock tag: the loop filter step, lock detection and
+    recording the clock. With phase_gate, a clock whose clock_phase() is beyond
+    PHASE_GATE is skipped entirely. Returns the new (clock0, clock0_dec, period, freq,
+    phi_old, cycle).
+    """
+    st = state[0]
+    if phase_gate and clock0 != -1:
+        if abs(clock_phase(current_clock, clock0, clock0_dec, period)) > PHASE_GATE:
+            return clock0, clock0_dec, period, freq, phi_old, cycle
+    clock0, clock0_dec, period, freq, phi_old, cycle = pll_clock_step(
+        current_clock,
+        clock0,
+        clock0_dec,
+        period,
+        freq,
+        phi_old,
+        cycle,
+        st.deriv,
+        st.prop,
+    )
+    lock_detect(state, phi_old, period, current_clock)
+    record_clock(
+        state, clock_data, lclock_data, lclock_data_dec, current_clock, clock0, clock0_dec
+    )
+    return clock0, clock0_dec, period, freq, phi_old, cycle
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def track_clocks(state, times, clock_pos, clock_data, lclock_data, lclock_data_dec, phase_gate):
+    """
+    track_clock() over the clock tags of a filtered block, carrying the loop filter in
+    the state. Returns the locked clock before the block and after every clock tag, as
+    arrays of len(clock_pos) + 1 entries of clock0, clock0_dec, the sub period and the
+    first minor cycle, for the data tags to look up.
+    """
+    st = state[0]
+    mult = st.mult
+    clock0 = st.clock0
+    clock0_dec = st.clock0_dec
+    period = st.period
+    phi_old = st.phi_old
+    cycle = st.cycle
+    freq = 1 / period
+
+    n_clocks = len(clock_pos)
+    locked_clock0 = np.empty(n_clocks + 1, dtype=np.int64)
+    locked_dec = np.empty(n_clocks + 1, dtype=np.float64)
+    locked_sub_period = np.empty(n_clocks + 1, dtype=np.float64)
+    locked_cycle_base = np.empty(n_clocks + 1, dtype=np.int64)
+    locked_clock0[0] = clock0
+    locked_dec[0] = clock0_dec
+    locked_sub_period[0] = period / mult
+    locked_cycle_base[0] = cycle * mult
+    for k in range(n_clocks):
+        clock0, clock0_dec, period, freq, phi_old, cycle = track_clock(
+            state,
+            clock_data,
+            lclock_data,
+            lclock_data_dec,
+            times[clock_pos[k]],
+            clock0,
+            clock0_dec,
+            period,
+            freq,
+            phi_old,
+            cycle,
+            phase_gate,
+        )
+        locked_clock0[k + 1] = clock0
+        locked_dec[k + 1] = clock0_dec
+        locked_sub_period[k + 1] = period / mult
+        locked_cycle_base[k + 1] = cycle * mult
+
+    st.clock0 = clock0
+    st.clock0_dec = clock0_dec
+    st.period = period
+    st.phi_old = phi_old
+    st.cycle = cycle
+    return locked_clock0, locked_dec, locked_sub_period, locked_cycle_base
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def start_block(tags, state):
+    """
+    What every kernel does first: acquire lock on the first block and reset the buffer
+    indices. Returns False while the blocks have too few clocks to acquire lock.
+    """
+    st = state[0]
+    if st.init:
+        print(
+            "Init PLL with clock channel ",
+            st.clock_channel,
+            " , data1 channel: ",
+            st.data_channel_1,
+            " , and data2 channel ",
+            st.data_channel_2,
+        )
+        if not acquire_lock(tags, state):
+            print("Too few clocks to acquire lock, waiting for the next block")
+            return False
+        st.init = 0
+        st.clock_idx = 0
+        st.hist_1_idx = 0
+        st.hist_2_idx = 0
+        st.coinc_idx = 0
+        st.full_coinc_idx = 0
+        print("[READY] Finished FastProcess Initialization")
+
+    if len(tags) > 10000000:
+        print("Danger: More than 10 million tags per iteration")
+    return True
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def place_data_tag(
+    time,
+    prev_raw,
+    clock0,
+    clock0_dec,
+    sub_period,
+    cycle_base,
+    phase,
+    walk_inv_res,
+    walk_max,
+    walk_offset,
+):
+    """
+    Histogram position of one data tag relative to its locked clock.
+    Returns (hist_tag, minor_cycle, diff), with the same arithmetic as the single loop.
+    """
+    hist_tag = (time - clock0) - clock0_dec
+    diff = time - prev_raw
+    hist_tag = correct_time_walk(hist_tag, diff, walk_inv_res, walk_max, walk_offset)
+    minor_cycles = (hist_tag + phase) // sub_period
+    minor_cycle = cycle_base + minor_cycles
+    hist_tag = hist_tag - (sub_period * minor_cycles)
+    return hist_tag, minor_cycle, diff
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def record_clock(state, clock_data, lclock_data, lclock_data_dec, clock, clock0, clock0_dec):
+    """
+    Count a clock tag and record it at the decimation of the state: the first clock of
+    every clock_decimation clocks, or with clock_envelope the clocks of the lowest and
+    highest phase error of the window, in the order they came, once the window is full.
+    """
+    st = state[0]
+    st.frame_clocks += 1
+    n = st.window_clocks
+    if not st.clock_envelope:
+        if n == 0:
+            store_clock(state, clock_data, lclock_data, lclock_data_dec, clock, clock0, clock0_dec)
+        n += 1
+        st.window_clocks = 0 if n == st.clock_decimation else n
+        return
+
+    error = (clock - clock0) - clock0_dec
+    if n == 0 or error < st.low_error:
+        st.low_error = error
+        st.low_clock = clock
+        st.low_lclock = clock0
+        st.low_dec = clock0_dec
+    if n == 0 or error > st.high_error:
+        st.high_error = error
+        st.high_clock = clock
+        st.high_lclock = clock0
+        st.high_dec = clock0_dec
+    n += 1
+    if n < st.clock_decimation:
+        st.window_clocks = n
+        return
+    st.window_clocks = 0
+    low = (st.low_clock, st.low_lclock, st.low_dec)
+    high = (st.high_clock, st.high_lclock, st.high_dec)
+    if st.high_clock < st.low_clock:
+        low, high = high, low
+    store_clock(state, clock_data, lclock_data, lclock_data_dec, low[0], low[1], low[2])
+    if high[0] != low[0]:
+        store_clock(state, clock_data, lclock_data, lclock_data_dec, high[0], high[1], high[2])
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def store_clock(state, clock_data, lclock_data, lclock_data_dec, clock, clock0, clock0_dec):
+    """
+    Write a clock tag and the locked clock after it to the clock rings. Compact storage
+    keeps the tag relative to the locked clock, and the locked clock relative to the
+    previously written one.
+    """
+    st = state[0]
+    i = st.clock_idx & st.clock_mask
+    if st.compact:
+        clock_data[i] = clamp_int32(clock - clock0)
+        lclock_data[i] = clock0 - st.last_lclock
+    else:
+        clock_data[i] = clock
+        lclock_data[i] = clock0
+    lclock_data_dec[i] = clock0_dec
+    st.last_lclock = clock0
+    st.clock_idx += 1
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def clamp_int32(value):
+    return min(max(value, -2147483648), 2147483647)
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def encode_diff(diff, compact):
+    """Diffs longer than ~2 ms saturate in compact storage."""
+    if compact:
+        return clamp_int32(diff)
+    return diff
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def encode_position(hist_tag, position_scale, position_max):
+    """
+    Value stored for a histogram position: the float itself, or with compact storage
+    the nearest fixed-point code, counted from POSITION_ORIGIN. Codes saturate at 0 and
+    position_max.
+    """
+    if position_scale == 0:
+        return hist_tag
+    code = math.floor((hist_tag - POSITION_ORIGIN) * position_scale + 0.5)
+    return min(max(code, 0.0), position_max)
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def histogram_add(hist_counts, row, hist_tag, hist_start, inv_bin_width):
+    """Count hist_tag in one row of the fixed histograms. Tags outside the range are dropped."""
+    x = (hist_tag - hist_start) * inv_bin_width
+    if (x >= 0) and (x < hist_counts.shape[1]):
+        hist_counts[row, int(x)] += 1
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def in_center_window(hist_tag, is_1, window):
+    """window is one row of coincidence_windows: ch1 start, ch1 end, ch2 start, ch2 end."""
+    if is_1:
+        return (hist_tag > window[0]) and (hist_tag < window[1])
+    return (hist_tag > window[2]) and (hist_tag < window[3])
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def window_coincidences(hist_tag, is_1, minor_cycle, windows, window_state, window_counts):
+    """
+    Center bin coincidence logic for every coincidence window at once.
+
+    window_state[k] holds the (buffer_cycle, buffer_tag_hist) of window k and is
+    updated in place. Pairs are counted in window_counts. Returns the tag that
+    hist_tag pairs with in the first window, or nan if it doesn't pair there.
+    """
+    partner = np.nan
+    for k in range(len(windows)):
+        if not in_center_window(hist_tag, is_1, windows[k]):
+            continue
+        if minor_cycle == window_state[k, 0]:
+            if k == 0:
+                partner = window_state[k, 1]
+            window_counts[k] += 1
+            window_state[k, 1] = -200
+        else:
+            # no match, overwrite buffer with current tag
+            window_state[k, 0] = minor_cycle
+            window_state[k, 1] = hist_tag
+    return partner
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def accidental_scan(
+    window_cycles, window_is_1, n, offsets, history, history_idx, accidental_counts
+):
+    """
+    Cross period pairs among the first n tags a kernel collected from the first
+    coincidence window, in stream order. Each tag is matched against the recent tags
+    of the other channel: history[0] and history[1] are rings of the minor cycles of
+    the last ACCIDENTAL_HISTORY window tags of channel 1 and 2, history_idx their write
+    counts. A pair counts for offset k when the channel 2 tag is k periods after the
+    channel 1 tag. Each pair is counted once, when its later tag arrives.
+
+    The kernels collect the window tags in batches of ACCIDENTAL_BATCH and match them
+    here. Matching inside the tag loop slows down the loop for every tag.
+    """
+    max_offset = np.abs(offsets).max()
+    size = history.shape[1]
+    for i in range(n):
+        minor_cycle = window_cycles[i]
+        own = 0 if window_is_1[i] else 1
+        other = 1 - own
+        idx = history_idx[other]
+        for j in range(min(idx, size)):
+            earlier = history[other, (idx - 1 - j) & (size - 1)]
+            if minor_cycle - earlier > max_offset:
+                break  # the ring is in stream order, older tags are further away
+            k = earlier - minor_cycle if own == 0 else minor_cycle - earlier
+            for o in range(len(offsets)):
+                if k == offsets[o]:
+                    accidental_counts[o] += 1
+        history[own, history_idx[own] & (size - 1)] = minor_cycle
+        history_idx[own] += 1
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def coincidence_scan(
+    lo,
+    hi,
+    minor_cycle,
+    is_1,
+    hist_tags,
+    windows,
+    cstate,
+    wstate,
+    full_1,
+    full_2,
+    center_1,
+    center_2,
+    out,
+    counts,
+    window_counts,
+    hist_start,
+    inv_bin_width,
+    write,
+):
+    """
+    The coincidence logic of the single loop kernel over the placed data tags lo to hi.
+
+    cstate holds (buffer_cycle, general_buffer_cycle, general_buffer_tag_hist) and
+    wstate the window buffers (see window_coincidences), both updated in place. If
+    write is set, pairs are stored from index out on and added to the coincidence rows
+    of counts. Returns the number of period coincidences, full coincidence pairs and
+    center bin pairs of the first window.
+    """
+    buffer_cycle = cstate[0]
+    general_buffer_cycle = cstate[1]
+    general_buffer_tag_hist = cstate[2]
+    coincidence = 0
+    n_full = 0
+    n_center = 0
+    for i in range(lo, hi):
+        hist_tag = hist_tags[i]
+        cyc = minor_cycle[i]
+        if cyc == buffer_cycle:
+            coincidence += 1
+            buffer_cycle = -200
+        else:
+            buffer_cycle = cyc
+
+        if cyc == general_buffer_cycle:
+            if write:
+                if is_1[i]:
+                    full_1[out + n_full] = hist_tag
+                    full_2[out + n_full] = general_buffer_tag_hist
+                else:
+                    full_2[out + n_full] = hist_tag
+                    full_1[out + n_full] = general_buffer_tag_hist
+                histogram_add(
+                    counts, FULL_COINC_1, full_1[out + n_full], hist_start, inv_bin_width
+                )
+                histogram_add(
+                    counts, FULL_COINC_2, full_2[out + n_full], hist_start, inv_bin_width
+                )
+            general_buffer_tag_hist = -200
+            n_full += 1
+        else:
+            general_buffer_tag_hist = hist_tag
+            general_buffer_cycle = cyc
+
+        partner = window_coincidences(
+            hist_tag, is_1[i], cyc, windows, wstate, window_counts
+        )
+        if not math.isnan(partner):
+            if write:
+                if is_1[i]:
+                    center_1[out + n_center] = hist_tag
+                    center_2[out + n_center] = partner
+                else:
+                    center_2[out + n_center] = hist_tag
+                    center_1[out + n_center] = partner
+                histogram_add(
+                    counts, COINC_1, center_1[out + n_center], hist_start, inv_bin_width
+                )
+                histogram_add(
+                    counts, COINC_2, center_2[out + n_center], hist_start, inv_bin_width
+                )
+            n_center += 1
+
+    cstate[0] = buffer_cycle
+    cstate[1] = general_buffer_cycle
+    cstate[2] = general_buffer_tag_hist
+    return coincidence, n_full, n_center
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def coincidence_resume(start, minor_cycle, is_1, hist_tags, windows):
+    """
+    Index from which coincidence_scan, started with empty buffers, is in the exact
+    state by the time it reaches data tag start. 0 means the buffers carried in from
+    the previous block are needed.
+
+    After any tag the buffers only remember that tag's minor cycle (and whether it was
+    itself matched), so they only depend on history through runs of tags in the same
+    minor cycle. Going back to the start of the run before start is enough, for all
+    data tags and separately for the tags in every coincidence window.
+    """
+    if start == 0:
+        return 0
+    last = minor_cycle[start - 1]
+    resume = start - 1
+    while resume > 0 and minor_cycle[resume - 1] == last:
+        resume -= 1
+
+    for k in range(len(windows)):
+        window = windows[k]
+        j = start - 1
+        while j >= 0 and not in_center_window(hist_tags[j], is_1[j], window):
+            j -= 1
+        if j < 0:
+            return 0
+        last = minor_cycle[j]
+        run_start = j
+        j -= 1
+        while j >= 0:
+            if in_center_window(hist_tags[j], is_1[j], window):
+                if minor_cycle[j] != last:
+                    break
+                run_start = j
+            j -= 1
+        if j < 0:
+            return 0
+        resume = min(resume, run_start)
+    return resume
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def accidental_resume(start, is_1, hist_tags, window, history_size):
+    """
+    Index from which accidental_scan, started with empty rings, holds the same
+    rings by the time it reaches data tag start: the last history_size center window
+    tags of both channels. 0 means the rings carried in from the previous block are
+    needed.
+    """
+    resume = start
+    for channel_1 in (True, False):
+        found = 0
+        j = start - 1
+        while j >= 0 and found < history_size:
+            if is_1[j] == channel_1 and in_center_window(hist_tags[j], is_1[j], window):
+                found += 1
+            j -= 1
+        if found < history_size:
+            return 0
+        resume = min(resume, j + 1)
+    return resume
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def correct_time_walk(hist_tag, diff, walk_inv_res, walk_max, walk_offset):
+    """
+    hist_tag less the time walk offset for a tag diff ps after the previous one.
+    walk_offset[i] belongs to the middle of bin i, (i + 0.5) / walk_inv_res, and the
+    offsets in between are interpolated linearly. Diffs outside the table are clamped to
+    its first or last entry (walk_offset[walk_max + 1] is the padding). No correction
+    without a table, walk_max < 0.
+    """
+    if walk_max < 0:
+        return hist_tag
+    x = min(max(diff * walk_inv_res - 0.5, 0.0), walk_max)
+    i = int(x)
+    low = walk_offset[i]
+    return hist_tag - (low + (x - i) * (walk_offset[i + 1] - low))
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def correct_time_walk_batch(hist_tags, diffs, walk_inv_res, walk_max, walk_offset):
+    """correct_time_walk() over whole arrays of tags, in place."""
+    for i in range(len(hist_tags)):
+        hist_tags[i] = correct_time_walk(
+            hist_tags[i], diffs[i], walk_inv_res, walk_max, walk_offset
+        )
+
+
+# kernels built by make_kernel(), by variant
+KERNELS = {}
+
+
+def make_kernel(
+    two_channels=True,
+    time_walk=True,
+    coincidences=True,
+    parallel=False,
+    compact=False,
+    proximity=False,
+    phase_gate=False,
+):
+    """
+    The PLL kernel of a variant. The flags are constants of the compiled code, so a
+    variant leaves out what it doesn't use instead of testing for it at every tag. Each
+    variant is compiled once and cached on disk by numba.
+
+    two_channels   bin the tags of data_channel_2 too
+    time_walk      correct the data tags with the walk_offset tables
+    coincidences   count the coincidences of the two channels: all pairs in the same
+                   period, the pairs in the center of every coincidence window and the
+                   accidentals. Needs two_channels
+    parallel       after the loop filter, place the data tags and find the coincidences
+                   of chunks of the block on several cores
+    compact        the buffers are compact storage (see CustomPLLHistogram)
+    proximity      instead of the same period rules, pair tags in the center of the first
+                   window that are at most PROXIMITY ps apart in raw time, whichever their
+                   channels. The earlier tag of a pair goes to coinc_1, the later to
+                   coinc_2. Not with parallel
+    phase_gate     the loop filter skips clocks beyond PHASE_GATE (see track_clock)
+
+    kernel(tags, state, clock_data, lclock_data, lclock_data_dec, hist_1_tags_data,
+    hist_2_tags_data, diff_1_data, diff_2_data, walk_offset_1, walk_offset_2, coinc_1,
+    coinc_2, full_coinc_1, full_coinc_2, hist_counts, windows, window_state,
+    window_counts, accidental_offsets, accidental_history, accidental_idx,
+    accidental_counts) processes one block of tags. state is a length 1 array of
+    PLL_STATE_DTYPE, read into locals and written back, so the loops work on registers.
+    All variants give the same results as the single loop for the parts they share.
+    """
+    coincidences = bool(coincidences and two_channels)
+    key = (
+        bool(two_channels),
+        bool(time_walk),
+        coincidences,
+        bool(parallel),
+        bool(compact),
+        bool(proximity and coincidences),
+        bool(phase_gate),
+    )
+    if key in KERNELS:
+        return KERNELS[key]
+    two_channels, time_walk, coincidences, parallel, compact, proximity, phase_gate = key
+    if parallel and proximity:
+        raise ValueError("proximity coincidences need one of the sequential kernels")
+
+    def sequential_kernel(
+        tags,
+        state,
+        clock_data,
+        lclock_data,
+        lclock_data_dec,
+        hist_1_tags_data,
+        hist_2_tags_data,
+        diff_1_data,
+        diff_2_data,
+        walk_offset_1,
+        walk_offset_2,
+        coinc_1,
+        coinc_2,
+        full_coinc_1,
+        full_coinc_2,
+        hist_counts,
+        windows,
+        window_state,
+        window_counts,
+        accidental_offsets,
+        accidental_history,
+        accidental_idx,
+        accidental_counts,
+    ):
+        if not start_block(tags, state):
+            return
+        st = state[0]
+        data_channel_1 = st.data_channel_1
+        data_channel_2 = st.data_channel_2
+        clock_channel = st.clock_channel
+        mult = st.mult
+        phase = st.phase
+        walk_inv_res = st.walk_inv_res
+        # without time walk, correct_time_walk() returns the tag unchanged
+        walk_max = st.walk_max if time_walk else -1.0
+        mask = st.buffer_mask
+        position_scale = st.position_scale if compact else 0.0
+        position_max = st.position_max
+        store_tags = st.store_tags
+        hist_start = st.hist_start
+        inv_bin_width = 1 / st.bin_width
+
+        clock0 = st.clock0
+        clock0_dec = st.clock0_dec
+        period = st.period
+        phi_old = st.phi_old
+        cycle = st.cycle
+        freq = 1 / period
+        # the locked clock the data tags are placed against
+        sub_period = period / mult
+        cycle_base = cycle * mult
+        prev_raw_1 = st.prev_raw_1  # used for jitterate analysis
+        prev_raw_2 = st.prev_raw_2
+        hist_1_idx = st.hist_1_idx
+        hist_2_idx = st.hist_2_idx
+        coinc_idx = st.coinc_idx
+        full_coinc_idx = st.full_coinc_idx
+        coincidence = st.coincidence
+        buffer_cycle = st.buffer_cycle
+        general_buffer_cycle = st.general_buffer_cycle
+        general_buffer_tag_hist = st.general_buffer_tag_hist
+        proximity_raw = st.proximity_raw
+        proximity_tag = st.proximity_tag
+
+        # the first window's tags, matched for accidentals in batches outside the loop
+        window_cycles = np.empty(ACCIDENTAL_BATCH, dtype=np.float64)
+        window_is_1 = np.empty(ACCIDENTAL_BATCH, dtype=np.bool_)
+        n_window_tags = 0
+        # drop the other channels and tag types, and read the record fields once, in
+        # batches so the columns stay in cache
+        times = np.empty(FILTER_BATCH, dtype=np.int64)
+        sources = np.empty(FILTER_BATCH, dtype=np.int8)
+        clock_pos = np.empty(FILTER_BATCH, dtype=np.int64)
+        for start in range(0, len(tags), FILTER_BATCH):
+            n_kept, n_clocks = filter_tags(
+                tags,
+                start,
+                min(start + FILTER_BATCH, len(tags)),
+                clock_channel,
+                data_channel_1,
+                data_channel_2,
+                times,
+                sources,
+                clock_pos,
+            )
+            for i in range(n_kept):
+                time = times[i]
+                source = sources[i]
+                if source == CLOCK:
+                    clock0, clock0_dec, period, freq, phi_old, cycle = track_clock(
+                        state,
+                        clock_data,
+                        lclock_data,
+                        lclock_data_dec,
+                        time,
+                        clock0,
+                        clock0_dec,
+                        period,
+                        freq,
+                        phi_old,
+                        cycle,
+                        phase_gate,
+                    )
+                    sub_period = period / mult
+                    cycle_base = cycle * mult
+                    continue
+
+                is_1 = source == DATA_1
+                if not (is_1 or two_channels):
+                    continue
+                if clock0 == -1:
+                    continue
+
+                # position in the period, after the time walk correction, and the diff
+                # to the previous tag of the same channel
+                if is_1:
+                    hist_tag, minor_cycle, diff = place_data_tag(
+                        time,
+                        prev_raw_1,
+                        clock0,
+                        clock0_dec,
+                        sub_period,
+                        cycle_base,
+                        phase,
+                        walk_inv_res,
+                        walk_max,
+                        walk_offset_1,
+                    )
+                    prev_raw_1 = time
+                    if store_tags:
+                        diff_1_data[hist_1_idx & mask] = encode_diff(diff, compact)
+                        hist_1_tags_data[hist_1_idx & mask] = encode_position(
+                            hist_tag, position_scale, position_max
+                        )
+                        hist_1_idx += 1
+                    histogram_add(hist_counts, HIST_1, hist_tag, hist_start, inv_bin_width)
+                else:
+                    hist_tag, minor_cycle, diff = place_data_tag(
+                        time,
+                        prev_raw_2,
+                        clock0,
+                        clock0_dec,
+                        sub_period,
+                        cycle_base,
+                        phase,
+                        walk_inv_res,
+                        walk_max,
+                        walk_offset_2,
+                    )
+                    prev_raw_2 = time
+                    if store_tags:
+                        diff_2_data[hist_2_idx & mask] = encode_diff(diff, compact)
+                        hist_2_tags_data[hist_2_idx & mask] = encode_position(
+                            hist_tag, position_scale, position_max
+                        )
+                        hist_2_idx += 1
+                    histogram_add(hist_counts, HIST_2, hist_tag, hist_start, inv_bin_width)
+
+                if not coincidences:
+                    continue
+
+                if proximity:
+                    if in_center_window(hist_tag, is_1, windows[0]):
+                        if abs(time - proximity_raw) <= PROXIMITY:
+                            coinc_1[coinc_idx & mask] = encode_position(
+                                proximity_tag, position_scale, position_max
+                            )
+                            coinc_2[coinc_idx & mask] = encode_position(
+                                hist_tag, position_scale, position_max
+                            )
+                            histogram_add(
+                                hist_counts, COINC_1, proximity_tag, hist_start, inv_bin_width
+                            )
+                            histogram_add(
+                                hist_counts, COINC_2, hist_tag, hist_start, inv_bin_width
+                            )
+                            window_counts[0] += 1
+                            coinc_idx += 1
+                            proximity_tag = -200
+                            proximity_raw = 0
+                        else:
+                            # no match, overwrite buffer with current tag
+                            proximity_tag = hist_tag
+                            proximity_raw = time
+                    continue
+
+                # look for general coincidence.
+                # This does not tell you which is channel 1 and which is channel 2
+                if minor_cycle == buffer_cycle:
+                    coincidence += 1
+                    buffer_cycle = -200
+                else:
+                    buffer_cycle = minor_cycle
+
+                # all pairs of the two channels in the same period
+                if minor_cycle == general_buffer_cycle:
+                    if is_1:
+                        pair_1 = hist_tag
+                        pair_2 = general_buffer_tag_hist
+                    else:
+                        pair_1 = general_buffer_tag_hist
+                        pair_2 = hist_tag
+                    full_coinc_1[full_coinc_idx & mask] = encode_position(
+                        pair_1, position_scale, position_max
+                    )
+                    full_coinc_2[full_coinc_idx & mask] = encode_position(
+                        pair_2, position_scale, position_max
+                    )
+                    histogram_add(hist_counts, FULL_COINC_1, pair_1, hist_start, inv_bin_width)
+                    histogram_add(hist_counts, FULL_COINC_2, pair_2, hist_start, inv_bin_width)
+                    general_buffer_tag_hist = -200
+                    full_coinc_idx += 1
+                else:
+                    # no match, overwrite buffer with current tag
+                    general_buffer_tag_hist = hist_tag
+                    general_buffer_cycle = minor_cycle
+
+                # center bin coincidences, in every window
+                partner = window_coincidences(
+                    hist_tag, is_1, minor_cycle, windows, window_state, window_counts
+                )
+                if in_center_window(hist_tag, is_1, windows[0]):
+                    window_cycles[n_window_tags] = minor_cycle
+                    window_is_1[n_window_tags] = is_1
+                    n_window_tags += 1
+                    if n_window_tags == ACCIDENTAL_BATCH:
+                        accidental_scan(
+                            window_cycles,
+                            window_is_1,
+                            n_window_tags,
+                            accidental_offsets,
+                            accidental_history,
+                            accidental_idx,
+                            accidental_counts,
+                        )
+                        n_window_tags = 0
+                if not math.isnan(partner):
+                    # the counts are from the same period
+                    if is_1:
+                        pair_1 = hist_tag
+                        pair_2 = partner
+                    else:
+                        pair_1 = partner
+                        pair_2 = hist_tag
+                    coinc_1[coinc_idx & mask] = encode_position(
+                        pair_1, position_scale, position_max
+                    )
+                    coinc_2[coinc_idx & mask] = encode_position(
+                        pair_2, position_scale, position_max
+                    )
+                    histogram_add(hist_counts, COINC_1, pair_1, hist_start, inv_bin_width)
+                    histogram_add(hist_counts, COINC_2, pair_2, hist_start, inv_bin_width)
+                    coinc_idx += 1
+
+        if coincidences and not proximity:
+            accidental_scan(
+                window_cycles,
+                window_is_1,
+                n_window_tags,
+                accidental_offsets,
+                accidental_history,
+                accidental_idx,
+                accidental_counts,
+            )
+
+        st.clock0 = clock0
+        st.clock0_dec = clock0_dec
+        st.period = period
+        st.phi_old = phi_old
+        st.cycle = cycle
+        st.prev_raw_1 = prev_raw_1
+        st.prev_raw_2 = prev_raw_2
+        st.hist_1_idx = hist_1_idx
+        st.hist_2_idx = hist_2_idx
+        st.coinc_idx = coinc_idx
+        st.full_coinc_idx = full_coinc_idx
+        st.coincidence = coincidence
+        st.buffer_cycle = buffer_cycle
+        st.general_buffer_cycle = general_buffer_cycle
+        st.general_buffer_tag_hist = general_buffer_tag_hist
+        st.proximity_raw = proximity_raw
+        st.proximity_tag = proximity_tag
+
+    def parallel_kernel(
+        tags,
+        state,
+        clock_data,
+        lclock_data,
+        lclock_data_dec,
+        hist_1_tags_data,
+        hist_2_tags_data,
+        diff_1_data,
+        diff_2_data,
+        walk_offset_1,
+        walk_offset_2,
+        coinc_1,
+        coinc_2,
+        full_coinc_1,
+        full_coinc_2,
+        hist_counts,
+        windows,
+        window_state,
+        window_counts,
+        accidental_offsets,
+        accidental_history,
+        accidental_idx,
+        accidental_counts,
+    ):
+        """
+        After the loop filter has run over the clocks, the block is cut into chunks at
+        clock tags. The data tags of every chunk are placed on their own core, then the
+        coincidences of every chunk are found on their own core. A chunk rebuilds the
+        coincidence buffers it starts with from the tags just before it (see
+        coincidence_resume), so the chunks are stitched back together exactly.
+        """
+        if not start_block(tags, state):
+            return
+        st = state[0]
+        phase = st.phase
+        walk_inv_res = st.walk_inv_res
+        walk_max = st.walk_max if time_walk else -1.0
+        mask = st.buffer_mask
+        position_scale = st.position_scale if compact else 0.0
+        position_max = st.position_max
+        store_tags = st.store_tags
+        hist_start = st.hist_start
+        inv_bin_width = 1 / st.bin_width
+        hist_1_idx = st.hist_1_idx
+        hist_2_idx = st.hist_2_idx
+
+        # drop the other channels and tag types, and read the record fields once
+        times, sources, clock_pos = filter_block(
+            tags, st.clock_channel, st.data_channel_1, st.data_channel_2
+        )
+        n_clocks = len(clock_pos)
+        locked_clock0, locked_dec, locked_sub_period, locked_cycle_base = track_clocks(
+            state, times, clock_pos, clock_data, lclock_data, lclock_data_dec, phase_gate
+        )
+
+        # cut the block at clock tags. chunk c starts at tag bounds[c], after
+        # first_clock[c] clock tags of this block
+        n_chunks = max(1, min(n_clocks + 1, st.n_chunks))
+        bounds = np.empty(n_chunks + 1, dtype=np.int64)
+        first_clock = np.empty(n_chunks, dtype=np.int64)
+        bounds[0] = 0
+        first_clock[0] = 0
+        for c in range(1, n_chunks):
+            first_clock[c] = (c * n_clocks) // n_chunks
+            bounds[c] = clock_pos[first_clock[c]]
+        bounds[n_chunks] = len(times)
+
+        # count the data tags of every chunk, so each one knows where its output goes
+        n_1 = np.zeros(n_chunks, dtype=np.int64)
+        n_2 = np.zeros(n_chunks, dtype=np.int64)
+        last_raw_1 = np.zeros(n_chunks, dtype=np.int64)
+        last_raw_2 = np.zeros(n_chunks, dtype=np.int64)
+        for c in numba.prange(n_chunks):
+            k = first_clock[c]
+            for i in range(bounds[c], bounds[c + 1]):
+                source = sources[i]
+                if source == CLOCK:
+                    k += 1
+                elif locked_clock0[k] != -1:
+                    if source == DATA_1:
+                        n_1[c] += 1
+                        last_raw_1[c] = times[i]
+                    elif two_channels:
+                        n_2[c] += 1
+                        last_raw_2[c] = times[i]
+
+        offset_1 = np.empty(n_chunks, dtype=np.int64)
+        offset_2 = np.empty(n_chunks, dtype=np.int64)
+        offset_data = np.empty(n_chunks + 1, dtype=np.int64)
+        prev_raw_1 = np.empty(n_chunks, dtype=np.int64)
+        prev_raw_2 = np.empty(n_chunks, dtype=np.int64)
+        raw_1 = st.prev_raw_1
+        raw_2 = st.prev_raw_2
+        offset_data[0] = 0
+        for c in range(n_chunks):
+            offset_1[c] = hist_1_idx
+            offset_2[c] = hist_2_idx
+            offset_data[c + 1] = offset_data[c] + n_1[c] + n_2[c]
+            prev_raw_1[c] = raw_1
+            prev_raw_2[c] = raw_2
+            if store_tags:
+                hist_1_idx += n_1[c]
+                hist_2_idx += n_2[c]
+            if n_1[c] > 0:
+                raw_1 = last_raw_1[c]
+            if n_2[c] > 0:
+                raw_2 = last_raw_2[c]
+        n_data = offset_data[n_chunks]
+
+        # place the data tags. all data tags of the block are also kept in stream
+        # order for the coincidence pass. every chunk fills its own histograms
+        minor_cycle = np.empty(n_data, dtype=np.float64)
+        hist_tags = np.empty(n_data, dtype=np.float64)
+        is_1 = np.empty(n_data, dtype=np.bool_)
+        chunk_counts = np.zeros((n_chunks,) + hist_counts.shape, dtype=np.int64)
+        for c in numba.prange(n_chunks):
+            counts = chunk_counts[c]
+            k = first_clock[c]
+            i_1 = offset_1[c]
+            i_2 = offset_2[c]
+            d = offset_data[c]
+            p_1 = prev_raw_1[c]
+            p_2 = prev_raw_2[c]
+            for i in range(bounds[c], bounds[c + 1]):
+                source = sources[i]
+                if source == CLOCK:
+                    k += 1
+                    continue
+                if locked_clock0[k] == -1:
+                    continue
+                time = times[i]
+                if source == DATA_1:
+                    hist_tag, cyc, diff = place_data_tag(
+                        time,
+                        p_1,
+                        locked_clock0[k],
+                        locked_dec[k],
+                        locked_sub_period[k],
+                        locked_cycle_base[k],
+                        phase,
+                        walk_inv_res,
+                        walk_max,
+                        walk_offset_1,
+                    )
+                    p_1 = time
+                    if store_tags:
+                        diff_1_data[i_1 & mask] = encode_diff(diff, compact)
+                        hist_1_tags_data[i_1 & mask] = encode_position(
+                            hist_tag, position_scale, position_max
+                        )
+                        i_1 += 1
+                    histogram_add(counts, HIST_1, hist_tag, hist_start, inv_bin_width)
+                    is_1[d] = True
+                elif two_channels:
+                    hist_tag, cyc, diff = place_data_tag(
+                        time,
+                        p_2,
+                        locked_clock0[k],
+                        locked_dec[k],
+                        locked_sub_period[k],
+                        locked_cycle_base[k],
+                        phase,
+                        walk_inv_res,
+                        walk_max,
+                        walk_offset_2,
+                    )
+                    p_2 = time
+                    if store_tags:
+                        diff_2_data[i_2 & mask] = encode_diff(diff, compact)
+                        hist_2_tags_data[i_2 & mask] = encode_position(
+                            hist_tag, position_scale, position_max
+                        )
+                        i_2 += 1
+                    histogram_add(counts, HIST_2, hist_tag, hist_start, inv_bin_width)
+                    is_1[d] = False
+                else:
+                    continue
+                hist_tags[d] = hist_tag
+                minor_cycle[d] = cyc
+                d += 1
+
+        for c in range(n_chunks):
+            hist_counts += chunk_counts[c]
+        st.prev_raw_1 = raw_1
+        st.prev_raw_2 = raw_2
+        st.hist_1_idx = hist_1_idx
+        st.hist_2_idx = hist_2_idx
+        if not coincidences:
+            return
+
+        # coincidences of every chunk. pairs are written at the chunk's own data
+        # offset and packed into the output arrays afterwards
+        chunk_counts[:] = 0
+        carried = np.empty(3, dtype=np.float64)
+        carried[0] = st.buffer_cycle
+        carried[1] = st.general_buffer_cycle
+        carried[2] = st.general_buffer_tag_hist
+        n_windows = len(windows)
+        coinc_state = np.empty((n_chunks, 3), dtype=np.float64)
+        chunk_window_state = np.empty((n_chunks, n_windows, 2), dtype=np.float64)
+        chunk_window_counts = np.zeros((n_chunks, n_windows), dtype=np.int64)
+        replay_window_counts = np.zeros((n_chunks, n_windows), dtype=np.int64)
+        n_coincidence = np.zeros(n_chunks, dtype=np.int64)
+        n_full = np.zeros(n_chunks, dtype=np.int64)
+        n_center = np.zeros(n_chunks, dtype=np.int64)
+        full_1 = np.empty(n_data, dtype=np.float64)
+        full_2 = np.empty(n_data, dtype=np.float64)
+        center_1 = np.empty(n_data, dtype=np.float64)
+        center_2 = np.empty(n_data, dtype=np.float64)
+        for c in numba.prange(n_chunks):
+            start = offset_data[c]
+            resume = coincidence_resume(start, minor_cycle, is_1, hist_tags, windows)
+            cstate = coinc_state[c]
+            wstate = chunk_window_state[c]
+            if resume == 0:
+                cstate[:] = carried
+                wstate[:] = window_state
+            else:
+                cstate[:] = np.nan  # never matches
+                wstate[:] = np.nan
+            # replay the tags before the chunk only to rebuild the buffers
+            coincidence_scan(
+                resume,
+                start,
+                minor_cycle,
+                is_1,
+                hist_tags,
+                windows,
+                cstate,
+                wstate,
+                full_1,
+                full_2,
+                center_1,
+                center_2,
+                start,
+                chunk_counts[c],
+                replay_window_counts[c],
+                hist_start,
+                inv_bin_width,
+                False,
+            )
+            n_coincidence[c], n_full[c], n_center[c] = coincidence_scan(
+                start,
+                offset_data[c + 1],
+                minor_cycle,
+                is_1,
+                hist_tags,
+                windows,
+                cstate,
+                wstate,
+                full_1,
+                full_2,
+                center_1,
+                center_2,
+                start,
+                chunk_counts[c],
+                chunk_window_counts[c],
+                hist_start,
+                inv_bin_width,
+                True,
+            )
+
+        # accidentals of every chunk. a chunk rebuilds the rings it starts with from the
+        # window tags just before it (see accidental_resume)
+        n_offsets = len(accidental_offsets)
+        chunk_history = np.empty((n_chunks,) + accidental_history.shape, dtype=np.float64)
+        chunk_history_idx = np.empty((n_chunks, 2), dtype=np.int64)
+        chunk_accidentals = np.zeros((n_chunks, n_offsets), dtype=np.int64)
+        for c in numba.prange(n_chunks):
+            start = offset_data[c]
+            resume = accidental_resume(start, is_1, hist_tags, windows[0], ACCIDENTAL_HISTORY)
+            history = chunk_history[c]
+            history_idx = chunk_history_idx[c]
+            if resume == 0:
+                history[:] = accidental_history
+                history_idx[:] = accidental_idx
+            else:
+                history[:] = -np.inf
+                history_idx[:] = 0
+            window_cycles = np.empty(offset_data[c + 1] - resume, dtype=np.float64)
+            window_is_1 = np.empty(offset_data[c + 1] - resume, dtype=np.bool_)
+            n_before = 0
+            n_window_tags = 0
+            for i in range(resume, offset_data[c + 1]):
+                if in_center_window(hist_tags[i], is_1[i], windows[0]):
+                    window_cycles[n_window_tags] = minor_cycle[i]
+                    window_is_1[n_window_tags] = is_1[i]
+                    n_window_tags += 1
+                    if i < start:
+                        n_before += 1
+            # replay the tags before the chunk only to rebuild the rings
+            accidental_scan(
+                window_cycles,
+                window_is_1,
+                n_before,
+                accidental_offsets,
+                history,
+                history_idx,
+                np.zeros(n_offsets, dtype=np.int64),
+            )
+            accidental_scan(
+                window_cycles[n_before:],
+                window_is_1[n_before:],
+                n_window_tags - n_before,
+                accidental_offsets,
+                history,
+                history_idx,
+                chunk_accidentals[c],
+            )
+
+        full_coinc_idx = st.full_coinc_idx
+        coinc_idx = st.coinc_idx
+        for c in range(n_chunks):
+            start = offset_data[c]
+            for j in range(start, start + n_full[c]):
+                full_coinc_1[full_coinc_idx & mask] = encode_position(
+                    full_1[j], position_scale, position_max
+                )
+                full_coinc_2[full_coinc_idx & mask] = encode_position(
+                    full_2[j], position_scale, position_max
+                )
+                full_coinc_idx += 1
+            for j in range(start, start + n_center[c]):
+                coinc_1[coinc_idx & mask] = encode_position(
+                    center_1[j], position_scale, position_max
+                )
+                coinc_2[coinc_idx & mask] = encode_position(
+                    center_2[j], position_scale, position_max
+                )
+                coinc_idx += 1
+
+        for c in range(n_chunks):
+            hist_counts += chunk_counts[c]
+            window_counts += chunk_window_counts[c]
+            accidental_counts += chunk_accidentals[c]
+
+        cstate = coinc_state[n_chunks - 1]
+        st.buffer_cycle = cstate[0]
+        st.general_buffer_cycle = cstate[1]
+        st.general_buffer_tag_hist = cstate[2]
+        window_state[:] = chunk_window_state[n_chunks - 1]
+        accidental_history[:] = chunk_history[n_chunks - 1]
+        accidental_idx[:] = chunk_history_idx[n_chunks - 1]
+        st.coincidence += n_coincidence.sum()
+        st.coinc_idx = coinc_idx
+        st.full_coinc_idx = full_coinc_idx
+
+    if parallel:
+        kernel = numba.jit(nopython=True, nogil=True, cache=True, parallel=True)(
+            parallel_kernel
+        )
+    else:
+        kernel = numba.jit(nopython=True, nogil=True, cache=True)(sequential_kernel)
+    KERNELS[key] = kernel
+    return kernel
@@ -0,0 +1,242 @@
+import os
+import re
+import sys
+import yaml
+import numpy as np
+import TimeTagger
+from concurrent.futures import ThreadPoolExecutor
+
+from CustomPLLHistogram import (
+    CustomPLLHistogram,
+    TAG_DTYPE,
+    HIST_1,
+    HIST_2,
+    merge_phase_stats,
+)
+
+
+"""
+Offline tuning of the PLL loop filter gains.
+
+Replays a clock and data tag stream, recorded in a .ttbin file or from the synthetic
+jitter model in benchmarks, through CustomPLLHistogram for every (deriv, prop) pair of
+a grid. Each pair is scored by its time to lock, the rms phase error of the clocks once
+locked, from the statistics the kernel keeps and the GUI shows, and the FWHM of the data
+histograms, over the frames taken in lock. The kernels release the GIL, so the pairs run
+on all cores from a thread pool. The best gains go into the PLL section of
+UI_params.yaml, which startPLL reads.
+
+startPLL divides the clock channel by clock_divider on the tagger. A recording made
+while the GUI runs holds the divided clock already. One made without the divider holds
+every clock edge, and the tuner divides it the same way in software.
+
+    python pll_tuner.py [recording.ttbin]
+"""
+
+DERIVS = (50, 100, 200, 400, 800)
+PROPS = (1e-13, 3e-13, 9e-13, 3e-12, 9e-12)
+
+
+def load_ttbin(filename, channels, n_events=1000000):
+    """The tags of channels in a .ttbin recording, as TAG_DTYPE records."""
+    reader = TimeTagger.FileReader(filename)
+    parts = []
+    while reader.hasData():
+        buffer = reader.getData(n_events)
+        part = np.zeros(buffer.size, dtype=TAG_DTYPE)
+        part["channel"] = buffer.getChannels()
+        part["time"] = buffer.getTimestamps()
+        parts.append(part[np.isin(part["channel"], channels)])
+    return np.concatenate(parts)
+
+
+def divide_clock(tags, clock_channel, divider, clock_period):
+    """
+    Keep every divider-th clock tag, as the event divider of the tagger does, if the
+    clocks in tags are clock_period / divider apart, not divided yet.
+    """
+    clock = tags["channel"] == clock_channel
+    spacing = np.median(np.diff(tags["time"][clock]))
+    if divider <= 1 or abs(spacing * divider / clock_period - 1) > 0.1:
+        return tags
+    keep = ~clock
+    keep[np.flatnonzero(clock)[::divider]] = True
+    return tags[keep]
+
+
+def split_blocks(tags, block_duration):
+    """Split a stream into consecutive blocks, like the backend does for process()."""
+    edges = np.arange(tags["time"][0], tags["time"][-1] + block_duration, block_duration)
+    cuts = np.searchsorted(tags["time"], edges[1:])
+    return [block for block in np.split(tags, cuts) if len(block)]
+
+
+def fwhm(counts, bin_edges):
+    """Full width at half maximum of the highest peak, interpolated between bins."""
+    peak = np.argmax(counts)
+    half = counts[peak] / 2
+    if half == 0:
+        return np.nan
+    left = peak
+    while left > 0 and counts[left - 1] > half:
+        left -= 1
+    right = peak
+    while right < len(counts) - 1 and counts[right + 1] > half:
+        right += 1
+    if left == 0 or right == len(counts) - 1:
+        return np.nan  # the peak runs off the histogram
+    centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    x_left = np.interp(half, counts[left - 1 : left + 1], centers[left - 1 : left + 1])
+    x_right = np.interp(
+        half, counts[right : right + 2][::-1], centers[right : right + 2][::-1]
+    )
+    return x_right - x_left
+
+
+def score(blocks, channels, deriv, prop, mult, tagger, bin_width=0.5):
+    """
+    Replays the blocks through the PLL with these gains. Returns (time to lock in s,
+    fraction of the frames in lock, rms phase error in ps, mean FWHM of both channels in
+    ps), with the last two over the frames in lock. The rms phase error is the std of
+    phase_error(), as the GUI shows it.
+    """
+    data_channel_1, data_channel_2, clock_channel = channels
+    pll = CustomPLLHistogram(
+        tagger,
+        data_channel_1,
+        data_channel_2,
+        clock_channel,
+        mult=mult,
+        phase=0,
+        deriv=deriv,
+        prop=prop,
+        n_bins=max(len(b) for b in blocks),
+        bin_width=bin_width,
+    )
+    histograms = np.zeros((2, pll.n_hist_bins), dtype=np.int64)
+    phase_stats = None
+    n_locked = 0
+    for block in blocks:
+        pll.process(block, 0, 0)
+        # process() ran on this thread, so getData() must not wait for more clocks
+        data = pll.getData(min_clocks=0)
+        if not pll.frame_locked:
+            continue
+        n_locked += 1
+        phase_stats = merge_phase_stats(phase_stats, pll.frame_phase_stats)
+        histograms += data[12][[HIST_1, HIST_2]]
+    time_to_lock = pll.time_to_lock()
+    bin_edges = pll.hist_bin_edges
+    del pll
+    locked = n_locked / len(blocks)
+    if phase_stats is None or phase_stats["phase_count"] < 2:
+        return time_to_lock, locked, np.nan, np.nan
+    rms = np.sqrt(phase_stats["phase_m2"] / (phase_stats["phase_count"] - 1))
+    width = np.mean([fwhm(h, bin_edges) for h in histograms])
+    return time_to_lock, locked, rms, width
+
+
+def tune(
+    tags,
+    channels,
+    mult,
+    derivs=DERIVS,
+    props=PROPS,
+    block_duration=1e10,
+    min_locked=0.9,
+    n_workers=None,
+):
+    """
+    Scores every (deriv, prop) pair on the tag stream, on n_workers threads (all cores by
+    default). Returns the rows (deriv, prop, time to lock, locked fraction, rms phase
+    error, FWHM), best first: the narrowest histograms among the pairs in lock for at
+    least min_locked of the frames, then the lowest error.
+    """
+    blocks = split_blocks(tags, block_duration)
+    grid = [(deriv, prop) for deriv in derivs for prop in props]
+    # the measurements only need a tagger to be created on, process() gets the blocks
+    tagger = TimeTagger.createTimeTaggerVirtual()
+    try:
+        with ThreadPoolExecutor(n_workers or os.cpu_count()) as pool:
+            scores = list(
+                pool.map(lambda g: score(blocks, channels, g[0], g[1], mult, tagger), grid)
+            )
+    finally:
+        TimeTagger.freeTimeTagger(tagger)
+    rows = [grid_point + result for grid_point, result in zip(grid, scores)]
+    return sorted(
+        rows,
+        key=lambda r: (
+            r[3] < min_locked,
+            np.nan_to_num(r[5], nan=np.inf),
+            np.nan_to_num(r[4], nan=np.inf),
+        ),
+    )
+
+
+def write_config(deriv, prop, filename="./UI_params.yaml"):
+    """Sets deriv and prop in the PLL section of the config, keeping its comments."""
+    with open(filename, "r", encoding="utf8") as stream:
+        text = stream.read()
+    section = re.search(r"^PLL:\n(?:[ #].*\n|\n)*", text, re.MULTILINE)
+    assert section, f"no PLL section in {filename}"
+    block = section.group(0)
+    for key, value in (("deriv", deriv), ("prop", prop)):
+        # yaml only reads 9e-13 as a number with a decimal point, 9.0e-13
+        value = repr(float(value))
+        if "e" in value and "." not in value:
+            value = value.replace("e", ".0e")
+        block = re.sub(rf"^(  {key}: )\S+", rf"\g<1>{value}", block, flags=re.MULTILINE)
+    with open(filename, "w", encoding="utf8") as stream:
+        stream.write(text[: section.start()] + block + text[section.end() :])
+
+
+def main(ttbin=None, write=True):
+    with open("./UI_params.yaml", "r", encoding="utf8") as stream:
+        params = yaml.safe_load(stream)
+    mult = int(params["PLL"]["mult"])
+    if ttbin is None:
+        from benchmarks.synthetic_tags import (
+            make_tag_stream,
+            CLOCK_CHANNEL,
+            DATA_CHANNEL_1,
+            DATA_CHANNEL_2,
+            MULT,
+        )
+
+        print("No recording given, tuning on the synthetic jitter model")
+        mult = MULT
+        channels = (DATA_CHANNEL_1, DATA_CHANNEL_2, CLOCK_CHANNEL)
+        tags = make_tag_stream(
+            0.2e12, singles_rate=2e6, pair_fraction=0.05, clock_wander=1.0
+        )
+    else:
+        channels = (
+            params["Channels"]["ChA"]["channel"],
+            params["Channels"]["ChB"]["channel"],
+            params["Channels"]["ChC"]["channel"],
+        )
+        tags = load_ttbin(ttbin, channels)
+        tags = divide_clock(
+            tags,
+            channels[2],
+            int(params["PLL"]["clock_divider"]),
+            float(params["PLL"]["clock_period"]),
+        )
+
+    rows = tune(tags, channels, mult)
+    print("   deriv      prop   lock (ms)   locked   rms error (ps)   FWHM (ps)")
+    for deriv, prop, time_to_lock, locked, rms, width in rows:
+        print(
+            f"{deriv:8g} {prop:9.2e} {time_to_lock * 1e3:11.2f} {locked:8.0%} "
+            f"{rms:16.2f} {width:11.2f}"
+        )
+    deriv, prop = rows[0][:2]
+    print(f"best: deriv={deriv}, prop={prop}")
+    if write:
+        write_config(deriv, prop)
+        print("written to UI_params.yaml")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
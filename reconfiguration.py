@@ -0,0 +1,105 @@
+"""
+Debounced reconfiguration of the measurements from the settings widgets.
+
+Every valueChanged of a spin box used to rebuild all measurements and plots, so dragging
+a delay spinner rebuilt them dozens of times. ReconfigurationManager collects the signals
+of a burst of changes and applies them once, delay_ms after the last one, and keeps the
+settings applied last, so only the ones that changed are pushed to the tagger.
+"""
+
+MISSING = object()
+INPUTS = "ABCD"
+
+
+class ReconfigurationManager:
+    """
+    Calls apply() once delay_ms after the last request(). apply reads the settings and
+    passes them to changes(), which returns the ones that differ from the last call.
+    With delay_ms=None every request() applies right away, without a Qt event loop.
+    """
+
+    def __init__(self, apply, delay_ms=200):
+        self.apply = apply
+        self.applied = {}
+        self.previous = {}
+        self.timer = None
+        if delay_ms is not None:
+            # the debounce timer is the only part that needs Qt
+            from PyQt5.QtCore import QTimer
+
+            self.timer = QTimer()
+            self.timer.setSingleShot(True)
+            self.timer.setInterval(delay_ms)
+            self.timer.timeout.connect(self.flush)
+
+        # requests, and the applies they were coalesced into
+        self.requests = 0
+        self.applies = 0
+
+    def request(self, *args):
+        """Slot for the signals of the settings widgets, restarts the debounce window."""
+        self.requests += 1
+        if self.timer is None:
+            self.flush()
+        else:
+            self.timer.start()
+
+    def flush(self):
+        """Apply the pending changes now."""
+        if self.timer is not None:
+            self.timer.stop()
+        self.applies += 1
+        self.apply()
+
+    def changes(self, settings, force=False):
+        """
+        The entries of the settings dict that differ from the ones passed last time, all
+        of them with force. settings count as applied from then on, the ones they replace
+        stay in previous.
+        """
+        if force:
+            changed = dict(settings)
+        else:
+            changed = {
+                key: value
+                for key, value in settings.items()
+                if self.applied.get(key, MISSING) != value
+            }
+        self.previous = self.applied
+        self.applied = dict(settings)
+        return changed
+
+
+def apply_input_settings(tagger, settings, changes, previous=None):
+    """
+    Push the delay, trigger level, dead time and test signal of the inputs A to D to
+    their tagger channels. Several inputs can share a channel (the UI_params defaults map
+    C and D to 9), and then the last of them wins, as when every input was applied. So
+    the settings go out per channel: a change to any input of a channel, or an input
+    moving onto or off it, re-applies all inputs mapped to it in order.
+    Returns the channels of the inputs in use, and whether anything was pushed.
+    """
+    previous = previous or {}
+    active_channels = []
+    dirty = set()
+    for name in INPUTS:
+        channel = settings[f"{name}.channel"]
+        if channel != 0:
+            active_channels.append(channel)
+        if any(key.startswith(f"{name}.") for key in changes):
+            dirty.add(channel)
+            dirty.add(previous.get(f"{name}.channel", channel))
+    dirty.discard(0)
+
+    for name in INPUTS:
+        channel = settings[f"{name}.channel"]
+        if channel not in dirty:
+            continue
+        tagger.setInputDelay(channel, settings[f"{name}.delay"])
+        tagger.setTriggerLevel(channel, settings[f"{name}.trigger"])
+        tagger.setDeadtime(channel, settings[f"{name}.dead_time"])
+        tagger.setDeadtime(channel * -1, settings[f"{name}.dead_time"])
+        tagger.setInputImpedanceHigh(channel, False)
+        if f"{name}.test_signal" in settings:
+            tagger.setTestSignal(channel, settings[f"{name}.test_signal"])
+    return active_channels, bool(dirty)
@@ -0,0 +1,60 @@
+import numpy as np
+
+"""
+Integration of the per frame histograms of the GUI over the last IntTime seconds.
+
+Summing the whole block of frames every frame costs the integration time. RollingIntegrator
+keeps the rows of the window in a ring and a running sum of them: a frame adds its row and
+subtracts the one it evicts, so the cost per frame doesn't depend on the window length.
+"""
+
+
+class RollingIntegrator:
+    """
+    Sums over the last n_rows rows added, of rows of the given shape.
+
+    rolling() is the sum of the last n_rows rows, discrete() the sum over the last whole
+    window of n_rows rows, counted from the first row, and the rolling sum until one is
+    complete. Float rows are summed again from the ring once per window, so rounding
+    doesn't build up in the running sum.
+    """
+
+    def __init__(self, n_rows, shape=(), dtype=np.int64):
+        self.rows = np.zeros((n_rows,) + tuple(shape), dtype=dtype)
+        self.total = np.zeros(shape, dtype=dtype)
+        self.window_total = None
+        self.index = 0
+        self.filled = 0
+
+    def add(self, row):
+        evicted = self.rows[self.index]
+        self.total -= evicted
+        self.total += row
+        evicted[...] = row
+        self.index += 1
+        self.filled = min(self.filled + 1, len(self.rows))
+        if self.index == len(self.rows):
+            self.index = 0
+            if self.total.dtype.kind == "f":
+                self.rows.sum(axis=0, out=self.total)
+            if self.window_total is None:
+                self.window_total = np.copy(self.total)
+            else:
+                self.window_total[...] = self.total
+
+    def rolling(self):
+        return self.total
+
+    def discrete(self):
+        return self.total if self.window_total is None else self.window_total
+
+    def mean(self):
+        """rolling() over the rows added so far, at most n_rows"""
+        return self.total / max(self.filled, 1)
+
+    def clear(self):
+        self.rows[...] = 0
+        self.total[...] = 0
+        self.window_total = None
+        self.index = 0
+        self.filled = 0